@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+
+# Blob extraction backends: close the gaps in a binary image and find the
+# contours of the blobs that could be targets.
+#
+# ContourBlobs is the usual path: two dilations and two erosions with the
+# default 3x3 kernel, then findContours on the whole image, and every
+# contour goes to the contour filter. ComponentBlobs does the same closing
+# as one morphologyEx with a 5x5 kernel, labels the blobs with
+# connectedComponentsWithStats, and rejects the ones that cannot be targets
+# from their stats (pixel count and bounding box) with numpy, all at once.
+# Contours are only found for the few that are left, in their bounding box.
+#
+# The stats tests are looser than the contour filter's (a contour's area is
+# less than its box's, and not much less than its pixel count), and the
+# contour filter still runs on what is left, so the same targets are found.
+# The exceptions are blobs inside the holes of other blobs, which are also
+# found, and ragged blobs right at the fill limit (the comparison below
+# counts the frames where the targets differ).
+# The contours of the blobs rejected by their stats are never found, so
+# they are not drawn on the debug stream.
+#
+# Compare the two on a recording, as recorded and with noise added:
+#   ./blobs.py /home/pi/recordings/match1 --noise 0.01
+
+import sys
+import time
+import argparse
+import cv2
+import numpy as np
+
+BACKENDS = ['contours', 'components']
+
+CLOSE_KERNEL = cv2.getStructuringElement(cv2.MORPH_RECT, (5, 5)) # Same as 2 iterations of the 3x3 default
+
+def scratch(buffers, name, shape, dtype=np.uint8):
+    """Return a scratch image from buffers, or a new one without them."""
+    if buffers is None:
+        return np.empty(shape, dtype=dtype)
+    return buffers.get(name, shape, dtype)
+
+class ContourBlobs:
+    """Dilates and erodes twice, and finds the contours of the whole image."""
+    def close(self, binary_img, timer, buffers=None):
+        # Closing (fill in any gaps), ending up back in the binary image
+        closed_img = scratch(buffers, 'closed', binary_img.shape)
+        closed_img = cv2.dilate(binary_img, None, dst=closed_img, iterations=2)
+        binary_img = cv2.erode(closed_img, None, dst=binary_img, iterations=2)
+        timer.lap('morphology')
+        return binary_img
+
+    def find(self, binary_img, offset, timer, buffers=None):
+        """Return the contours in a closed binary image, and the counts of those rejected already."""
+        _, contour_list, _ = cv2.findContours(binary_img, mode=cv2.RETR_EXTERNAL,
+            method=cv2.CHAIN_APPROX_SIMPLE, offset=offset)
+        timer.lap('find_contours')
+        return contour_list, {}
+
+class ComponentBlobs:
+    """Closes once, and finds contours only of the connected components that could be targets."""
+    def __init__(self, contour_filter):
+        self.filter = contour_filter # Its limits are the ones the stats are tested against
+
+    def close(self, binary_img, timer, buffers=None):
+        closed_img = scratch(buffers, 'closed', binary_img.shape)
+        closed_img = cv2.morphologyEx(binary_img, cv2.MORPH_CLOSE, CLOSE_KERNEL, dst=closed_img)
+        timer.lap('morphology')
+        return closed_img
+
+    def find(self, binary_img, offset, timer, buffers=None):
+        labels = scratch(buffers, 'labels', binary_img.shape, np.int32)
+        count, labels, stats, _ = cv2.connectedComponentsWithStats(binary_img, labels,
+            connectivity=8, ltype=cv2.CV_32S)
+        timer.lap('components')
+
+        # The contour (through the edge pixels' centers) has less area than
+        # (w-1)*(h-1), and at least the pixel count less half the edge pixels
+        x, y, w, h, pixels = stats[1:].T # Label 0 is the background
+        box_areas = (w - 1) * (h - 1)
+        seen = box_areas >= self.filter.min_area
+        keep = seen & (box_areas > self.filter.target_area)
+        survivors = keep & (pixels - (w + h) < self.filter.max_fill * w * h)
+        rejected = {
+            'small': len(stats) - 1 - np.count_nonzero(seen),
+            'area': np.count_nonzero(seen) - np.count_nonzero(keep),
+            'bbox_fill': np.count_nonzero(keep) - np.count_nonzero(survivors),
+        }
+
+        # Contours of just the label in each survivor's box
+        contour_list = []
+        for i in np.flatnonzero(survivors):
+            x0, y0, x1, y1 = x[i], y[i], x[i] + w[i], y[i] + h[i]
+            mask = np.equal(labels[y0:y1, x0:x1], i + 1).view(np.uint8)
+            _, contours, _ = cv2.findContours(mask, mode=cv2.RETR_EXTERNAL,
+                method=cv2.CHAIN_APPROX_SIMPLE, offset=(int(x0) + offset[0], int(y0) + offset[1]))
+            contour_list.extend(contours)
+        timer.lap('find_contours')
+        return contour_list, rejected
+
+def make_blobs(kind, contour_filter, current=None):
+    """Make a blob extraction backend, or return current if it is already that kind."""
+    if kind == 'components':
+        if isinstance(current, ComponentBlobs) and current.filter is contour_filter:
+            return current
+        return ComponentBlobs(contour_filter)
+    if kind != 'contours':
+        print("unknown blob extraction '{}', using 'contours'".format(kind), file=sys.stderr)
+    if isinstance(current, ContourBlobs):
+        return current
+    return ContourBlobs()
+
+if __name__ == "__main__":
+    from recorder import Recording
+    from frame_buffers import FrameBuffers
+    from segmentation import HsvSegmenter
+    from contour_filter import ContourFilter
+    import perf
+
+    parser = argparse.ArgumentParser(description='Compare the blob extraction backends on a recording')
+    parser.add_argument('recording')
+    parser.add_argument('--noise', type=float, default=0.01,
+        help='fraction of pixels set at random in the noisy scene')
+    parser.add_argument('--lower', nargs=3, type=int, default=[55, 255, 40])
+    parser.add_argument('--upper', nargs=3, type=int, default=[65, 255, 255])
+    args = parser.parse_args()
+
+    recording = Recording(args.recording)
+    segmenter = HsvSegmenter(args.lower, args.upper)
+    contour_filter = ContourFilter() # The same limits as peariscope_pnp.py's TARGET_FILTER
+    backends = {kind: make_blobs(kind, contour_filter) for kind in BACKENDS}
+    buffers = {kind: FrameBuffers() for kind in BACKENDS}
+    rng = np.random.RandomState(0)
+
+    for scene in ['clean', 'noisy']:
+        times = dict.fromkeys(BACKENDS, 0)
+        blob_counts = dict.fromkeys(BACKENDS, 0)
+        mismatched = 0
+        for frame in recording.frames:
+            binary_img = segmenter.threshold(np.array(frame), perf.NULL_TIMER)
+            if scene == 'noisy':
+                binary_img[rng.random_sample(binary_img.shape) < args.noise] = 255
+            centers = {}
+            for kind in BACKENDS:
+                img = binary_img.copy() # The closing writes over it
+                start_time = time.perf_counter()
+                closed_img = backends[kind].close(img, perf.NULL_TIMER, buffers[kind])
+                contour_list, _ = backends[kind].find(closed_img, (0, 0), perf.NULL_TIMER, buffers[kind])
+                _, targets, _ = contour_filter.apply(contour_list)
+                times[kind] += time.perf_counter() - start_time
+                blob_counts[kind] += len(contour_list)
+                centers[kind] = sorted((round(c[0], 1), round(c[1], 1)) for _, c, _ in targets)
+            mismatched += centers['contours'] != centers['components']
+
+        count = len(recording)
+        print('{} scene:'.format(scene))
+        for kind in BACKENDS:
+            print('  {}: {:.2f} ms/frame, {:.1f} contours/frame to filter'.format(
+                kind, times[kind] / count * 1000, blob_counts[kind] / count))
+        print('  frames with different targets: {}'.format(mismatched))
@@ -1,122 +1,253 @@
 # All Credit goes to Github user JackToaster (Discord: A Toaster#9900) for providing this script
 
+# Interactive calibration reads the camera stream and asks before using each
+# view of the board. Batch calibration (--images DIR or --video FILE) runs
+# headless: the board is looked for in every image in a process pool, first
+# in a downscaled copy (so images without it are skipped quickly) and then
+# refined at full resolution. The views whose reprojection error is far above
+# the others' are dropped and the camera is calibrated again without them.
+#   ./calibrate.py --images shots/ -o calibration/<camera name>_640x480.yml
+#   ./calibrate.py --video board.mp4 --step 5 -o calibration/<camera name>_640x480.yml
+
+import os
+import sys
+import time
 import argparse
+import multiprocessing
 import numpy as np
 import cv2
 
-parser = argparse.ArgumentParser(description='Calibrate a camera')
-parser.add_argument('--resolution', '-r', nargs=2)
-parser.add_argument('--camera', '-c', default=0)
-parser.add_argument('--gridsize', '-g', default=0.0254)  # Default to 1 inch grid
-parser.add_argument('--output', '-o')
-
-parsed = parser.parse_args()
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # For "import undistort"
+from camera_calibration import CameraCalibration
+from undistort import Undistorter
 
 CAMERA_MATRIX_NAME = 'camera_matrix'
 DISTORTION_COEFFICIENTS_NAME = 'distortion_coefficients'
+IMAGE_WIDTH_NAME = 'image_width'
+IMAGE_HEIGHT_NAME = 'image_height'
 
-WRITE_PATH = parsed.output
-
-GRID_SQUARE_SIZE = float(parsed.gridsize)
-
-RESOLUTION = tuple([int(res) for res in parsed.resolution])
-
-# Create video capture
-cap = cv2.VideoCapture('http://frcvision.local:1181/stream.mjpg')
-
-cap.set(cv2.CAP_PROP_FRAME_WIDTH, RESOLUTION[0])
-cap.set(cv2.CAP_PROP_FRAME_HEIGHT, RESOLUTION[1])
+BOARD_SIZE = (7, 6) # Inside corners of the chessboard
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+PRECHECK_WIDTH = 320 # Width of the downscaled copy the board is first looked for in (half of 640x480)
+OUTLIER_MADS = 3.0 # Views this many median absolute deviations above the median error are dropped
+MIN_VIEWS = 10
 
 # termination criteria
 criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.001)
-# prepare object points, like (0,0,0), (1,0,0), (2,0,0) ....,(6,5,0)
-objp = np.zeros((6*7,3), np.float32)
-objp[:,:2] = np.mgrid[0:7,0:6].T.reshape(-1,2)
-
-# Scale to real grid size
-objp = np.multiply(objp, GRID_SQUARE_SIZE)
-
-# Arrays to store object points and image points from all the images.
-objpoints = [] # 3d point in real world space
-imgpoints = [] # 2d points in image plane.
-
-ret, img = cap.read()
-if not ret:
-    raise Exception('Camera input failed to read')
-h, w = img.shape[:2]
-
-print('Searching for calibration checkerboard. Press q to calibrate once enough samples (usually 20-50) have been recorded.')
-
-while True:
-    _, img = cap.read()
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    # Find the chess board corners
-    ret, corners = cv2.findChessboardCorners(gray, (7, 6), None)
-    # If found, add object points, image points (after refining them)
-    if ret:
-        corners2 = cv2.cornerSubPix(gray, corners, (11, 11), (-1, -1), criteria)
-        # Draw and display the corners
-        cv2.drawChessboardCorners(img, (7, 6), corners2, ret)
-        cv2.putText(img, 'Calibrating - ' + str(len(objpoints)) + ' samples - press Q to stop', (5, 15),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255))
-        cv2.putText(img, 'Press Y/N to accept/reject sample', (5, 55), cv2.FONT_HERSHEY_SIMPLEX, 0.5,
-                    (0, 0, 255))
-        cv2.imshow('img', img)
-        key = cv2.waitKey(5000)
-        if key & 0xFF == ord('q'):
-            break
-        elif key & 0xFF == ord('y'):
-            objpoints.append(objp)
-            imgpoints.append(corners2)
-    else:
-        cv2.putText(img, 'Calibrating - ' + str(len(objpoints)) + ' samples - press Q to stop', (5, 15),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255))
-        cv2.imshow('img', img)
-    if cv2.waitKey(1) & 0xFF == ord('q'):
-        break
-
-cv2.destroyAllWindows()
-
-print('Computing camera calibration parameters. This may take a minute...')
-ret, mtx, dist, rvecs, tvecs = cv2.calibrateCamera(objpoints, imgpoints, gray.shape[::-1], None, None)
 
-print('camera_matrix = np.' + repr(mtx))
-print('distortion_coefficients = np.' + repr(dist))
-
-print('Saving to ' + WRITE_PATH)
-
-
-def write_calibration_file(path: str, camera_matrix, distortion_coefficients):
+def board_points(grid_size):
+    """Return the 3D corners of the board, like (0,0,0), (1,0,0), (2,0,0) ....,(6,5,0) times the grid size."""
+    objp = np.zeros((BOARD_SIZE[0] * BOARD_SIZE[1], 3), np.float32)
+    objp[:, :2] = np.mgrid[0:BOARD_SIZE[0], 0:BOARD_SIZE[1]].T.reshape(-1, 2)
+    return np.multiply(objp, grid_size)
+
+def find_board(img):
+    """Return the refined corners of the board in an image, or None if it is not there."""
+    gray = img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    scale = max(1.0, gray.shape[1] / PRECHECK_WIDTH)
+    small = gray if scale == 1 else cv2.resize(gray, None, fx=1/scale, fy=1/scale, interpolation=cv2.INTER_AREA)
+    scale = gray.shape[1] / small.shape[1] # As rounded to whole pixels
+    ret, corners = cv2.findChessboardCorners(small, BOARD_SIZE, None,
+        cv2.CALIB_CB_ADAPTIVE_THRESH + cv2.CALIB_CB_NORMALIZE_IMAGE + cv2.CALIB_CB_FAST_CHECK)
+    if not ret:
+        return None
+    corners = (corners + 0.5) * scale - 0.5 # Pixel centers of the downscaled copy in the full image
+    return cv2.cornerSubPix(gray, corners.astype(np.float32), (11, 11), (-1, -1), criteria)
+
+def find_board_in_file(path):
+    img = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        print("cannot read image '{}'".format(path))
+        return path, None, None
+    return path, find_board(img), img.shape[::-1]
+
+def find_board_in_frame(item):
+    name, img = item
+    return name, find_board(img), img.shape[::-1]
+
+def video_frames(path, step):
+    """Yield every step'th frame of a video (as grayscale, to send less to the workers)."""
+    cap = cv2.VideoCapture(path)
+    index = 0
+    while True:
+        ret, img = cap.read()
+        if not ret:
+            break
+        if index % step == 0:
+            yield 'frame {}'.format(index), cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        index += 1
+    cap.release()
+
+def find_boards(parsed):
+    """Find the board in the images or video of a batch; return the names, corners, and image size."""
+    with multiprocessing.Pool(parsed.processes) as pool:
+        if parsed.images:
+            paths = sorted(os.path.join(parsed.images, name) for name in os.listdir(parsed.images)
+                if name.lower().endswith(IMAGE_EXTENSIONS))
+            found = pool.imap(find_board_in_file, paths, chunksize=4)
+        else:
+            found = pool.imap(find_board_in_frame, video_frames(parsed.video, parsed.step), chunksize=4)
+        names, imgpoints, sizes = [], [], set()
+        count = 0
+        for name, corners, size in found:
+            count += 1
+            if corners is not None:
+                names.append(name)
+                imgpoints.append(corners)
+                sizes.add(size)
+    print('Found the board in {} of {} images'.format(len(imgpoints), count))
+    if len(sizes) > 1:
+        raise Exception('The images are not all the same size: {}'.format(sorted(sizes)))
+    return names, imgpoints, sizes.pop() if sizes else None
+
+def reprojection_errors(objpoints, imgpoints, rvecs, tvecs, mtx, dist):
+    """Return the RMS reprojection error (pixels) of each view."""
+    projected = np.array([cv2.projectPoints(objp, rvec, tvec, mtx, dist)[0]
+        for objp, rvec, tvec in zip(objpoints, rvecs, tvecs)])
+    squared = np.sum((projected - np.array(imgpoints)) ** 2, axis=-1)
+    return np.sqrt(np.mean(squared.reshape(len(imgpoints), -1), axis=1))
+
+def calibrate_batch(parsed, objp):
+    """Calibrate from a batch, dropping the outlying views; return the matrix, distortion, and image size."""
+    start_time = time.perf_counter()
+    names, imgpoints, image_size = find_boards(parsed)
+    print('Detection took {:.1f} s'.format(time.perf_counter() - start_time))
+    if len(imgpoints) < MIN_VIEWS:
+        raise Exception('Need at least {} views of the board, found {}'.format(MIN_VIEWS, len(imgpoints)))
+
+    objpoints = [objp] * len(imgpoints)
+    ret, mtx, dist, rvecs, tvecs = cv2.calibrateCamera(objpoints, imgpoints, image_size, None, None)
+    errors = reprojection_errors(objpoints, imgpoints, rvecs, tvecs, mtx, dist)
+    median = np.median(errors)
+    limit = median + OUTLIER_MADS * 1.4826 * np.median(np.abs(errors - median))
+    keep = errors <= limit
+    print('RMS error {:.3f} px with all {} views, dropping {} over {:.3f} px'.format(
+        ret, len(imgpoints), np.count_nonzero(~keep), limit))
+    for name, error in zip(names, errors):
+        if error > limit:
+            print('  {}: {:.3f} px'.format(name, error))
+
+    if np.count_nonzero(~keep) > 0 and np.count_nonzero(keep) >= MIN_VIEWS:
+        imgpoints = [corners for corners, kept in zip(imgpoints, keep) if kept]
+        objpoints = [objp] * len(imgpoints)
+        ret, mtx, dist, rvecs, tvecs = cv2.calibrateCamera(objpoints, imgpoints, image_size, None, None)
+        print('RMS error {:.3f} px with {} views'.format(ret, len(imgpoints)))
+    print('Calibration took {:.1f} s'.format(time.perf_counter() - start_time))
+    return mtx, dist, image_size
+
+def write_calibration_file(path: str, camera_matrix, distortion_coefficients, image_size):
     fs = cv2.FileStorage(path, cv2.FILE_STORAGE_WRITE)
     fs.write(CAMERA_MATRIX_NAME, camera_matrix)
     fs.write(DISTORTION_COEFFICIENTS_NAME, distortion_coefficients)
+    fs.write(IMAGE_WIDTH_NAME, image_size[0])
+    fs.write(IMAGE_HEIGHT_NAME, image_size[1])
+    fs.release()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Calibrate a camera')
+    parser.add_argument('--resolution', '-r', nargs=2)
+    parser.add_argument('--camera', '-c', default=0)
+    parser.add_argument('--gridsize', '-g', default=0.0254)  # Default to 1 inch grid
+    parser.add_argument('--output', '-o')  # e.g. calibration/<camera name>_640x480.yml (see camera_calibration.py)
+    parser.add_argument('--images', '-i', metavar='DIR', help='calibrate from a directory of images, headless')
+    parser.add_argument('--video', '-v', metavar='FILE', help='calibrate from a recorded video, headless')
+    parser.add_argument('--step', type=int, default=1, help='use every step\'th frame of the video')
+    parser.add_argument('--processes', '-p', type=int, default=os.cpu_count())
+
+    parsed = parser.parse_args()
+
+    WRITE_PATH = parsed.output
+
+    GRID_SQUARE_SIZE = float(parsed.gridsize)
+
+    # Scale to real grid size
+    objp = board_points(GRID_SQUARE_SIZE)
+
+    if parsed.images or parsed.video:
+        mtx, dist, image_size = calibrate_batch(parsed, objp)
+        print('camera_matrix = np.' + repr(mtx))
+        print('distortion_coefficients = np.' + repr(dist))
+        if WRITE_PATH:
+            print('Saving to ' + WRITE_PATH)
+            write_calibration_file(WRITE_PATH, mtx, dist, image_size)
+        raise SystemExit
+
+    RESOLUTION = tuple([int(res) for res in parsed.resolution])
+
+    # Create video capture
+    cap = cv2.VideoCapture('http://frcvision.local:1181/stream.mjpg')
+
+    cap.set(cv2.CAP_PROP_FRAME_WIDTH, RESOLUTION[0])
+    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, RESOLUTION[1])
+
+    # Arrays to store object points and image points from all the images.
+    objpoints = [] # 3d point in real world space
+    imgpoints = [] # 2d points in image plane.
+
+    ret, img = cap.read()
+    if not ret:
+        raise Exception('Camera input failed to read')
+    h, w = img.shape[:2]
+
+    print('Searching for calibration checkerboard. Press q to calibrate once enough samples (usually 20-50) have been recorded.')
+
+    while True:
+        _, img = cap.read()
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        # Find the chess board corners
+        ret, corners = cv2.findChessboardCorners(gray, BOARD_SIZE, None)
+        # If found, add object points, image points (after refining them)
+        if ret:
+            corners2 = cv2.cornerSubPix(gray, corners, (11, 11), (-1, -1), criteria)
+            # Draw and display the corners
+            cv2.drawChessboardCorners(img, BOARD_SIZE, corners2, ret)
+            cv2.putText(img, 'Calibrating - ' + str(len(objpoints)) + ' samples - press Q to stop', (5, 15),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255))
+            cv2.putText(img, 'Press Y/N to accept/reject sample', (5, 55), cv2.FONT_HERSHEY_SIMPLEX, 0.5,
+                        (0, 0, 255))
+            cv2.imshow('img', img)
+            key = cv2.waitKey(5000)
+            if key & 0xFF == ord('q'):
+                break
+            elif key & 0xFF == ord('y'):
+                objpoints.append(objp)
+                imgpoints.append(corners2)
+        else:
+            cv2.putText(img, 'Calibrating - ' + str(len(objpoints)) + ' samples - press Q to stop', (5, 15),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255))
+            cv2.imshow('img', img)
+        if cv2.waitKey(1) & 0xFF == ord('q'):
+            break
 
+    cv2.destroyAllWindows()
 
-write_calibration_file(WRITE_PATH, mtx, dist)
+    print('Computing camera calibration parameters. This may take a minute...')
+    ret, mtx, dist, rvecs, tvecs = cv2.calibrateCamera(objpoints, imgpoints, gray.shape[::-1], None, None)
 
-# Calculate how accurate the calibration was (Reprojection error)
-mean_error = 0
-for i in range(len(objpoints)):
-    imgpoints2, _ = cv2.projectPoints(objpoints[i], rvecs[i], tvecs[i], mtx, dist)
-    error = cv2.norm(imgpoints[i], imgpoints2, cv2.NORM_L2)/len(imgpoints2)
-    mean_error += error
+    print('camera_matrix = np.' + repr(mtx))
+    print('distortion_coefficients = np.' + repr(dist))
 
-print("reprojection_error = {}".format(mean_error/len(objpoints)))
+    print('Saving to ' + WRITE_PATH)
 
-print('Showing undistorted image. Press q to exit.')
+    write_calibration_file(WRITE_PATH, mtx, dist, gray.shape[::-1])
 
-new_camera_mtx, roi = cv2.getOptimalNewCameraMatrix(mtx, dist, (w, h), 1, (w, h))
+    # Calculate how accurate the calibration was (Reprojection error)
+    errors = reprojection_errors(objpoints, imgpoints, rvecs, tvecs, mtx, dist)
+    print("reprojection_error = {}".format(np.mean(errors)))
 
-while True:
-    _, img = cap.read()
-    # undistort
-    dst = cv2.undistort(img, mtx, dist, None, new_camera_mtx)
-    # crop the image
-    # x, y, w, h = roi
-    # dst = dst[y:y + h, x:x + w]
+    print('Showing undistorted image. Press q to exit.')
 
-    cv2.putText(dst, 'Undistorted', (5, 15), cv2.FONT_HERSHEY_SIMPLEX, 0.5,
-                (0, 0, 255))
-    cv2.imshow('img', dst)
-    if cv2.waitKey(1) & 0xFF == ord('q'):
-        break
\ No newline at end of file
+    # The remap tables are built once (and saved next to the calibration file)
+    undistorter = Undistorter(CameraCalibration(mtx, dist, w, h, WRITE_PATH), alpha=1)
+    dst = np.empty((h, w, 3), dtype=np.uint8)
+
+    while True:
+        _, img = cap.read()
+        # undistort
+        dst = undistorter.undistort(img, dst)
+
+        cv2.putText(dst, 'Undistorted', (5, 15), cv2.FONT_HERSHEY_SIMPLEX, 0.5,
+                    (0, 0, 255))
+        cv2.imshow('img', dst)
+        if cv2.waitKey(1) & 0xFF == ord('q'):
+            break
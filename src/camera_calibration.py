@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+# Camera calibrations written by calibration/calibrate.py.
+#
+# Calibration files live in the calibration folder, named after the camera
+# (as in /boot/frc.json) and the resolution they were made at, e.g.
+#   calibration/Peariscope_640x480.yml
+# The file for the camera's resolution is used if there is one. Otherwise a
+# file for the camera at another resolution (or the original
+# calibration/output file) is rescaled to the stream resolution.
+#
+# Only the target corners are undistorted here, with cv2.undistortPoints
+# straight to normalized camera coordinates (normalize_points), which
+# solvePnP then takes with an identity camera matrix (see pose.py). That
+# covers what rays through a precomputed inverse camera matrix would, and
+# the distortion as well, so there is no inverse matrix. See undistort.py
+# for whole frames.
+
+import os
+import re
+import sys
+import cv2
+import numpy as np
+
+CALIBRATION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'calibration')
+DEFAULT_CALIBRATION_FILE = os.path.join(CALIBRATION_DIR, 'output')
+DEFAULT_CALIBRATION_SIZE = (640, 480) # For files written before the resolution was saved
+
+CAMERA_MATRIX_NAME = 'camera_matrix'
+DISTORTION_COEFFICIENTS_NAME = 'distortion_coefficients'
+IMAGE_WIDTH_NAME = 'image_width'
+IMAGE_HEIGHT_NAME = 'image_height'
+CALIBRATION_SIZE = r'_(\d+)x(\d+)' # After the camera name, e.g. Peariscope_640x480.yml
+CALIBRATION_EXTENSIONS = r'\.(yml|yaml|xml)' # The FileStorage formats calibrate.py writes
+
+class CameraCalibration:
+    """A camera matrix and distortion coefficients for one resolution."""
+    def __init__(self, camera_matrix, distortion_coeffs, width, height, path=None):
+        self.camera_matrix = np.array(camera_matrix, dtype=np.float64)
+        self.distortion_coeffs = np.array(distortion_coeffs, dtype=np.float64).reshape(1, -1)
+        self.width = width
+        self.height = height
+        self.path = path
+
+    def scaled(self, width, height):
+        """Return this calibration for a stream of a different resolution."""
+        if (width, height) == (self.width, self.height):
+            return self
+        sx, sy = width / self.width, height / self.height
+        if abs(sx - sy) > 0.01:
+            print("calibration {} is {}x{} but the stream is {}x{} (a different aspect ratio)".format(
+                self.path, self.width, self.height, width, height), file=sys.stderr)
+        camera_matrix = self.camera_matrix.copy()
+        camera_matrix[0, :] *= sx # fx, skew, cx
+        camera_matrix[1, :] *= sy # fy, cy
+        return CameraCalibration(camera_matrix, self.distortion_coeffs, width, height, self.path)
+
+    def normalize_points(self, points):
+        """Undistort pixel points into normalized camera coordinates, shape (N, 1, 2)."""
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 1, 2)
+        return cv2.undistortPoints(points, self.camera_matrix, self.distortion_coeffs)
+
+def read_calibration_file(path):
+    """Read a calibration file written by calibrate.py."""
+    fs = cv2.FileStorage(path, cv2.FileStorage_READ)
+    if not fs.isOpened():
+        raise ValueError("Calibration file '{}' does not exist or cannot be opened".format(path))
+    camera_matrix = fs.getNode(CAMERA_MATRIX_NAME).mat()
+    distortion_coeffs = fs.getNode(DISTORTION_COEFFICIENTS_NAME).mat()
+    width, height = DEFAULT_CALIBRATION_SIZE
+    if not fs.getNode(IMAGE_WIDTH_NAME).empty():
+        width = int(fs.getNode(IMAGE_WIDTH_NAME).real())
+        height = int(fs.getNode(IMAGE_HEIGHT_NAME).real())
+    fs.release()
+    return CameraCalibration(camera_matrix, distortion_coeffs, width, height, path)
+
+def find_calibration_file(camera_name, width, height, directory=CALIBRATION_DIR):
+    """Return the best calibration file for a camera, or None."""
+    # <camera>_<width>x<height>.yml (or .yaml, .xml) only, so not another
+    # camera whose name starts the same (Peariscope_2_640x480.yml is not
+    # Peariscope's), and not the undistortion tables saved next to the files
+    # or their temporary files (see undistort.py)
+    pattern = re.compile(re.escape(camera_name) + CALIBRATION_SIZE + CALIBRATION_EXTENSIONS)
+    names = sorted(os.listdir(directory)) if os.path.isdir(directory) else []
+    files = {} # (width, height) -> path, the first by name for each size
+    for file_name in names:
+        match = pattern.fullmatch(file_name)
+        if match is not None:
+            files.setdefault((int(match.group(1)), int(match.group(2))), os.path.join(directory, file_name))
+    if (width, height) in files:
+        return files[(width, height)]
+    if len(files) > 0:
+        return next(iter(files.values()))
+    if os.path.exists(DEFAULT_CALIBRATION_FILE):
+        return DEFAULT_CALIBRATION_FILE
+    return None
+
+def load_calibration(camera_name, width, height, directory=CALIBRATION_DIR):
+    """Load the calibration for a camera, scaled to the stream resolution."""
+    path = find_calibration_file(camera_name, width, height, directory)
+    if path is None:
+        raise ValueError("No calibration file for camera '{}' in {}".format(camera_name, directory))
+    calibration = read_calibration_file(path)
+    print("Using calibration {} ({}x{}) for camera '{}' at {}x{}".format(
+        path, calibration.width, calibration.height, camera_name, width, height))
+    return calibration.scaled(width, height)
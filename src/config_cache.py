@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+# Configuration values from a network table, kept up to date by an entry
+# listener instead of being polled with getNumber() on every frame.
+#
+# Values are checked against the network tables type of their default: an
+# int setting takes only whole numbers (a dashboard sends every number as a
+# float), a float setting any number, a bool setting only a boolean, and a
+# string setting only a string.
+
+import sys
+import threading
+
+def convert(default, value):
+    """Return value as the type of default, or raise ValueError if it is not that kind of value."""
+    if isinstance(default, bool):
+        if isinstance(value, bool):
+            return value
+    elif isinstance(default, (int, float)):
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            if isinstance(default, float):
+                return float(value)
+            if float(value).is_integer():
+                return int(value)
+    elif isinstance(value, type(default)):
+        return value
+    raise ValueError(value)
+
+class ConfigCache:
+    """Typed configuration values kept up to date by a network tables listener.
+
+    Each key in defaults is set in the table if it is not set already, and
+    every value received afterwards is converted to the type of its default
+    (see convert), or ignored with an error if it cannot be.
+    The version counter goes up whenever a value actually changes, so callers
+    only need to rebuild derived data (thresholds, LED state, ...) when the
+    version differs from the one they last saw.
+    """
+    def __init__(self, nt, defaults):
+        self.nt = nt
+        self.defaults = dict(defaults)
+        self.values = dict(defaults)
+        self.version = 0
+        self.lock = threading.Lock()
+
+        # Set all configuration parameters if not set already
+        for key, value in self.defaults.items():
+            nt.setDefaultValue(key, value)
+
+        # Get the current values now and any changes from the network later
+        nt.addEntryListener(self.valueChanged, immediateNotify=True, localNotify=False)
+
+    def valueChanged(self, table, key, value, isNew):
+        if key not in self.defaults:
+            return # Not a configuration parameter (e.g. one of our results)
+        try:
+            value = convert(self.defaults[key], value)
+        except ValueError:
+            print("config error: '{}' cannot be set to {!r}".format(key, value), file=sys.stderr)
+            return
+        with self.lock:
+            if self.values[key] != value:
+                self.values[key] = value
+                self.version += 1
+
+    def set(self, key, value):
+        """Set a configuration value locally and in the network table."""
+        self.nt.putValue(key, value)
+        self.valueChanged(self.nt, key, value, False)
+
+    def snapshot(self):
+        """Return the version and a consistent copy of all the values."""
+        with self.lock:
+            return self.version, dict(self.values)
+
+    def __getattr__(self, key):
+        try:
+            return self.__dict__['values'][key]
+        except KeyError:
+            raise AttributeError(key) from None
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+# Contour filtering as a cascade: cheap features are computed for all the
+# contours at once and tested with numpy, and the expensive steps (rotated
+# rectangles, convex hulls, polygon fitting) only run on the contours that
+# are still in the running. The targets found are the same as testing every
+# contour with all the predicates one at a time. Several filters (one per
+# target class) can share one pass over their contours with apply_all().
+
+import cv2
+import numpy as np
+
+# Reasons a contour can be rejected, in the order they are tested
+FILTER_STAGES = ['small', 'area', 'bbox_fill', 'angle', 'ratio', 'fill', 'corners']
+
+class ContourFilter:
+    """Finds the contours that look like targets."""
+    def __init__(self, min_area=10, target_area=150, max_angle=20, min_ratio=1.5, max_fill=0.25,
+            num_corners=4, epsilon=0.015):
+        self.min_area = min_area # Smaller contours are ignored completely
+        self.target_area = target_area # Targets must be larger than this
+        self.max_angle = max_angle # Degrees the long side may be from horizontal
+        self.min_ratio = min_ratio # Long side / short side of the rotated rectangle
+        self.max_fill = max_fill # Contour area / rotated rectangle area
+        self.num_corners = num_corners # Corners of the fitted polygon
+        self.epsilon = epsilon # Polygon fitting tolerance, as a fraction of the perimeter
+
+    def apply(self, contour_list):
+        """Return (seen, targets, counts) for a list of contours.
+
+        seen is the list of contours big enough to consider at all, targets is
+        a list of (contour, rect_center, corners) for the accepted ones, and
+        counts maps each of FILTER_STAGES to the number of contours it rejected
+        (plus the 'contours' considered and the number 'accepted').
+        """
+        return apply_all([(self, contour_list)])[0]
+
+def apply_all(groups):
+    """Run several filters, each on its own contours, with one pass over the features of them all.
+
+    groups is a list of (ContourFilter, contour_list), and the result is a
+    list of (seen, targets, counts) for each, as returned by apply(). With
+    num_corners at 0 a filter fits no polygon, and the corners of its targets
+    are those of their rotated rectangles.
+    """
+    filters = [contour_filter for contour_filter, _ in groups]
+    group_sizes = [len(contours) for _, contours in groups]
+    contour_list = [contour for _, contours in groups for contour in contours]
+    group = np.repeat(np.arange(len(groups)), group_sizes) # Which filter each contour is for
+
+    outputs = []
+    for size in group_sizes:
+        counts = dict.fromkeys(['contours'] + FILTER_STAGES + ['accepted'], 0)
+        counts['contours'] = size
+        outputs.append(([], [], counts))
+    if len(contour_list) == 0:
+        return outputs
+
+    def limits(name):
+        """The value of a filter setting for each contour."""
+        return np.array([getattr(contour_filter, name) for contour_filter in filters], dtype=np.float64)[group]
+
+    def count(stage, passed, ok):
+        """Charge the contours of each group that passed before but not after a test."""
+        rejected = np.bincount(group[passed & ~ok], minlength=len(groups))
+        for (_, _, counts), n in zip(outputs, rejected):
+            counts[stage] += int(n)
+
+    # Cheap features of every contour
+    areas = np.array([cv2.contourArea(contour) for contour in contour_list])
+    boxes = np.array([cv2.boundingRect(contour) for contour in contour_list]).reshape(-1, 4)
+
+    everything = np.ones(len(contour_list), dtype=bool)
+    seen = areas >= limits('min_area')
+    keep = seen & (areas > limits('target_area'))
+    count('small', everything, seen)
+    count('area', seen, keep)
+
+    # The rotated rectangle is never bigger than the upright bounding box,
+    # so a contour that fills too much of its box fills too much of it too
+    box_areas = boxes[:, 2] * boxes[:, 3]
+    max_fills = limits('max_fill')
+    survivors = keep & (areas < max_fills * box_areas)
+    count('bbox_fill', keep, survivors)
+    for i in np.flatnonzero(seen):
+        outputs[group[i]][0].append(contour_list[i])
+    index = np.flatnonzero(survivors)
+    if len(index) == 0:
+        return outputs
+
+    # Rotated rectangles of the survivors
+    rects = [cv2.minAreaRect(contour_list[i]) for i in index]
+    centers = np.array([rect[0] for rect in rects])
+    sizes = np.array([rect[1] for rect in rects])
+    angles = -np.array([rect[2] for rect in rects]) # Horizontal is 0 degrees, CCW is positive
+    wide = sizes[:, 0] >= sizes[:, 1]
+    longs = np.where(wide, sizes[:, 0], sizes[:, 1])
+    shorts = np.where(wide, sizes[:, 1], sizes[:, 0])
+    angles = np.where(wide, angles, angles + 90)
+    # Keep the angle between -90 and +90 degrees
+    angles = np.where(angles > 90, angles - 180, angles)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratios = longs / shorts
+        fills = areas[index] / (longs * shorts)
+
+    # The tests from here on are on the survivors only
+    group = group[index]
+    max_angles = limits('max_angle')
+    all_survivors = np.ones(len(index), dtype=bool)
+    ok = (-max_angles < angles) & (angles < max_angles)
+    count('angle', all_survivors, ok)
+    passed = ok
+    ok = ok & (ratios > limits('min_ratio'))
+    count('ratio', passed, ok)
+    passed = ok
+    ok = ok & (fills < max_fills[index])
+    count('fill', passed, ok)
+
+    # Polygon fitting only for what is left
+    for j in np.flatnonzero(ok):
+        contour_filter = filters[group[j]]
+        _, targets, counts = outputs[group[j]]
+        contour = contour_list[index[j]]
+        if contour_filter.num_corners == 0:
+            corners = cv2.boxPoints(rects[j]).reshape(-1, 1, 2)
+        else:
+            corners = cv2.convexHull(contour)
+            corners = cv2.approxPolyDP(corners, contour_filter.epsilon * cv2.arcLength(contour, True), True)
+            if len(corners) != contour_filter.num_corners:
+                counts['corners'] += 1
+                continue
+        targets.append((contour, tuple(centers[j]), corners))
+    for _, targets, counts in outputs:
+        counts['accepted'] = len(targets)
+
+    return outputs
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+
+# The marked-up debug video (the Peariscope stream) as a separate, rate
+# limited stage of the frame loop.
+#
+# Drawing the marks and having cscore JPEG-encode every frame costs about as
+# much as finding the targets, so a debug frame is only rendered when one is
+# due at debug_fps, at 1/debug_scale of the camera resolution, and only when
+# a dashboard is actually watching the stream.
+
+import time
+
+class DebugStream:
+    """Decides when to render the debug video and sends it to the output stream."""
+    def __init__(self, output_stream, fps=10, scale=2):
+        self.output_stream = output_stream
+        self.fps = fps # Most debug frames per second (0 sends none)
+        self.scale = scale # Debug frames are 1/scale of the camera resolution (1, 2, or 4)
+        self.last_time = 0
+        self.skipped = 0 # Debug frames that were due but had nobody watching
+
+    def has_viewers(self):
+        """Return whether any client is connected to the output stream.
+
+        cscore only enables a source while a sink (here the MJPEG server) is
+        streaming it to a client. Streams without isEnabled count as watched.
+        """
+        is_enabled = getattr(self.output_stream, 'isEnabled', None)
+        return is_enabled is None or is_enabled()
+
+    def due(self):
+        """Return whether a debug frame should be rendered for this frame."""
+        if self.fps <= 0:
+            return False
+        now = time.perf_counter()
+        if now - self.last_time < 1 / self.fps:
+            return False
+        self.last_time = now
+        if not self.has_viewers():
+            self.skipped += 1
+            return False
+        return True
+
+    def shape(self, img_width, img_height):
+        """Return the shape of a debug frame for a camera frame of this size."""
+        return (img_height // self.scale, img_width // self.scale, 3)
+
+    def put(self, output_img):
+        self.output_stream.putFrame(output_img)
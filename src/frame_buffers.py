@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+
+# Scratch images reused from frame to frame, so that the steady state frame
+# loop does not allocate a new image at every stage.
+#
+# The OpenCV stages write into these with their dst argument. A buffer is
+# only (re)allocated when a bigger one is asked for, and a smaller request
+# (e.g. a region of interest window) gets a view of the top left corner, so
+# after the first full frame nothing new is allocated. A FrameBuffers object
+# is used by one thread at a time.
+
+import numpy as np
+
+class FrameBuffers:
+    """Named scratch images, kept between frames."""
+    def __init__(self):
+        self.buffers = {} # Name -> array at least as big as any request so far
+        self.allocations = 0 # Number of times a buffer had to be (re)allocated
+
+    def get(self, name, shape, dtype=np.uint8):
+        """Return a buffer of this shape and dtype (with undefined contents)."""
+        buf = self.buffers.get(name)
+        if buf is not None and buf.shape == shape and buf.dtype == dtype:
+            return buf
+        if buf is None or buf.dtype != dtype or buf.ndim != len(shape) or \
+                any(n > m for n, m in zip(shape, buf.shape)):
+            if buf is not None:
+                shape_needed = tuple(max(n, m) for n, m in zip(shape, buf.shape)) \
+                    if buf.ndim == len(shape) else shape
+            else:
+                shape_needed = shape
+            buf = np.empty(shape_needed, dtype=dtype)
+            self.buffers[name] = buf
+            self.allocations += 1
+            if buf.shape == shape:
+                return buf
+        return buf[tuple(slice(0, n) for n in shape)]
+
+    def zeros(self, name, shape, dtype=np.uint8):
+        """Return a buffer of this shape and dtype, filled with zeros."""
+        buf = self.get(name, shape, dtype)
+        buf.fill(0)
+        return buf
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+
+# A frame bus: one process captures a camera into shared memory, and any
+# number of other processes (target detection, a game piece detector, a
+# match recorder, ...) read the frames from there, instead of each having
+# its own sink and its own copy of every frame.
+#
+# The shared memory block (named after the camera, see bus_name) holds a
+# header, a ring of SLOTS frames, and for each slot its sequence number and
+# frame_time:
+#   header  - int64 [version, slots, height, width, fps, latest seq]
+#   meta    - int64 [begin seq, frame_time, end seq] for each slot
+#   frames  - uint8 slots x height x width x 3 (BGR)
+# The capture process grabs each frame straight into the next slot. It sets
+# the slot's begin seq before writing and its end seq after, then the
+# latest seq. There are no locks: a reader takes the latest slot as a numpy
+# view (no copy) and the frame is whole if the begin and end seq match. The
+# view stays valid until the capture process comes back around to the slot
+# (SLOTS - 1 frames later, about 100 ms at 30 fps); valid() tells whether
+# that has happened yet. Readers' views are read-only.
+#
+# peariscope_pnp.py --bus <camera name> runs the target detection on a bus:
+# BusCamera and BusSink stand in for its camera and sink, with the camera's
+# width, height, and fps from the bus header.
+#
+# Needs Python 3.8 or later (multiprocessing.shared_memory).
+#   ./frame_bus.py capture                 # the first camera in /boot/frc.json
+#   ./frame_bus.py watch Peariscope        # read rate and frames missed
+#   ./frame_bus.py record Peariscope /home/pi/recordings/match1 --frames 900
+
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+
+BUS_VERSION = 1
+SLOTS = 4
+HEADER_FIELDS = ['version', 'slots', 'height', 'width', 'fps', 'latest']
+HEADER_BYTES = 64 # Room for the header fields, keeping the frames 64-byte aligned
+META_FIELDS = 3 # begin seq, frame_time, end seq
+VERSION, NUM_SLOTS, HEIGHT, WIDTH, FPS, LATEST = range(len(HEADER_FIELDS))
+BEGIN, FRAME_TIME, END = range(META_FIELDS)
+POLL_INTERVAL = 0.001 # Seconds between checks for a new frame
+
+def bus_name(camera_name):
+    """Return the shared memory name of a camera's bus."""
+    return 'peariscope-' + ''.join(c if c.isalnum() else '_' for c in camera_name)
+
+def bus_size(width, height, slots):
+    meta_bytes = -(-slots * META_FIELDS * 8 // 64) * 64 # Rounded up to keep the frames aligned
+    return HEADER_BYTES + meta_bytes + slots * height * width * 3
+
+class FrameBus:
+    """The header, slot metadata, and frames of a bus, as numpy views of its shared memory."""
+    def __init__(self, shm):
+        self.shm = shm
+        self.header = np.ndarray((len(HEADER_FIELDS),), dtype=np.int64, buffer=shm.buf)
+        if self.header[VERSION] != BUS_VERSION:
+            raise ValueError("frame bus '{}' is version {}, not {}".format(
+                shm.name, self.header[VERSION], BUS_VERSION))
+        slots, height, width = (int(self.header[i]) for i in (NUM_SLOTS, HEIGHT, WIDTH))
+        self.slots = slots
+        self.shape = (height, width, 3)
+        self.meta = np.ndarray((slots, META_FIELDS), dtype=np.int64, buffer=shm.buf, offset=HEADER_BYTES)
+        self.frames = np.ndarray((slots,) + self.shape, dtype=np.uint8, buffer=shm.buf,
+            offset=bus_size(width, height, slots) - slots * height * width * 3)
+
+    @classmethod
+    def create(cls, name, width, height, fps=0, slots=SLOTS):
+        """Create the bus (replacing one left behind by a capture process that died)."""
+        try:
+            old = shared_memory.SharedMemory(name)
+            old.close()
+            old.unlink()
+        except FileNotFoundError:
+            pass
+        shm = shared_memory.SharedMemory(name, create=True, size=bus_size(width, height, slots))
+        header = np.ndarray((len(HEADER_FIELDS),), dtype=np.int64, buffer=shm.buf)
+        header[:] = [BUS_VERSION, slots, height, width, fps, 0]
+        del header
+        return cls(shm)
+
+    @classmethod
+    def attach(cls, name):
+        """Open a bus made by a capture process."""
+        shm = shared_memory.SharedMemory(name)
+        # Otherwise this process's resource tracker would unlink the bus when it exits
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        bus = cls(shm)
+        bus.frames.flags.writeable = False # Only the capture process writes the frames
+        return bus
+
+    @property
+    def fps(self):
+        return int(self.header[FPS])
+
+    @property
+    def latest(self):
+        return int(self.header[LATEST])
+
+    def close(self):
+        # The views have to go before the memory can be closed
+        self.header = self.meta = self.frames = None
+        self.shm.close()
+
+class FrameWriter:
+    """Writes frames into a bus (only one per bus, in the capture process)."""
+    def __init__(self, bus):
+        self.bus = bus
+        self.seq = bus.latest
+
+    def next_image(self):
+        """Return the slot to write the next frame into, marked as being written."""
+        seq = self.seq + 1
+        slot = seq % self.bus.slots
+        self.bus.meta[slot, BEGIN] = seq
+        return self.bus.frames[slot]
+
+    def publish(self, frame_time):
+        """Mark the frame written by next_image() as whole and make it the latest."""
+        self.seq += 1
+        slot = self.seq % self.bus.slots
+        self.bus.meta[slot, FRAME_TIME] = frame_time
+        self.bus.meta[slot, END] = self.seq
+        self.bus.header[LATEST] = self.seq
+
+class FrameReader:
+    """Reads the latest frames from a bus, as views of the shared memory."""
+    def __init__(self, bus):
+        self.bus = bus
+        self.seq = 0 # Of the last frame read
+
+    def latest(self):
+        """Return (seq, frame_time, img) of the latest whole frame, or None if there is none yet."""
+        seq = self.bus.latest
+        if seq == 0:
+            return None
+        slot = seq % self.bus.slots
+        end = self.bus.meta[slot, END]
+        frame_time = int(self.bus.meta[slot, FRAME_TIME])
+        if self.bus.meta[slot, BEGIN] != seq or end != seq:
+            return None # Already being written over
+        self.seq = seq
+        return seq, frame_time, self.bus.frames[slot]
+
+    def wait(self, timeout=1.0):
+        """Return the latest frame once there is one newer than the last one read, or None on timeout."""
+        deadline = time.monotonic() + timeout
+        while True:
+            if self.bus.latest > self.seq:
+                frame = self.latest()
+                if frame is not None:
+                    return frame
+            if time.monotonic() > deadline:
+                return None
+            time.sleep(POLL_INTERVAL)
+
+    def valid(self, seq):
+        """Return whether the view of frame seq has not started to be written over."""
+        return self.bus.meta[seq % self.bus.slots, BEGIN] == seq
+
+class BusSink:
+    """Stands in for a CvSink, returning the newest frame of a bus as a view of the shared memory.
+
+    The image given to grabFrame is not used: the frame is not copied into
+    it. Check valid() once done with the frame, since the capture process
+    may have started writing over it by then.
+    """
+    def __init__(self, bus, timeout=1.0):
+        self.reader = FrameReader(bus)
+        self.timeout = timeout
+        self.seq = 0 # Of the frame last returned
+        self.error = ''
+
+    def grabFrame(self, img):
+        frame = self.reader.wait(self.timeout)
+        if frame is None:
+            self.error = 'no frame on the bus for {} s'.format(self.timeout)
+            return 0, img
+        self.seq, frame_time, view = frame
+        return frame_time, view
+
+    def valid(self):
+        """Return whether the frame last returned is still whole."""
+        return self.reader.valid(self.seq)
+
+    def getError(self):
+        return self.error
+
+class BusCamera:
+    """Stands in for the UsbCamera of a bus, which the capture process has open."""
+    def __init__(self, bus, name):
+        self.bus = bus
+        self.name = name
+
+    def getName(self):
+        return self.name
+
+    def getInfo(self):
+        return 'Frame bus {}'.format(self.bus.shm.name)
+
+    def getPath(self):
+        return self.bus.shm.name
+
+    def getConfigJson(self):
+        height, width = self.bus.shape[:2]
+        return json.dumps({'name': self.name, 'width': width, 'height': height, 'fps': self.bus.fps})
+
+    def setFPS(self, fps):
+        print('the frame rate of a frame bus is set by its capture process', file=sys.stderr)
+        return False
+
+def run_capture(config_file, slots=SLOTS):
+    """Start the first camera in the configuration file and capture it onto its bus, forever."""
+    import peariscope.src.multiCameraServer as mcs # Only the capture process needs cscore
+
+    mcs.configFile = config_file
+    if not mcs.readConfig():
+        sys.exit(1)
+    config = mcs.cameraConfigs[0]
+    camera, inst = mcs.startCamera(config)
+    sink = inst.getVideo(camera=camera)
+    width, height = config.config['width'], config.config['height']
+    bus = FrameBus.create(bus_name(config.name), width, height, config.config.get('fps', 0), slots)
+    writer = FrameWriter(bus)
+    print("Capturing camera '{}' to frame bus '{}' ({} slots of {}x{})".format(
+        config.name, bus.shm.name, slots, width, height))
+
+    try:
+        while True:
+            img = writer.next_image()
+            frame_time, grabbed = sink.grabFrame(img)
+            if frame_time == 0:
+                print('grab error:', sink.getError(), file=sys.stderr)
+                continue
+            if grabbed is not img:
+                np.copyto(img, grabbed) # The camera's mode does not match the configuration
+            writer.publish(frame_time)
+    finally:
+        bus.close()
+        bus.shm.unlink()
+
+if __name__ == "__main__":
+    SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+    sys.path.append(os.path.dirname(os.path.dirname(SRC_DIR))) # For "import peariscope.src..."
+
+    parser = argparse.ArgumentParser(description='Share camera frames between processes')
+    commands = parser.add_subparsers(dest='command')
+    capture = commands.add_parser('capture', help='capture the first camera onto its bus')
+    capture.add_argument('config', nargs='?', default='/boot/frc.json')
+    capture.add_argument('--slots', type=int, default=SLOTS)
+    watch = commands.add_parser('watch', help='read a bus and report the rate')
+    watch.add_argument('camera')
+    record = commands.add_parser('record', help='record the frames of a bus (see recorder.py)')
+    record.add_argument('camera')
+    record.add_argument('output')
+    record.add_argument('--frames', '-n', type=int, default=0, help='stop after this many frames (0 is never)')
+    args = parser.parse_args()
+
+    if args.command == 'capture':
+        run_capture(args.config, args.slots)
+        sys.exit()
+    if args.command is None:
+        parser.error('a command is needed')
+
+    bus = FrameBus.attach(bus_name(args.camera))
+    reader = FrameReader(bus)
+    frame_recorder = None
+    if args.command == 'record':
+        from recorder import FrameRecorder
+        frame_recorder = FrameRecorder(args.output, bus.shape[1], bus.shape[0], bus.fps, args.camera)
+
+    count = missed = 0
+    start_time = time.monotonic()
+    try:
+        while args.command != 'record' or args.frames <= 0 or count < args.frames:
+            frame = reader.wait()
+            if frame is None:
+                print('no frames on the bus')
+                continue
+            seq, frame_time, img = frame
+            if count > 0:
+                missed += seq - previous_seq - 1
+            previous_seq = seq
+            if frame_recorder is not None:
+                frame_recorder.write(frame_time, img)
+                if not reader.valid(seq):
+                    print('frame {} was written over while recording it'.format(seq), file=sys.stderr)
+            count += 1
+            if args.command == 'watch' and count % 100 == 0:
+                elapsed = time.monotonic() - start_time
+                print('{:.1f} fps, {} frames missed'.format(count / elapsed, missed))
+    finally:
+        if frame_recorder is not None:
+            frame_recorder.close()
+            print('Recorded {} frames ({} missed)'.format(count, missed))
+        bus.close()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+# Keeps the capture-to-publish latency under a budget (latency_budget) by
+# trading processing resolution and camera frame rate.
+#
+# When the smoothed latency is over the budget the governor steps down one
+# knob: the pyramid scale (1, 2) or the camera FPS (all, 2/3, 1/2 of the
+# configured rate, set with VideoSource.setFPS; if the camera refuses, as a
+# frame bus does, only the scale is used). While locked on a target it keeps
+# the resolution (for accurate poses) and gives up frame rate first; while
+# searching it keeps the frame rate and gives up resolution first.
+# With plenty of headroom it steps back up the other way. Changes are at
+# least CHANGE_INTERVAL apart so each operating point can be measured. The
+# current point is published as Peariscope/operating_point:
+#   [pyramid_scale, camera_fps, smoothed latency (seconds)]
+
+import time
+
+SCALES = [1, 2] # Up to peariscope_pnp.MAX_PYRAMID_SCALE
+FPS_FRACTIONS = [1, 2/3, 1/2]
+
+SMOOTHING = 0.1 # Weight of the newest latency in the moving average
+HEADROOM = 0.6 # Step back up when the latency is under this fraction of the budget
+CHANGE_INTERVAL = 2.0 # Seconds between changes
+
+class Governor:
+    """Chooses the pyramid scale and camera frame rate to meet a latency budget."""
+    def __init__(self, camera, table, camera_fps, budget=0):
+        self.camera = camera
+        self.table = table
+        self.camera_fps = camera_fps # As configured in /boot/frc.json
+        self.budget = budget # Seconds (0 is off)
+        self.scale_index = 0
+        self.fps_index = 0
+        self.applied_fps = camera_fps
+        self.fixed_fps = False # The camera refused to change its frame rate
+        self.latency = None # Moving average since the last change
+        self.last_change = 0
+
+    @property
+    def scale(self):
+        return SCALES[self.scale_index]
+
+    @property
+    def fps(self):
+        return max(1, int(round(self.camera_fps * FPS_FRACTIONS[self.fps_index])))
+
+    def update(self, latency, locked):
+        """Take the latency of a frame and whether any target was found in it."""
+        if self.budget <= 0:
+            if self.scale_index != 0 or self.fps_index != 0:
+                self.scale_index = self.fps_index = 0 # Turned off, so back to full
+                self.changed()
+            return
+
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += SMOOTHING * (latency - self.latency)
+        if time.monotonic() - self.last_change < CHANGE_INTERVAL:
+            return
+
+        if self.latency > self.budget:
+            knobs = ['fps', 'scale'] if locked else ['scale', 'fps']
+            self.step(knobs, 1)
+        elif self.latency < self.budget * HEADROOM:
+            knobs = ['scale', 'fps'] if locked else ['fps', 'scale']
+            self.step(knobs, -1)
+
+    def step(self, knobs, direction):
+        """Move the first knob that can go further in direction (1 is cheaper)."""
+        for knob in knobs:
+            if knob == 'scale' and 0 <= self.scale_index + direction < len(SCALES):
+                self.scale_index += direction
+                self.changed()
+                return
+            if knob == 'fps' and not self.fixed_fps and 0 <= self.fps_index + direction < len(FPS_FRACTIONS):
+                self.fps_index += direction
+                self.changed()
+                return
+
+    def changed(self):
+        print('Operating point: pyramid_scale {}, {} fps (latency {})'.format(
+            self.scale, self.fps, 'n/a' if self.latency is None else '{:.1f} ms'.format(self.latency * 1000)))
+        if self.fps != self.applied_fps:
+            if self.camera.setFPS(self.fps):
+                self.applied_fps = self.fps
+            else:
+                self.fixed_fps = True
+                self.fps_index = 0
+        self.table.putNumberArray('operating_point', [self.scale, self.fps, self.latency or 0])
+        self.latency = None
+        self.last_change = time.monotonic()
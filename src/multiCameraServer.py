@@ -208,7 +208,7 @@ def startSwitchedCamera(config):
 
     return server
 
-def init():
+def init(start_cameras=True):
     # read configuration
     if not readConfig():
         sys.exit(1)
@@ -222,6 +222,10 @@ def init():
         print("Setting up NetworkTables client for team {}".format(team))
         ntinst.startClientTeam(team)
 
+    # the cameras can be started by another process instead (see frame_bus.py)
+    if not start_cameras:
+        return
+
     # start cameras
     for config in cameraConfigs:
         camera, inst = startCamera(config)
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+# Runs the vision code on every camera in /boot/frc.json, one process per
+# camera, so each camera has a core (and a Python interpreter) of its own.
+#
+# Each camera process starts its own camera and network tables connection
+# (multiCameraServer.init() starts them all in one process). Its camera
+# stream and output stream are served on fixed ports, BASE_PORT + 2*index
+# and the port after that, since the processes cannot share the automatic
+# port numbering of a single CameraServer.
+
+import sys
+import json
+import time
+import multiprocessing
+
+from cscore import CameraServer, VideoSource, VideoMode, UsbCamera, MjpegServer, CvSource
+from networktables import NetworkTablesInstance
+import peariscope.src.multiCameraServer as mcs
+
+BASE_PORT = 1181
+
+class CameraStreams:
+    """Stands in for the CameraServer instance within one camera process."""
+    def __init__(self, inst, camera, port):
+        self.inst = inst
+        self.camera = camera
+        self.port = port # For the output stream
+
+    def getVideo(self, camera=None):
+        return self.inst.getVideo(camera=camera or self.camera)
+
+    def putVideo(self, name, width, height):
+        source = CvSource(name, VideoMode.PixelFormat.kMJPEG, width, height, 30)
+        server = MjpegServer('serve_' + name, self.port)
+        server.setSource(source)
+        self.inst.addCamera(source)
+        self.inst.addServer(server)
+        return source
+
+class BusStreams(CameraStreams):
+    """Stands in for the CameraServer instance in a process reading a frame bus (see frame_bus.py).
+
+    The capture process serves the camera stream, on the first automatic
+    port, so the output streams are served on a fixed port instead.
+    """
+    def __init__(self, inst, sink, port):
+        super().__init__(inst, None, port)
+        self.sink = sink
+
+    def getVideo(self, camera=None):
+        return self.sink
+
+def init_camera(index):
+    """Start network tables and the camera at index, in its camera process.
+
+    The configuration file has already been read, before forking (see run_cameras).
+    """
+    # Only one process can be the server, the others connect to it
+    ntinst = NetworkTablesInstance.getDefault()
+    if mcs.server and index == 0:
+        print("Setting up NetworkTables server")
+        ntinst.startServer()
+    elif mcs.server:
+        print("Setting up NetworkTables client for the first camera's process")
+        ntinst.startClient('127.0.0.1')
+    else:
+        print("Setting up NetworkTables client for team {}".format(mcs.team))
+        ntinst.startClientTeam(mcs.team)
+
+    config = mcs.cameraConfigs[index]
+    port = BASE_PORT + 2 * index
+    print("Starting camera '{}' on {} (port {})".format(config.name, config.path, port))
+    inst = CameraServer.getInstance()
+    camera = UsbCamera(config.name, config.path)
+    camera.setConfigJson(json.dumps(config.config))
+    camera.setConnectionStrategy(VideoSource.ConnectionStrategy.kKeepOpen)
+    server = MjpegServer('serve_' + config.name, port)
+    server.setSource(camera)
+    if config.streamConfig is not None:
+        server.setConfigJson(json.dumps(config.streamConfig))
+    inst.addCamera(camera)
+    inst.addServer(server)
+
+    return camera, CameraStreams(inst, camera, port + 1)
+
+def run_cameras(target, *args):
+    """Call target(index, *args) in a new process for each camera.
+
+    Runs until one of the processes exits, then stops the others and exits
+    with an error (so that the service restarts all of them).
+    """
+    if not mcs.readConfig():
+        sys.exit(1)
+    if len(mcs.switchedCameraConfigs) > 0:
+        print("switched cameras are not started with one process per camera", file=sys.stderr)
+
+    # Fork before anything (cscore, network tables) has started in this process
+    processes = []
+    for index, config in enumerate(mcs.cameraConfigs):
+        process = multiprocessing.Process(target=target, args=(index,) + args,
+            name='peariscope-' + config.name)
+        process.start()
+        processes.append(process)
+    print('Started {} camera processes'.format(len(processes)))
+
+    while all(process.is_alive() for process in processes):
+        time.sleep(1)
+    for process in processes:
+        if not process.is_alive():
+            print("camera process '{}' exited with code {}".format(process.name, process.exitcode),
+                file=sys.stderr)
+    for process in processes:
+        process.terminate()
+    sys.exit(1)
@@ -8,7 +8,8 @@ import numpy as np
 import cv2
 import networktables
 import peariscope.src.multiCameraServer as mcs
-import RPi.GPIO as GPIO
+import peariscope.src.config_cache as config_cache
+import peariscope.src.ringlight_service as ringlight_service
 
 # Define some colors (BGR)
 BGR_BLACK = (0, 0, 0)
@@ -29,13 +30,15 @@ DEFAULT_VALS = {
     'max_sat' : 255,
     'min_val' : 40,
     'max_val' : 255,
+    'led' : False,
 }
 
+# The ringlight service (ringlight_service.py) owns the LEDs and the PWM pin
+ringlight = ringlight_service.RinglightClient()
+
 def ringlight_on(red, grn, blu):
     print("Setting ringlights to", red, grn, blu)
-    script = 'peariscope/src/ringlight_on.py'
-    command = 'sudo {} {} {} {} 2>/dev/null'.format(script, red, grn, blu)
-    rc = subprocess.call(command, shell=True) # Run the script in the shell
+    ringlight.set_color(red, grn, blu) # Never blocks, even if the service is down
 
 def get_temperature():
     result = subprocess.check_output(['vcgencmd', 'measure_temp'])
@@ -72,27 +75,22 @@ def peariscope(camera, inst):
     nt = networktables.NetworkTables.getTable('Peariscope')
     time.sleep(1) # Wait for network tables to start
 
-    # Set all configuration parameters if not set already
+    # Configuration parameters are kept up to date by a network tables listener
+    settings = config_cache.ConfigCache(nt, DEFAULT_VALS)
     for key, value in DEFAULT_VALS.items():
-        print(key, value)
-        if nt.getNumber(key, None) == None:
-            nt.putNumber(key, value)
+        print(key, getattr(settings, key))
 
     # Set ringlight to initial color
-    red = nt.getNumber('led_red', None)
-    grn = nt.getNumber('led_grn', None)
-    blu = nt.getNumber('led_blu', None)
-    nt.putBoolean('led', False)
-
-    GPIO.setmode(GPIO.BOARD)
-    GPIO.setup(32, GPIO.OUT)
-    p = GPIO.PWM(32, 1000)
-    p.start(0)
+    red = settings.led_red
+    grn = settings.led_grn
+    blu = settings.led_blu
+    settings.set('led', False)
 
     #
     # Image Loop (runs for each image from the camera)
     #
 
+    settings_version = None
     current_time = time.time()
     while True: # Forever loop
         start_time = current_time
@@ -100,30 +98,24 @@ def peariscope(camera, inst):
         # Publish the temperature of the pi
         # nt.putNumber('temperature', get_temperature())
 
-        # Get configuration values for LED lights
-        led_red = nt.getNumber('led_red', None)
-        led_grn = nt.getNumber('led_grn', None)
-        led_blu = nt.getNumber('led_blu', None)
+        # Only rebuild the thresholds and LED state when something changed
+        if settings.version != settings_version:
+            settings_version, vals = settings.snapshot()
 
-        on = nt.getBoolean('led', False)
-
-        if on:
-            p.ChangeDutyCycle(100)
-        else:
-            p.ChangeDutyCycle(0)
+            if vals['led']:
+                ringlight.set_duty_cycle(100)
+            else:
+                ringlight.set_duty_cycle(0)
 
-        # Get configuration values for color detection
-        min_hue = nt.getNumber('min_hue', None)
-        max_hue = nt.getNumber('max_hue', None)
-        min_sat = nt.getNumber('min_sat', None)
-        max_sat = nt.getNumber('max_sat', None)
-        min_val = nt.getNumber('min_val', None)
-        max_val = nt.getNumber('max_val', None)
+            # Configuration values for color detection
+            lower = (vals['min_hue'], vals['min_sat'], vals['min_val'])
+            upper = (vals['max_hue'], vals['max_sat'], vals['max_val'])
 
-        # Ringlight control (only if changes are requested)
-        if led_red != red or led_grn != grn or led_blu != blu:
-            red, grn, blu = led_red, led_grn, led_blu
-            ringlight_on(red, grn, blu)
+            # Ringlight control (only if changes are requested)
+            led_red, led_grn, led_blu = vals['led_red'], vals['led_grn'], vals['led_blu']
+            if led_red != red or led_grn != grn or led_blu != blu:
+                red, grn, blu = led_red, led_grn, led_blu
+                ringlight_on(red, grn, blu)
 
         # Grab a frame from the camera and store it in the preallocated space
         frame_time, input_img = sink.grabFrame(input_img)
@@ -142,7 +134,7 @@ def peariscope(camera, inst):
 
         # Segment the image based on hue, saturation, and value ranges
         hsv_img = cv2.cvtColor(input_img, cv2.COLOR_BGR2HSV)
-        binary_img = cv2.inRange(hsv_img, (min_hue, min_sat, min_val), (max_hue, max_sat, max_val))
+        binary_img = cv2.inRange(hsv_img, lower, upper)
 
         # Closing (fill in any gaps)
         binary_img = cv2.dilate(binary_img, None, iterations=2)
@@ -1,16 +1,37 @@
 #!/usr/bin/env python3
 
+import os
 import sys
 import time
-import subprocess
+import threading
+import argparse
 import json
 import numpy as np
 import cv2
 import networktables
-import math
 from cscore import CameraServer, VideoSource, UsbCamera, MjpegServer
 import peariscope.src.multiCameraServer as mcs
-import RPi.GPIO as GPIO
+import peariscope.src.pipeline as pipeline
+import peariscope.src.config_cache as config_cache
+import peariscope.src.ringlight_service as ringlight_service
+import peariscope.src.recorder as recorder
+import peariscope.src.perf as perf
+import peariscope.src.roi as roi
+import peariscope.src.contour_filter as contour_filter
+import peariscope.src.segmentation as segmentation
+import peariscope.src.pose as pose
+import peariscope.src.camera_calibration as camera_calibration
+import peariscope.src.frame_buffers as frame_buffers
+import peariscope.src.multi_camera as multi_camera
+import peariscope.src.debug_stream as debug_stream
+import peariscope.src.result_packet as result_packet
+import peariscope.src.pose_history as pose_history
+import peariscope.src.thermal as thermal
+import peariscope.src.governor as governor
+import peariscope.src.target_tracker as target_tracker
+import peariscope.src.undistort as undistort
+import peariscope.src.blobs as blobs
+import peariscope.src.target_classes as target_classes
 
 configFile = "/boot/frc.json"
 
@@ -23,9 +44,6 @@ switchedCameraConfigs = []
 cameras = []
 insts = []
 
-CAMERA_MATRIX_NAME = 'camera_matrix'
-DISTORTION_COEFFICIENTS_NAME = 'distortion_coefficients'
-
 def parseError(str):
     """Report parse error."""
     print("config error in '" + configFile + "': " + str, file=sys.stderr)
@@ -56,17 +74,6 @@ def readCameraConfig(config):
     cameraConfigs.append(cam)
     return True
 
-def readCalibrationFile(path: str):
-    fs = cv2.FileStorage(path, cv2.FileStorage_READ)
-    if fs.isOpened():
-        cam_mat = fs.getNode(CAMERA_MATRIX_NAME).mat()
-        dist_coeff = fs.getNode(DISTORTION_COEFFICIENTS_NAME).mat()
-        return cam_mat, dist_coeff
-    else:
-        raise ValueError(
-            "Specified calibration file does not exist or cannot be opened"
-        )
-
 def readSwitchedCameraConfig(config):
     """Read single switched camera configuration."""
     cam = CameraConfig()
@@ -203,6 +210,25 @@ DEFAULT_VALS = {
     'max_sat' : 255,
     'min_val' : 40,
     'max_val' : 255,
+    'perf_rate' : 0.0, # Publish stage timings to Peariscope/perf this many times a second (0 is off)
+    'roi_refresh' : 0, # Search only near the last targets, and the whole frame every this many frames (0 is off)
+    'roi_margin' : 50, # Pixels added around the last targets when searching near them
+    'segmentation' : 'hsv', # 'hsv' (cvtColor + inRange) or 'lut' (BGR lookup table)
+    'blob_extraction' : 'contours', # 'contours' (of the whole image) or 'components' (connected components, see blobs.py)
+    'lut_bits' : 6, # Bits per color channel of the lookup table (8 is exact)
+    'pyramid_scale' : 1, # Search a 1/2 size image and find the targets again at full size (1 is off)
+    'pnp_solver' : 'iterative', # solvePnP method: 'iterative', 'epnp', 'ap3p', 'ippe', or 'sqpnp'
+    'pnp_track' : True, # Start solvePnP from the pose of the same target in the last frame
+    'debug_fps' : 10, # Most frames per second on the marked-up Peariscope stream (0 is off)
+    'debug_scale' : 2, # The Peariscope stream is 1/1, 1/2, or 1/4 of the camera resolution
+    'legacy_results' : True, # Also publish x_list, y_list, ... as separate entries (besides the result packet)
+    'thermal_warm' : 70.0, # Degrees C at which to search only near the targets and slow the debug stream
+    'thermal_hot' : 80.0, # Degrees C at which to also search a 1/2 size image and stop the debug stream
+    'latency_budget' : 0.0, # Seconds from capture to publish that the governor keeps under (0 is off)
+    'track_targets' : False, # Give targets stable IDs and smooth their positions and poses (instead of the raw ones)
+    'detect_every' : 1, # Run the full detection every this many frames and predict the tracks in between
+    'track_confirm' : True, # Between full detections, search just around the predicted tracks
+    'undistort_stream' : False, # Also send the undistorted camera image (at debug_fps and debug_scale)
 }
 
 TARGET_POINTS = np.array(
@@ -214,18 +240,361 @@ TARGET_POINTS = np.array(
     ]
 )
 
+# Predicates for the contours of the vision targets
+TARGET_FILTER = contour_filter.ContourFilter(min_area=10, target_area=150, max_angle=20,
+    min_ratio=1.5, max_fill=0.25, num_corners=4)
+
+# Candidates in a downscaled image: the same, but the corners are only fitted
+# once each one is found again at full size (see refine_target)
+PYRAMID_FILTER = contour_filter.ContourFilter(min_area=10, target_area=150, max_angle=20,
+    min_ratio=1.5, max_fill=0.25, num_corners=0)
+
+# The usual blob extraction (see blobs.py)
+CONTOUR_BLOBS = blobs.ContourBlobs()
+
+# Cheaper settings used when the Pi is warm (see thermal_settings)
+THERMAL_ROI_REFRESH = 10
+THERMAL_DEBUG_FPS = 2
+
+# Settings the pipelined loop does not support, and the values that turn them off
+# (README.md lists what the pipelined loop does and does not support)
+PIPELINED_OFF = {'perf_rate': 0, 'roi_refresh': 0, 'detect_every': 1, 'undistort_stream': False}
+
+# The largest pyramid_scale that passes pyramid_check.py (at 4 far targets are lost)
+MAX_PYRAMID_SCALE = 2
+
+# Downscaled pixels searched around a target found in a downscaled image,
+# when finding it again at full size (more than the closing reaches)
+REFINE_MARGIN = 4
+
+# The ringlight service (ringlight_service.py) owns the LEDs and the PWM pin
+ringlight = ringlight_service.RinglightClient()
+
+def load_defaults(path):
+    """Update DEFAULT_VALS from a JSON file (e.g. the thresholds from tune_thresholds.py)."""
+    with open(path) as f:
+        values = json.load(f)
+    values.pop('tuning', None) # How well tune_thresholds.py's thresholds did
+    for key, value in values.items():
+        if key not in DEFAULT_VALS:
+            print("defaults error in '{}': unknown key '{}'".format(path, key), file=sys.stderr)
+            continue
+        try:
+            DEFAULT_VALS[key] = config_cache.convert(DEFAULT_VALS[key], value)
+        except ValueError:
+            print("defaults error in '{}': '{}' cannot be set to {!r}".format(path, key, value), file=sys.stderr)
+    print("Defaults from", path, values)
+
 def ringlight_on(red, grn, blu):
     print("Setting ringlights to", red, grn, blu)
-    script = 'peariscope/src/ringlight_on.py'
-    command = 'sudo {} {} {} {} 2>/dev/null'.format(script, red, grn, blu)
-    rc = subprocess.call(command, shell=True) # Run the script in the shell
+    ringlight.set_color(red, grn, blu) # Never blocks, even if the service is down
+
+def thermal_settings(vals, level):
+    """Return the settings, switched to cheaper ones if the Pi is warm or hot."""
+    if level == thermal.NORMAL:
+        return vals
+    vals = dict(vals)
+    if vals['roi_refresh'] == 0:
+        vals['roi_refresh'] = THERMAL_ROI_REFRESH
+    vals['debug_fps'] = min(vals['debug_fps'], THERMAL_DEBUG_FPS)
+    if level == thermal.HOT:
+        vals['pyramid_scale'] = max(vals['pyramid_scale'], 2)
+        vals['debug_fps'] = 0
+    return vals
+
+def segment(input_img, segmenter, extractor, buffers, timer=perf.NULL_TIMER, hsv_img=None):
+    """Segment the image based on hue, saturation, and value ranges.
+
+    hsv_img is the image already converted to HSV, if it has been (for the
+    other target classes), which only the 'hsv' segmentation can use.
+    """
+    if hsv_img is not None and isinstance(segmenter, segmentation.HsvSegmenter):
+        binary_img = segmenter.in_range(hsv_img, timer, buffers)
+    else:
+        binary_img = segmenter.threshold(input_img, timer, buffers)
+
+    # Closing (fill in any gaps)
+    return extractor.close(binary_img, timer, buffers)
+
+def refine_target(input_img, segmenter, extractor, target, scale):
+    """Find a target found in a downscaled image again at full size, or return None.
+
+    Only the target's bounding box (and a margin) is searched, with the same
+    thresholds, closing, and contour filter as a full size search, so the
+    contour, center, and corners are the ones that search would have found.
+    """
+    img_height, img_width = input_img.shape[:2]
+    x, y, w, h = cv2.boundingRect(target[0])
+    pad = REFINE_MARGIN * scale
+    x0, y0 = max(0, x - pad), max(0, y - pad)
+    x1, y1 = min(img_width, x + w + pad), min(img_height, y + h + pad)
+    binary_img = segmenter.threshold(input_img[y0:y1, x0:x1], perf.NULL_TIMER)
+    binary_img = extractor.close(binary_img, perf.NULL_TIMER)
+    contour_list, _ = extractor.find(binary_img, (x0, y0), perf.NULL_TIMER)
+    _, targets, _ = TARGET_FILTER.apply(contour_list)
+    if len(targets) == 0:
+        return None
+
+    # The box can also hold part of a neighboring target, so take the nearest
+    center_x, center_y = target[1]
+    return min(targets, key=lambda found: np.hypot(found[1][0] - center_x, found[1][1] - center_y))
+
+def find_contours(binary_img, extractor, offset, scale, timer, buffers):
+    """Return the contours of a (window of a, maybe downscaled) binary image in full-frame pixels,
+    and the counts of the blobs rejected before they had contours."""
+    if scale == 1:
+        return extractor.find(binary_img, offset, timer, buffers)
+    contour_list, rejected = extractor.find(binary_img, (0, 0), timer, buffers)
+    # Scale the contours back up to full-frame pixels (each small pixel
+    # covers scale x scale full-size pixels, so use the middle of those)
+    origin = np.array(offset, dtype=np.int32) + (scale - 1) // 2
+    contour_list = [contour * scale + origin for contour in contour_list]
+    timer.lap('find_contours')
+    return contour_list, rejected
+
+def find_targets(binary_img, estimator, offset=(0, 0), scale=1,
+        refine=None, timer=perf.NULL_TIMER, extractor=CONTOUR_BLOBS, buffers=None, classes=()):
+    """Find the targets in a binary image and estimate their pose.
+
+    The binary image can be a window of the full frame starting at offset,
+    and can be downscaled by scale, in which case the contours (and so all
+    the results) are still in full-frame pixels. Each target is passed
+    through refine (if given) before estimating the pose, which returns it
+    found again at full size, or None to drop it. The
+    contours are kept in the results for annotate(). extractor (see blobs.py)
+    finds the contours, and may reject some blobs before they have any.
+    classes is a list of (TargetClass, thresholded image) of the other
+    target classes (see target_classes.py), whose targets are found in the
+    same pass of the contour filter and kept in results['classes'].
+    """
+
+    # Find contours in the binary image
+    contour_list, rejected = find_contours(binary_img, extractor, offset, scale, timer, buffers)
+
+    # And in the images of the other classes (only closed now, as they can share scratch images)
+    groups = [(TARGET_FILTER if refine is None else PYRAMID_FILTER, contour_list)]
+    for target_class, class_img in classes:
+        class_img = target_class.extractor.close(class_img, timer, buffers)
+        class_contours, _ = find_contours(class_img, target_class.extractor, offset, scale, timer, buffers)
+        groups.append((target_class.filter, class_contours))
+
+    # Keep only the contours we want (cheap tests first, on all contours of all classes at once)
+    filtered = contour_filter.apply_all(groups)
+    seen_list, targets, filter_counts = filtered[0]
+    for stage, count in rejected.items():
+        filter_counts[stage] += count
+    if refine is not None:
+        targets = [target for target in map(refine, targets) if target is not None]
+    timer.lap('contour_filter')
 
-def get_temperature():
-    result = subprocess.check_output(['vcgencmd', 'measure_temp'])
-    temperature = float(result.decode('UTF-8')[5:][:-3])
-    return temperature
+    #
+    # Target Loop (runs for each target found in the image)
+    #
 
-def peariscope(camera, inst):
+    # Initialize arrays of results
+    x_list = [] # X-coordinates of found reflectors
+    y_list = [] # Y-coordinates of found reflectors
+    corners_list = []
+
+    for contour, rect_center, corners in targets:
+        rect_x, rect_y = rect_center
+
+        # Add to the lists of results
+        x_list.append(rect_x)
+        y_list.append(rect_y)
+        corners_list.append(corners)
+    timer.lap('target_loop')
+
+    # Estimate the pose of all the targets
+    results = estimator.estimate(corners_list, list(zip(x_list, y_list)))
+    timer.lap('pose')
+
+    results.update({
+        'detected' : True,
+        'x_list' : x_list,
+        'y_list' : y_list,
+        'corners_list' : corners_list,
+        'seen_list' : seen_list,
+        'target_contours' : [target[0] for target in targets],
+        'classes' : {target_class.name : class_filtered[1]
+            for (target_class, _), class_filtered in zip(classes, filtered[1:])},
+        'pose_time' : estimator.elapsed_time,
+        'filter_counts' : [filter_counts[stage] for stage in contour_filter.FILTER_STAGES],
+    })
+    return results
+
+def no_detection():
+    """Return the results of a frame where nothing was searched (see target_tracker.py)."""
+    return {
+        'detected' : False,
+        'x_list' : [],
+        'y_list' : [],
+        'corners_list' : [],
+        'target_pos_list' : [],
+        'camera_pos_list' : [],
+        'dist_list' : [],
+        'angle_list' : [],
+        'seen_list' : [],
+        'target_contours' : [],
+        'classes' : {},
+        'window' : None,
+        'pose_time' : 0,
+        'filter_counts' : [0] * len(contour_filter.FILTER_STAGES),
+    }
+
+def publish_results(nt, results, img_width, img_height):
+    """Publish the results of one frame to network tables as separate entries.
+
+    The robot can read these from two different frames, so they are only
+    kept for robot code that does not read the result packet yet (see
+    result_packet.py).
+    """
+    x_list = results['x_list']
+    y_list = results['y_list']
+
+    # Output the results
+    nt.putNumberArray('id_list', results['id_list'])
+    nt.putNumberArray('x_list', x_list)
+    nt.putNumberArray('y_list', y_list)
+
+    # Compute the coordinates as percentage distances from image center
+    x_list_pct = [result_packet.image_percent(x, img_width) for x in x_list]
+    y_list_pct = [result_packet.image_percent(y, img_height) for y in y_list]
+    nt.putNumberArray('x_list_pct', x_list_pct)
+    nt.putNumberArray('y_list_pct', y_list_pct)
+
+    if len(results['target_pos_list']) > 0:
+        nt.putNumberArray('target_pos_list', results['target_pos_list'][0])
+
+    if len(results['camera_pos_list']) > 0:
+        nt.putNumberArray('camera_pos_list', results['camera_pos_list'][0])
+
+    if len(results['angle_list']) > 0:
+        nt.putNumberArray('angle_list', results['angle_list'][0])
+
+    nt.putNumberArray('dist_list', results['dist_list'])
+
+    # Seconds spent estimating the poses of the targets
+    nt.putNumber('pose_time', results['pose_time'])
+
+def detect(input_img, segmenter, estimator, window=None, scale=1,
+        buffers=None, timer=perf.NULL_TIMER, extractor=CONTOUR_BLOBS, classes=()):
+    """Find the targets in the whole image, or only in the (x0, y0, x1, y1) window.
+
+    With scale 2 or 4 the search is done on an image downscaled that much,
+    and then each target is found again at full size in its bounding box. The intermediate images
+    are kept in buffers (a FrameBuffers) to be reused by the next frame.
+    The targets of the other classes (a list of TargetClass) are found in the
+    same image, converted to HSV only once.
+    """
+    if buffers is None:
+        buffers = frame_buffers.FrameBuffers()
+
+    if window is None:
+        x0, y0 = 0, 0
+        search_img = input_img
+    else:
+        x0, y0, x1, y1 = window
+        search_img = input_img[y0:y1, x0:x1]
+
+    refine = None
+    if scale > 1:
+        search_height, search_width = search_img.shape[:2]
+        small_img = buffers.get('small', (search_height // scale, search_width // scale, 3))
+        # Nearest neighbor keeps the pixels' own colors, where averaging would
+        # desaturate the edges of thin targets until they fail the thresholds
+        search_img = cv2.resize(search_img, (search_width // scale, search_height // scale),
+            dst=small_img, interpolation=cv2.INTER_NEAREST)
+        refine = lambda target: refine_target(input_img, segmenter, extractor, target, scale)
+        timer.lap('resize')
+
+    hsv_img = None
+    class_imgs = []
+    if len(classes) > 0:
+        hsv_img = segmentation.to_hsv(search_img, timer, buffers)
+        class_imgs = [(target_class, target_class.segmenter.in_range(hsv_img, timer, buffers,
+            target_class.buffer_name)) for target_class in classes]
+
+    binary_img = segment(search_img, segmenter, extractor, buffers, timer, hsv_img)
+    results = find_targets(binary_img, estimator, (x0, y0), scale, refine, timer, extractor, buffers,
+        class_imgs)
+    results['window'] = window
+    return results
+
+def annotate(output_img, results, scale=1):
+    """Mark up the results of a frame on an image 1/scale the size of the frame.
+
+    scale must be a power of two: the full-frame contours are drawn with
+    fixed-point coordinates (shift) instead of being scaled first, and each
+    kind of mark is drawn with a single call.
+    """
+    shift = scale.bit_length() - 1
+
+    # Show where we looked
+    window = results['window']
+    if window is not None:
+        x0, y0, x1, y1 = window
+        cv2.rectangle(output_img, (x0, y0), (x1-1, y1-1), BGR_BLUE, 1, shift=shift)
+
+    # Color in the contours so we know they were seen
+    if len(results['seen_list']) > 0:
+        cv2.fillPoly(output_img, results['seen_list'], BGR_RED, shift=shift)
+
+    # Color in the successful contours and outline their corners
+    if len(results['corners_list']) > 0:
+        cv2.polylines(output_img, [corners.astype(np.int32) for corners in results['corners_list']], True,
+            (255, 0, 255), max(1, 15 // scale), shift=shift)
+        cv2.fillPoly(output_img, results['target_contours'], BGR_GREEN, shift=shift)
+
+    # Outline the targets of the other classes
+    class_corners = [corners.astype(np.int32)
+        for targets in results['classes'].values() for _, _, corners in targets]
+    if len(class_corners) > 0:
+        cv2.polylines(output_img, class_corners, True, BGR_YELLOW, 2, shift=shift)
+
+    # Draw a circle to mark the center of each target, labeled with its ID
+    for target_id, x, y in zip(results['id_list'], results['x_list'], results['y_list']):
+        cv2.circle(output_img, center=(int(x), int(y)), radius=3 << shift, color=BGR_YELLOW,
+            thickness=-1, shift=shift)
+        cv2.putText(output_img, str(target_id), (int(x) // scale + 5, int(y) // scale - 5),
+            cv2.FONT_HERSHEY_SIMPLEX, 0.4, BGR_YELLOW, 1)
+
+def draw_crosshairs(output_img):
+    """Draw crosshairs through the center of the image."""
+    img_height, img_width = output_img.shape[:2]
+    img_center_x = int(img_width/2)
+    img_center_y = int(img_height/2)
+    cv2.line(output_img, (img_center_x, 0), (img_center_x, img_height-1), BGR_YELLOW, 1)
+    cv2.line(output_img, (0, img_center_y), (img_width-1, img_center_y), BGR_YELLOW, 1)
+
+def render_debug(debug, results, img_width, img_height, buffers):
+    """Mark up the results on a cleared debug frame and send it to the output stream."""
+    output_img = buffers.zeros('debug', debug.shape(img_width, img_height))
+    annotate(output_img, results, debug.scale)
+    draw_crosshairs(output_img)
+    debug.put(output_img)
+
+def render_undistorted(stream, undistorter, input_img, buffers, frame_valid=None):
+    """Undistort (and downscale) a camera frame and send it to its output stream.
+
+    With frame_valid (see frame_bus.BusSink.valid) a frame that was written
+    over while it was undistorted is not sent.
+    """
+    output_img = buffers.get('undistorted', (undistorter.output_size[1], undistorter.output_size[0], 3))
+    output_img = undistorter.undistort(input_img, output_img)
+    if frame_valid is None or frame_valid():
+        stream.put(output_img)
+
+def peariscope(camera, inst, pipelined=False, num_workers=1, record_path=None, trace_alloc=False,
+        name=None, leds=True, thermal_sensor=None, classes=()):
+    """Run the vision code on one camera, forever.
+
+    With a name (when there is a process per camera) the results and settings
+    are in the Peariscope/<name> subtable and the output stream is called
+    Peariscope-<name>. Only the camera with leds set controls the ringlight.
+    thermal_sensor replaces the Pi's own sensor (see thermal.py). classes are
+    the other target classes to look for (see target_classes.py).
+    """
 
     #
     # Setup (runs only once)
@@ -243,49 +612,211 @@ def peariscope(camera, inst):
     print('camera_height: {}, camera_width: {}, fps: {}'.format(
         camera_height, camera_width, camera_fps))
     
-    camera_matrix = np.array([[624.25613979,   0.        , 334.72661579],
-       [  0.        , 620.80019602, 219.02446486],
-       [  0.        ,   0.        ,   1.        ]])
-    distortion_coeffs = np.array([[ 0.19929767, -0.49579213, -0.00794165,  0.00057195, -0.25235623]])
+
+    # Load the calibration for this camera (see camera_calibration.py)
+    calibration = camera_calibration.load_calibration(camera.getName(), camera_width, camera_height)
+
+    # Estimates target poses, starting from the last frame's poses when possible
+    estimator = pose.PoseEstimator(TARGET_POINTS, calibration)
 
     # Create sink for capturing images from the camera video stream
     sink = inst.getVideo()
 
+    # A frame bus sink hands out frames that can be written over while in use (see frame_bus.py)
+    frame_valid = getattr(sink, 'valid', None)
+
     # Preallocate space for new color images
     input_img = np.zeros(shape=(camera_height, camera_width, 3), dtype=np.uint8)
 
+    # Scratch images for every stage, reused from frame to frame
+    buffers = frame_buffers.FrameBuffers()
+
     # Create output stream for sending processed images
-    output_stream = inst.putVideo('Peariscope', camera_width, camera_height)
+    output_stream = inst.putVideo('Peariscope' if name is None else 'Peariscope-' + name,
+        camera_width, camera_height)
+
+    # The marked-up images are only rendered when due and when someone is watching
+    debug = debug_stream.DebugStream(output_stream)
+
+    # The undistorted camera image, if undistort_stream is set (see undistort.py)
+    undistorted = None
+    undistorter = None
+
+    # Optionally record the raw frames for replaying later (see replay.py)
+    frame_recorder = None
+    if record_path is not None:
+        print('Recording frames to', record_path)
+        frame_recorder = recorder.FrameRecorder(record_path, camera_width, camera_height, camera_fps,
+            camera.getName())
 
     # Use network tables to receive configuration and publish results
-    nt = networktables.NetworkTables.getTable('Peariscope')
+    nt = networktables.NetworkTables.getTable('Peariscope' if name is None else 'Peariscope/' + name)
     time.sleep(1) # Wait for network tables to start
 
-    # Set all configuration parameters if not set already
+    # Configuration parameters are kept up to date by a network tables listener
+    settings = config_cache.ConfigCache(nt, DEFAULT_VALS)
     for key, value in DEFAULT_VALS.items():
-        print(key, value)
-        if nt.getNumber(key, None) == None:
-            nt.putNumber(key, value)
+        print(key, getattr(settings, key))
 
     # Set ringlight to initial color
-    red = nt.getNumber('led_red', None)
-    grn = nt.getNumber('led_grn', None)
-    blu = nt.getNumber('led_blu', None)
-    GPIO.setmode(GPIO.BOARD)
-    GPIO.setup(32, GPIO.OUT)
-    ringlight_on(red, grn, blu)
-    p = GPIO.PWM(32, 1000)
-    p.start(0)
-    p.ChangeDutyCycle(80)
+    red = settings.led_red
+    grn = settings.led_grn
+    blu = settings.led_blu
+    if leds:
+        ringlight_on(red, grn, blu)
+        ringlight.set_duty_cycle(80)
 
     # while True:
     #     for dc in range(0, 101, 5):
-    #         p.ChangeDutyCycle(dc)
+    #         ringlight.set_duty_cycle(dc)
     #         time.sleep(0.1)
     #     for dc in range(100, -1, -5):
-    #         p.ChangeDutyCycle(dc)
+    #         ringlight.set_duty_cycle(dc)
     #         time.sleep(0.1)
 
+    nt.putStringArray('filter_stages', contour_filter.FILTER_STAGES)
+
+    # Search near the last targets when roi_refresh is set
+    tracker = roi.RoiTracker()
+
+    # Stage timing is only done when perf_rate is set
+    stage_timer = perf.StageTimer(nt.getSubTable('perf'))
+    timer = perf.NULL_TIMER
+
+    # Capture times in the robot's clock, and the recent poses by capture time (see pose_history.py)
+    clock = pose_history.RobotClock(nt)
+    history = pose_history.PoseHistory()
+    history.serve(nt)
+
+    # Trades resolution and frame rate to meet latency_budget (see governor.py)
+    frame_governor = governor.Governor(camera, nt, camera_fps)
+
+    # Stable IDs and smoothed poses for the targets (see target_tracker.py)
+    tracks = target_tracker.TargetTracker()
+
+    # Results go out as one packet per frame (see result_packet.py)
+    publisher = result_packet.ResultPublisher(nt)
+    class_publishers = [target_classes.ClassPublisher(nt.getSubTable(target_class.name), target_class)
+        for target_class in classes]
+    legacy_results = True
+    def publish(results, frame_time, capture_time, elapsed_time, fps, img_width, img_height):
+        """Publish the results of a frame, and return them with the tracked targets."""
+        results = tracks.update(results, capture_time)
+        latency = clock.now() - capture_time
+        robot_capture_time = clock.to_robot(capture_time)
+        history.add(robot_capture_time, results)
+        frame_governor.update(latency, len(results['x_list']) > 0)
+
+        if legacy_results:
+            publish_results(nt, results, img_width, img_height)
+            nt.putNumber('elapsed_time', elapsed_time)
+            nt.putNumber('fps', fps)
+            nt.putNumber('latency', latency)
+
+        # Number of contours rejected by each filter stage (named in filter_stages)
+        nt.putNumberArray('filter_counts', results['filter_counts'])
+
+        # The other target classes, from frames that were searched in full
+        if results['detected'] and results['window'] is None:
+            for class_publisher in class_publishers:
+                class_publisher.publish(results['classes'].get(class_publisher.target_class.name, []),
+                    frame_time, img_width, img_height)
+
+        # Last, so the flush sends everything above with the packet
+        publisher.publish(results, frame_time, robot_capture_time, latency, elapsed_time, fps,
+            img_width, img_height)
+        return results
+
+    # Temperature and throttling are sampled in the background
+    monitor = thermal.ThermalMonitor(nt, thermal_sensor)
+    monitor.start()
+
+    settings_version = None
+    thermal_level = thermal.NORMAL
+    segmenter = None
+    extractor = None
+    pyramid_scale = 1
+    def read_config():
+        nonlocal settings_version, thermal_level, segmenter, pyramid_scale, red, grn, blu, timer, legacy_results
+        nonlocal undistorted, undistorter, extractor
+
+        # Only rebuild the thresholds and LED state when something changed
+        if settings.version == settings_version and monitor.level == thermal_level:
+            return segmenter, extractor, max(pyramid_scale, frame_governor.scale)
+        settings_version, vals = settings.snapshot()
+        thermal_level = monitor.level
+        monitor.warm, monitor.hot = vals['thermal_warm'], vals['thermal_hot']
+        if pipelined:
+            unsupported = [key for key, off in PIPELINED_OFF.items() if vals[key] != off]
+            if len(unsupported) > 0:
+                print('not supported when pipelined, ignored:', ', '.join(unsupported), file=sys.stderr)
+        vals = thermal_settings(vals, thermal_level)
+        if pipelined:
+            vals = dict(vals, **PIPELINED_OFF) # Also the roi_refresh of thermal_settings
+
+        # Configuration values for color detection (the lookup table is only
+        # rebuilt if the thresholds or the segmentation settings changed)
+        lower = (vals['min_hue'], vals['min_sat'], vals['min_val'])
+        upper = (vals['max_hue'], vals['max_sat'], vals['max_val'])
+        segmenter = segmentation.make_segmenter(vals['segmentation'], lower, upper,
+            vals['lut_bits'], segmenter)
+        extractor = blobs.make_blobs(vals['blob_extraction'], TARGET_FILTER, extractor)
+
+        # Ringlight control (only if changes are requested)
+        led_red, led_grn, led_blu = vals['led_red'], vals['led_grn'], vals['led_blu']
+        if leds and (led_red != red or led_grn != grn or led_blu != blu):
+            red, grn, blu = led_red, led_grn, led_blu
+            ringlight_on(red, grn, blu)
+
+        pyramid_scale = max(1, vals['pyramid_scale'])
+        if pyramid_scale > MAX_PYRAMID_SCALE:
+            print('pyramid_scale {} is not supported, using {}'.format(pyramid_scale, MAX_PYRAMID_SCALE),
+                file=sys.stderr)
+            pyramid_scale = MAX_PYRAMID_SCALE
+
+        estimator.solver = vals['pnp_solver']
+        estimator.track = vals['pnp_track']
+
+        tracker.refresh = vals['roi_refresh']
+        tracker.margin = vals['roi_margin']
+
+        stage_timer.rate = vals['perf_rate']
+        timer = stage_timer if stage_timer.rate > 0 else perf.NULL_TIMER
+
+        debug.fps = vals['debug_fps']
+        debug.scale = vals['debug_scale'] if vals['debug_scale'] in (1, 2, 4) else 1
+
+        legacy_results = vals['legacy_results']
+
+        # The undistorted stream is made the first time it is asked for, and
+        # its remap tables whenever its scale changes
+        if vals['undistort_stream']:
+            if undistorted is None:
+                undistorted = debug_stream.DebugStream(inst.putVideo(
+                    'Peariscope-undistorted' if name is None else 'Peariscope-undistorted-' + name,
+                    camera_width, camera_height))
+            undistorted.fps, undistorted.scale = debug.fps, debug.scale
+            if undistorter is None or undistorter.scale != debug.scale:
+                undistorter = undistort.Undistorter(calibration, debug.scale)
+        elif undistorted is not None:
+            undistorted.fps = 0
+
+        frame_governor.budget = vals['latency_budget']
+
+        tracks.enabled = vals['track_targets']
+        tracks.detect_every = max(1, vals['detect_every'])
+        tracks.confirm = vals['track_confirm']
+
+        return segmenter, extractor, max(pyramid_scale, frame_governor.scale)
+
+    if pipelined:
+        peariscope_pipelined(sink, output_stream, debug, nt, read_config, publish, clock,
+            camera_width, camera_height, estimator, num_workers, frame_recorder, classes)
+        return
+
+    # Optionally check how much memory each frame allocates (slow)
+    alloc_counter = perf.AllocationCounter() if trace_alloc else None
+
     #
     # Image Loop (runs for each image from the camera)
     #
@@ -294,196 +825,251 @@ def peariscope(camera, inst):
     while True: # Forever loop
         start_time = current_time
 
-        # Publish the temperature of the pi
-        # nt.putNumber('temperature', get_temperature())
-
-        # Get configuration values for LED lights
-        led_red = nt.getNumber('led_red', None)
-        led_grn = nt.getNumber('led_grn', None)
-        led_blu = nt.getNumber('led_blu', None)
-
-        # Get configuration values for color detection
-        min_hue = nt.getNumber('min_hue', None)
-        max_hue = nt.getNumber('max_hue', None)
-        min_sat = nt.getNumber('min_sat', None)
-        max_sat = nt.getNumber('max_sat', None)
-        min_val = nt.getNumber('min_val', None)
-        max_val = nt.getNumber('max_val', None)
-
-        # Ringlight control (only if changes are requested)
-        if led_red != red or led_grn != grn or led_blu != blu:
-            red, grn, blu = led_red, led_grn, led_blu
-            ringlight_on(red, grn, blu)
+        segmenter, extractor, pyramid_scale = read_config()
+        timer.start()
+        if alloc_counter is not None:
+            alloc_counter.start()
 
         # Grab a frame from the camera and store it in the preallocated space
         frame_time, input_img = sink.grabFrame(input_img)
+        timer.lap('grab')
 
         # If there is an error then notify the output and skip this iteration
         if frame_time == 0:
             output_stream.notifyError(sink.getError())
             continue
+        capture_time = clock.capture_time(frame_time)
 
-        # Publish the image size
-        img_height, img_width = input_img.shape[:2]
-        nt.putNumber('image_height', img_height)
-        nt.putNumber('image_width', img_width)
-        img_center_x = int(img_width/2)
-        img_center_y = int(img_height/2)
-
-        # Segment the image based on hue, saturation, and value ranges
-        hsv_img = cv2.cvtColor(input_img, cv2.COLOR_BGR2HSV)
-        binary_img = cv2.inRange(hsv_img, (min_hue, min_sat, min_val), (max_hue, max_sat, max_val))
-
-        # Closing (fill in any gaps)
-        binary_img = cv2.dilate(binary_img, None, iterations=2)
-        binary_img = cv2.erode(binary_img, None, iterations=2)
+        if frame_recorder is not None:
+            frame_recorder.write(frame_time, input_img)
 
-        # Create an output image for display
-        output_img = np.zeros_like(input_img)
-        # output_img[:] = BGR_BLUE
-
-        # Find contours in the binary image
-        _, contour_list, _ = cv2.findContours(binary_img, mode=cv2.RETR_EXTERNAL, method=cv2.CHAIN_APPROX_SIMPLE)
-
-        #
-        # Contour Loop (runs for each contour in the image)
-        #
-
-        # Initialize arrays of results
-        x_list = [] # X-coordinates of found reflectors
-        y_list = [] # Y-coordinates of found reflectors
-        
-        target_pos_list = []
-        camera_pos_list = []
-        dist_list = []
-        angle_list = []
-
-        
-
-        # For each contour of every object...
-        for contour in contour_list:
-            # Compute the area of the contour
-            area = cv2.contourArea(contour)
-            if area < 10:
-                continue # Immediately eliminate small contours
-            # Color in the contour so we know it was seen
-            cv2.drawContours(output_img, [contour], 0, color=BGR_RED, thickness=-1)
-
-            # Compute the rotated rectangle surrounding the contour
-            rect = cv2.minAreaRect(contour)
-            rect_center, rect_size, rect_angle = rect
-            rect_x, rect_y = rect_center
-            rect_width, rect_height = rect_size
-            rect_angle = -rect_angle # Horizontal is 0 degrees, CCW is positive
-            if rect_width >= rect_height:
-                rect_long, rect_short = rect_width, rect_height
+        img_height, img_width = input_img.shape[:2]
+        # Put back if the frame turns out to be torn
+        previous_poses, roi_count = estimator.previous, tracker.count
+        full_detection = tracks.full_detection_due()
+        if full_detection:
+            results = detect(input_img, segmenter, estimator,
+                tracker.next_window(), pyramid_scale, buffers, timer, extractor, classes)
+        else:
+            # In between, only search around where the tracks are predicted to be (if at all)
+            window = None
+            if tracks.confirm:
+                window = roi.window_around(tracks.predicted_corners(capture_time), tracker.margin,
+                    img_width, img_height)
+            if window is None:
+                results = no_detection()
             else:
-                rect_long, rect_short = rect_height, rect_width
-                rect_angle += 90
-            # Keep the angle between -90 and +90 degrees
-            if rect_angle > 90:
-                rect_angle -= 180
-
-            # Ratio of long side to short side of rotated rectangle
-            ratio = rect_long / rect_short
-
-            # Compute the fill of the contour
-            fill = area / (rect_long * rect_short)
-
-            # Keep only the contours we want
-            corners = cv2.convexHull(contour)
-            corners = cv2.approxPolyDP(corners, 0.015 * cv2.arcLength(contour, True), True)
-            
-            if (150 < area) and (-20 < rect_angle < 20) and (ratio > 1.5) and (fill < 0.25) and len(corners) == 4:
-                cv2.drawContours(output_img, [corners], 0, (255, 0, 255), thickness=15)
-                # Color in the successful contour
-                cv2.drawContours(output_img, [contour], 0, color=BGR_GREEN, thickness=-1)
-
-                # Draw rotated rectangle
-                # cv2.drawContours(output_img, [np.int0(cv2.boxPoints(rect))], 0, BGR_YELLOW, 2)
-
-                # Draw a circle to mark the center
-                cv2.circle(output_img, center=(int(rect_x), int(rect_y)), radius=3, color=BGR_YELLOW, thickness=-1)
-
-                # Add to the lists of results
-                x_list.append(rect_x)
-                y_list.append(rect_y)
-
-                _, rvec, tvec = cv2.solvePnP(TARGET_POINTS, corners.astype(np.float64), camera_matrix, distortion_coeffs)
-
-                rot, _ = cv2.Rodrigues(rvec)
-                
-                x = tvec[0][0]
-                z = tvec[1][0] * np.sin(math.pi/12) + tvec[2][0] * np.sin(math.pi/12)
-                
-                angle1 = np.arctan2(x, z)
-                rot_t = rot.transpose()
-                pzero_world = np.matmul(rot_t, -tvec)
-                x_from_target = pzero_world[0][0]
-                z_from_target = pzero_world[2][0]
-                angle2 = np.arctan2(pzero_world[0][0], pzero_world[2][0])
-                
-                target_pos_list.append([x, z])
-                camera_pos_list.append([x_from_target, z_from_target])
-                dist_list.append(math.sqrt(x**2 + z**2))   
-                angle_list.append([angle1, angle2])
+                results = detect(input_img, segmenter, estimator, window, pyramid_scale, buffers, timer,
+                    extractor, classes)
+
+        # A frame bus frame written over during detection leaves no trace (the
+        # ROI, tracks, and pose guesses only take whole frames)
+        if frame_valid is not None and not frame_valid():
+            output_stream.notifyError('the frame was written over while it was processed')
+            estimator.previous, tracker.count = previous_poses, roi_count
+            timer.discard()
+            current_time = time.time()
+            continue
+        if full_detection:
+            tracker.update(results['corners_list'], img_width, img_height)
 
         #
         # Outputs
         #
 
-        # Output the results
-        nt.putNumberArray('x_list', x_list)
-        nt.putNumberArray('y_list', y_list)
-
-        # Compute the coordinates as percentage distances from image center
-        # for x (horizontal), 0 is center, -100 is image left, 100 is image right
-        # for y (vertical), 0 is center, -100 is image top, 100 is image bottom
-        x_list_pct = [(x-img_width/2)/(img_width/2)*100 for x in x_list]
-        y_list_pct = [(y-img_height/2)/(img_height/2)*100 for y in y_list]
-        x_list_pct = [round(x, 1) for x in x_list_pct]
-        y_list_pct = [round(y, 1) for y in y_list_pct]
-        nt.putNumberArray('x_list_pct', x_list_pct)
-        nt.putNumberArray('y_list_pct', y_list_pct)
-        
-        if len(target_pos_list) > 0:
-            target_pos_list = target_pos_list[0]
-            nt.putNumberArray('target_pos_list', target_pos_list)
-        
-        if len(camera_pos_list) > 0:
-            camera_pos_list = camera_pos_list[0]
-            nt.putNumberArray('camera_pos_list', camera_pos_list)
-            
-        if len(angle_list) > 0:
-            angle_list = angle_list[0]
-            nt.putNumberArray('angle_list', angle_list)
-            
-        nt.putNumberArray('dist_list', dist_list)
-
-        # Draw crosshairs on the image
-        cv2.line(output_img, (img_center_x, 0), (img_center_x, img_height-1), BGR_YELLOW, 1)
-        cv2.line(output_img, (0, img_center_y), (img_width-1, img_center_y), BGR_YELLOW, 1)
-
-        # Display the marked-up image on a separate output stream
-        output_stream.putFrame(output_img)
-
-        # Compute the elapsed time and FPS
+        # Elapsed time is for the whole loop, so FPS is the frame rate
         current_time = time.time()
         elapsed_time = current_time - start_time
         fps = 1/elapsed_time
-        nt.putNumber('elapsed_time', elapsed_time)
-        nt.putNumber('fps', fps)
+        results = publish(results, frame_time, capture_time, elapsed_time, fps, img_width, img_height)
+        timer.lap('publish')
+
+        # Display the marked-up image on a separate output stream (when due)
+        if debug.due():
+            render_debug(debug, results, img_width, img_height, buffers)
+            timer.lap('debug_stream')
+        if undistorted is not None and undistorted.due():
+            render_undistorted(undistorted, undistorter, input_img, buffers, frame_valid)
+            timer.lap('undistorted_stream')
+        timer.finish()
+        if alloc_counter is not None:
+            nt.putNumber('alloc_bytes', alloc_counter.finish())
+
+def peariscope_pipelined(sink, output_stream, debug, nt, read_config, publish_frame, clock,
+        camera_width, camera_height, estimator, num_workers, frame_recorder=None, classes=()):
+    """Run the image loop as capture, process, and publish threads.
+
+    The stages are connected by latest-frame-wins queues, so when processing
+    falls behind the camera the stale frames are dropped instead of queued.
+    Each worker has its own pose estimator, with the settings of estimator.
+    The settings in PIPELINED_OFF are not supported (read_config turns them
+    off).
+    """
+    print('Running pipelined with {} worker(s)'.format(num_workers))
+
+    # Enough images for one being captured, one queued, and one per worker
+    pool = pipeline.BufferPool(num_workers + 3, (camera_height, camera_width, 3))
+
+    # Each worker has its own scratch images and pose estimator, and the publish stage its own scratch
+    # images (for the debug frames)
+    worker = threading.local()
+    publish_buffers = frame_buffers.FrameBuffers()
+
+    frame_queue = pipeline.LatestQueue(on_drop=lambda frame: pool.release(frame.img))
+    result_queue = pipeline.LatestQueue(maxsize=num_workers)
+
+    seq = 0
+    def capture():
+        nonlocal seq
+        segmenter, extractor, pyramid_scale = read_config()
+
+        # Grab a frame from the camera and store it in a free image
+        img = pool.acquire()
+        frame_time, img = sink.grabFrame(img)
+
+        # If there is an error then notify the output and skip this frame
+        if frame_time == 0:
+            output_stream.notifyError(sink.getError())
+            pool.release(img)
+            return None
+        capture_time = clock.capture_time(frame_time)
+
+        if frame_recorder is not None:
+            frame_recorder.write(frame_time, img)
+
+        seq += 1
+        frame = pipeline.Frame(seq, frame_time, img)
+        frame.capture_time = capture_time
+        frame.segmenter = segmenter
+        frame.extractor = extractor
+        frame.pyramid_scale = pyramid_scale
+        frame.solver, frame.track = estimator.solver, estimator.track
+        return frame
+
+    def process(frame):
+        if not hasattr(worker, 'buffers'):
+            worker.buffers = frame_buffers.FrameBuffers()
+            # Its last poses and pose time are from this worker's own frames
+            worker.estimator = pose.PoseEstimator(estimator.target_points, estimator.calibration)
+        worker.estimator.solver, worker.estimator.track = frame.solver, frame.track
+
+        frame.img_height, frame.img_width = frame.img.shape[:2]
+        frame.results = detect(frame.img, frame.segmenter,
+            worker.estimator, scale=frame.pyramid_scale, buffers=worker.buffers, extractor=frame.extractor,
+            classes=classes)
+
+        # The input image is no longer needed so give it back to the capture stage
+        pool.release(frame.img)
+        frame.img = None
+        return frame
+
+    last_seq = 0
+    last_time = time.time()
+    def publish(frame):
+        nonlocal last_seq, last_time
+
+        # With several workers a result can finish after a newer one
+        if frame.seq <= last_seq:
+            return None
+        last_seq = frame.seq
+
+        # Elapsed time is from grab to publish, FPS is the publish rate
+        img_height, img_width = frame.img_height, frame.img_width
+        current_time = time.time()
+        frame.results = publish_frame(frame.results, frame.frame_time, frame.capture_time,
+            current_time - frame.grab_time, 1/(current_time - last_time), img_width, img_height)
+        last_time = current_time
+
+        # Display the marked-up image on a separate output stream (when due)
+        if debug.due():
+            render_debug(debug, frame.results, img_width, img_height, publish_buffers)
+        return frame
+
+    stages = [pipeline.Stage('capture', capture, outbox=frame_queue)]
+    for i in range(num_workers):
+        stages.append(pipeline.Stage('process{}'.format(i), process, inbox=frame_queue, outbox=result_queue))
+    stages.append(pipeline.Stage('publish', publish, inbox=result_queue))
+
+    def report(stage_fps, dropped):
+        process_fps = sum(fps for name, fps in stage_fps.items() if name.startswith('process'))
+        print("capture {:.1f} fps, process {:.1f} fps, publish {:.1f} fps, dropped {}".format(
+            stage_fps['capture'], process_fps, stage_fps['publish'], dropped))
+        nt.putNumber('capture_fps', stage_fps['capture'])
+        nt.putNumber('process_fps', process_fps)
+        nt.putNumber('publish_fps', stage_fps['publish'])
+        nt.putNumber('dropped_frames', dropped)
+
+    pipeline.run_pipeline(stages, [frame_queue, result_queue], report)
+
+def peariscope_camera(index, args):
+    """Run the vision code on the camera at index, in its own process (see multi_camera.py)."""
+    camera, inst = multi_camera.init_camera(index)
+    name = camera.getName()
+    record_path = None if args.record is None else os.path.join(args.record, name)
+
+    # The first camera is the one with the ringlight
+    classes = target_classes.load_classes(args.classes) if args.classes else ()
+    peariscope(camera, inst, args.pipelined, args.workers, record_path, args.trace_alloc,
+        name, leds=(index == 0), classes=classes)
+
+def peariscope_bus(args):
+    """Run the vision code on the frames of a camera's frame bus, forever (see frame_bus.py)."""
+    import peariscope.src.frame_bus as frame_bus # Needs Python 3.8 or later
+
+    mcs.init(start_cameras=False) # The capture process has the camera
+    bus = frame_bus.FrameBus.attach(frame_bus.bus_name(args.bus))
+    sink = frame_bus.BusSink(bus)
+    inst = multi_camera.BusStreams(CameraServer.getInstance(), sink, args.port)
+    classes = target_classes.load_classes(args.classes) if args.classes else ()
+    peariscope(frame_bus.BusCamera(bus, args.bus), inst, record_path=args.record, trace_alloc=args.trace_alloc,
+        classes=classes)
 
 #######################
 # End Peariscope Code #
 #######################
 
 if __name__ == "__main__":
-    if len(sys.argv) >= 2:
-        mcs.configFile = sys.argv[1]
+    parser = argparse.ArgumentParser(description='Run the Peariscope vision pipeline')
+    parser.add_argument('config', nargs='?', default=mcs.configFile)
+    parser.add_argument('--pipelined', '-p', action='store_true',
+        help='run capture, processing, and publishing on separate threads')
+    parser.add_argument('--workers', '-w', type=int, default=1,
+        help='number of processing threads when pipelined')
+    parser.add_argument('--record', '-r', metavar='DIR',
+        help='record the raw camera frames to this directory (see replay.py)')
+    parser.add_argument('--trace-alloc', action='store_true',
+        help='report the memory allocated per frame with tracemalloc (slow)')
+    parser.add_argument('--all-cameras', '-a', action='store_true',
+        help='process every camera, each in its own process')
+    parser.add_argument('--defaults', '-d', metavar='FILE',
+        help='JSON file of default values, e.g. thresholds from tune_thresholds.py')
+    parser.add_argument('--classes', '-c', metavar='FILE',
+        help='JSON file of other target classes to look for (see target_classes.py)')
+    parser.add_argument('--bus', '-b', metavar='CAMERA',
+        help="read the camera's frames from its frame bus instead of opening it (see frame_bus.py)")
+    parser.add_argument('--port', type=int, default=multi_camera.BASE_PORT + 1,
+        help='port of the output stream with --bus (the capture process serves the camera stream)')
+    args = parser.parse_args()
+    if args.trace_alloc and args.pipelined:
+        parser.error('--trace-alloc only works without --pipelined')
+    if args.bus and (args.pipelined or args.all_cameras):
+        parser.error('--bus only works without --pipelined and --all-cameras')
+    mcs.configFile = args.config
+    if args.defaults:
+        load_defaults(args.defaults)
+
+    if args.all_cameras:
+        print("Peariscope", "configFile", mcs.configFile, "(all cameras)")
+        multi_camera.run_cameras(peariscope_camera, args)
+
+    if args.bus:
+        print("Peariscope", "configFile", mcs.configFile, "(frame bus of '{}')".format(args.bus))
+        peariscope_bus(args)
 
     mcs.init()
     print("Peariscope", "team", mcs.team, "server", mcs.server, "configFile", mcs.configFile)
 
-    # Peariscope uses only the first (non-switched) camera and its instance
-    peariscope(mcs.cameras[0], mcs.insts[0])
+    # Otherwise Peariscope uses only the first (non-switched) camera and its instance
+    classes = target_classes.load_classes(args.classes) if args.classes else ()
+    peariscope(mcs.cameras[0], mcs.insts[0], args.pipelined, args.workers, args.record, args.trace_alloc,
+        classes=classes)
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+# Per-stage timing for the frame loop, published to network tables.
+#
+# Each frame the loop calls start(), then lap('stage') after each stage, and
+# finish() at the end. The timer keeps the last WINDOW times of every stage
+# and publishes [p50, p95, p99] in milliseconds under the Peariscope/perf
+# subtable, e.g. Peariscope/perf/segment.
+#
+# NULL_TIMER has the same methods but does nothing, so the instrumentation
+# can stay in the loop at competition with no measurable cost.
+#
+# AllocationCounter uses tracemalloc to check how much memory each frame
+# allocates, which should be next to nothing once the scratch images (see
+# frame_buffers.py) exist. tracemalloc slows down every allocation, so it is
+# only for checking the loop (--trace-alloc), not for competition.
+
+import time
+import collections
+import tracemalloc
+import numpy as np
+
+WINDOW = 300 # Frames kept for the rolling percentiles (10 seconds at 30 fps)
+
+class StageTimer:
+    """Times the stages of each frame and publishes rolling percentiles."""
+    def __init__(self, table, rate=1.0, window=WINDOW):
+        self.table = table
+        self.rate = rate # How many times per second to publish
+        self.window = window
+        self.samples = {} # Stage name -> deque of recent times (ns)
+        self.frame = {} # Stage name -> time in the current frame (ns)
+        self.frame_start = 0
+        self.last = 0
+        self.last_publish = 0
+
+    def clock(self):
+        return time.perf_counter_ns()
+
+    def start(self):
+        """Start timing a new frame (dropping any unfinished one)."""
+        self.frame.clear()
+        self.frame_start = self.last = time.perf_counter_ns()
+
+    def lap(self, name):
+        """Charge the time since the last lap (or start) to a stage."""
+        now = time.perf_counter_ns()
+        self.frame[name] = self.frame.get(name, 0) + now - self.last
+        self.last = now
+
+    def add(self, name, ns):
+        """Charge a separately measured time to a stage (e.g. one call in a loop)."""
+        self.frame[name] = self.frame.get(name, 0) + ns
+
+    def discard(self):
+        """Drop the current frame without recording it (e.g. a torn frame)."""
+        self.frame.clear()
+
+    def finish(self):
+        """Record the current frame and publish if it is time to."""
+        now = time.perf_counter_ns()
+        self.frame['total'] = now - self.frame_start
+        for name, ns in self.frame.items():
+            if name not in self.samples:
+                self.samples[name] = collections.deque(maxlen=self.window)
+            self.samples[name].append(ns)
+        self.frame.clear()
+
+        if self.rate > 0 and now - self.last_publish >= 1e9 / self.rate:
+            self.last_publish = now
+            self.publish()
+
+    def percentiles(self):
+        """Return stage name -> [p50, p95, p99] in milliseconds."""
+        return {name: list(np.percentile(samples, [50, 95, 99]) / 1e6)
+            for name, samples in self.samples.items() if len(samples) > 0}
+
+    def publish(self):
+        for name, values in self.percentiles().items():
+            self.table.putNumberArray(name, values)
+
+class NullTimer:
+    """A timer that does nothing, used when timing is disabled."""
+    def clock(self):
+        return 0
+
+    def start(self):
+        pass
+
+    def lap(self, name):
+        pass
+
+    def add(self, name, ns):
+        pass
+
+    def discard(self):
+        pass
+
+    def finish(self):
+        pass
+
+NULL_TIMER = NullTimer()
+
+class AllocationCounter:
+    """Measures the memory allocated during each frame with tracemalloc.
+
+    With Python 3.9 and later this is the peak memory in use during the frame
+    above what was in use at its start, so an image that is allocated and
+    freed within the frame still counts. Older versions only have the net
+    growth over the frame.
+    """
+    def __init__(self, window=WINDOW):
+        self.window = window
+        self.samples = collections.deque(maxlen=window) # Bytes allocated in recent frames
+        self.count = 0
+        self.baseline = 0
+        self.has_peak = hasattr(tracemalloc, 'reset_peak')
+        tracemalloc.start()
+
+    def start(self):
+        if self.has_peak:
+            tracemalloc.reset_peak()
+        self.baseline = tracemalloc.get_traced_memory()[0]
+
+    def finish(self):
+        """Record the current frame and return the bytes it allocated."""
+        current, peak = tracemalloc.get_traced_memory()
+        allocated = max(0, (peak if self.has_peak else current) - self.baseline)
+        self.samples.append(allocated)
+        self.count += 1
+        if self.count % self.window == 0:
+            print('allocated bytes/frame: p50 {:.0f} max {:.0f} (last {} frames)'.format(
+                np.percentile(self.samples, 50), max(self.samples), len(self.samples)))
+        return allocated
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+# Building blocks for running the Peariscope frame loop as a pipeline of
+# threads (capture -> process -> publish) instead of one stage after another.
+# OpenCV releases the GIL while it works, so the stages run on separate cores.
+
+import collections
+import queue
+import threading
+import time
+
+import numpy as np
+
+class Frame:
+    """A frame moving through the pipeline, plus whatever the stages attach."""
+    def __init__(self, seq, frame_time, img):
+        self.seq = seq # Sequence number assigned by the capture stage
+        self.frame_time = frame_time # Timestamp from sink.grabFrame
+        self.grab_time = time.time() # When the frame entered the pipeline
+        self.img = img
+
+class BufferPool:
+    """A fixed set of preallocated images handed out to the capture stage."""
+    def __init__(self, count, shape, dtype=np.uint8):
+        self.free = queue.Queue()
+        for _ in range(count):
+            self.free.put(np.zeros(shape=shape, dtype=dtype))
+
+    def acquire(self):
+        return self.free.get()
+
+    def release(self, img):
+        if img is not None:
+            self.free.put(img)
+
+class LatestQueue:
+    """A bounded queue where the newest item wins.
+
+    When the queue is full the oldest item is dropped (and passed to on_drop)
+    so that a slow consumer always gets the most recent frame instead of a
+    backlog of stale ones.
+    """
+    def __init__(self, maxsize=1, on_drop=None):
+        self.items = collections.deque()
+        self.maxsize = maxsize
+        self.on_drop = on_drop
+        self.dropped = 0
+        self.cond = threading.Condition()
+
+    def put(self, item):
+        dropped = None
+        with self.cond:
+            if len(self.items) >= self.maxsize:
+                dropped = self.items.popleft()
+                self.dropped += 1
+            self.items.append(item)
+            self.cond.notify()
+        if dropped is not None and self.on_drop is not None:
+            self.on_drop(dropped)
+
+    def get(self, timeout=None):
+        """Return the oldest queued item, or None if the timeout expires."""
+        with self.cond:
+            if not self.cond.wait_for(lambda: len(self.items) > 0, timeout):
+                return None
+            return self.items.popleft()
+
+class Stage(threading.Thread):
+    """A thread that repeatedly applies func to items from inbox.
+
+    A stage without an inbox is a source (func is called with no arguments).
+    Whatever func returns is put in the outbox; returning None means there is
+    nothing to pass on (an error frame or a stale result).
+    """
+    def __init__(self, name, func, inbox=None, outbox=None):
+        super().__init__(name=name, daemon=True)
+        self.func = func
+        self.inbox = inbox
+        self.outbox = outbox
+        self.count = 0 # Items completed by this stage
+        self.error = None
+
+    def run(self):
+        try:
+            while True:
+                if self.inbox is None:
+                    result = self.func()
+                else:
+                    item = self.inbox.get(timeout=1)
+                    if item is None:
+                        continue
+                    result = self.func(item)
+                if result is None:
+                    continue
+                self.count += 1
+                if self.outbox is not None:
+                    self.outbox.put(result)
+        except Exception as err:
+            self.error = err
+            raise
+
+def run_pipeline(stages, queues, report, interval=1.0):
+    """Start the stages and call report(stage_fps, dropped) every interval.
+
+    stage_fps maps each stage name to the number of items it completed per
+    second and dropped is the total number of frames discarded by the queues.
+    Runs forever, or raises RuntimeError if one of the stages dies.
+    """
+    for stage in stages:
+        stage.start()
+
+    last_counts = {stage.name: 0 for stage in stages}
+    last_time = time.time()
+    while True:
+        time.sleep(interval)
+        for stage in stages:
+            if not stage.is_alive():
+                raise RuntimeError("pipeline stage '{}' stopped: {}".format(
+                    stage.name, stage.error))
+
+        current_time = time.time()
+        elapsed_time = current_time - last_time
+        stage_fps = {}
+        for stage in stages:
+            count = stage.count
+            stage_fps[stage.name] = (count - last_counts[stage.name]) / elapsed_time
+            last_counts[stage.name] = count
+        last_time = current_time
+
+        report(stage_fps, sum(q.dropped for q in queues))
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+# Pose estimation for the targets found in a frame.
+#
+# When a target was also seen in the previous frame, its last pose is used as
+# the starting point of the iterative solver (useExtrinsicGuess), which then
+# needs only a couple of iterations. Other solvers can be chosen by name; the
+# planar ones (IPPE) suit the flat vision targets. The positions and angles
+# of all the targets are then computed together with numpy.
+
+import sys
+import math
+import time
+import cv2
+import numpy as np
+
+# Solvers by name (the ones missing from older OpenCV versions are left out)
+SOLVERS = {name: getattr(cv2, flag) for name, flag in [
+    ('iterative', 'SOLVEPNP_ITERATIVE'),
+    ('epnp', 'SOLVEPNP_EPNP'),
+    ('ap3p', 'SOLVEPNP_AP3P'),
+    ('ippe', 'SOLVEPNP_IPPE'),
+    ('sqpnp', 'SOLVEPNP_SQPNP'),
+] if hasattr(cv2, flag)}
+
+TRACK_DISTANCE = 40 # Pixels a target center may move between frames and still be the same target
+
+# The camera looks up at 15 degrees
+CAMERA_TILT = math.pi/12
+
+# The corners are undistorted and normalized before solving
+IDENTITY_MATRIX = np.eye(3)
+NO_DISTORTION = np.zeros((1, 5))
+
+def rotation_matrices(rvecs):
+    """Rodrigues' formula for an (N, 3) array of rotation vectors, giving (N, 3, 3)."""
+    theta = np.linalg.norm(rvecs, axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        k = np.where(theta[:, None] > 0, rvecs / theta[:, None], 0)
+    K = np.zeros((len(rvecs), 3, 3))
+    K[:, 0, 1], K[:, 0, 2] = -k[:, 2], k[:, 1]
+    K[:, 1, 0], K[:, 1, 2] = k[:, 2], -k[:, 0]
+    K[:, 2, 0], K[:, 2, 1] = -k[:, 1], k[:, 0]
+    sin = np.sin(theta)[:, None, None]
+    cos = np.cos(theta)[:, None, None]
+    return np.eye(3) + sin * K + (1 - cos) * np.matmul(K, K)
+
+class PoseEstimator:
+    """Estimates the pose of each target from its four corners."""
+    def __init__(self, target_points, calibration, solver='iterative', track=True):
+        self.target_points = target_points
+        self.calibration = calibration # See camera_calibration.py
+        self.solver = solver
+        self.track = track # Start from the previous frame's pose when there is one
+        self.previous = [] # (center, rvec, tvec) of the targets in the last frame
+        self.elapsed_time = 0 # Seconds spent in the last call to estimate
+
+    def solver_flag(self):
+        if self.solver not in SOLVERS:
+            print("unknown or unsupported solvePnP solver '{}', using 'iterative'".format(self.solver), file=sys.stderr)
+            self.solver = 'iterative'
+        return SOLVERS[self.solver]
+
+    def guess(self, center):
+        """Return the (rvec, tvec) of the nearest target in the last frame, if close enough."""
+        best = None
+        for previous_center, rvec, tvec in self.previous:
+            gap = math.hypot(previous_center[0] - center[0], previous_center[1] - center[1])
+            if gap <= TRACK_DISTANCE and (best is None or gap < best[0]):
+                best = (gap, rvec, tvec)
+        return None if best is None else best[1:]
+
+    def solve(self, corners, center):
+        # Undistort just the corners, so the solver can work without distortion
+        image_points = self.calibration.normalize_points(corners)
+        flag = self.solver_flag()
+        guess = self.guess(center) if self.track else None
+        if guess is not None:
+            # Only the iterative solver can start from a guess
+            _, rvec, tvec = cv2.solvePnP(self.target_points, image_points, IDENTITY_MATRIX,
+                NO_DISTORTION, guess[0].copy(), guess[1].copy(), True, cv2.SOLVEPNP_ITERATIVE)
+        else:
+            _, rvec, tvec = cv2.solvePnP(self.target_points, image_points, IDENTITY_MATRIX,
+                NO_DISTORTION, flags=flag)
+        return rvec, tvec
+
+    def estimate(self, corners_list, centers):
+        """Return the poses of the targets as a dict of lists (see below)."""
+        start_time = time.perf_counter()
+
+        rvecs = np.zeros((len(corners_list), 3))
+        tvecs = np.zeros((len(corners_list), 3))
+        for i, (corners, center) in enumerate(zip(corners_list, centers)):
+            rvec, tvec = self.solve(corners, center)
+            rvecs[i], tvecs[i] = rvec.ravel(), tvec.ravel()
+        self.previous = [(center, rvecs[i].reshape(3, 1), tvecs[i].reshape(3, 1))
+            for i, center in enumerate(centers)]
+
+        # Target position relative to the camera, on the floor
+        x = tvecs[:, 0]
+        z = tvecs[:, 1] * np.sin(CAMERA_TILT) + tvecs[:, 2] * np.sin(CAMERA_TILT)
+        angle1 = np.arctan2(x, z)
+
+        # Camera position relative to the target: -R^T t
+        camera_pos = -np.einsum('nji,nj->ni', rotation_matrices(rvecs), tvecs)
+        angle2 = np.arctan2(camera_pos[:, 0], camera_pos[:, 2])
+
+        self.elapsed_time = time.perf_counter() - start_time
+        return {
+            'target_pos_list' : np.stack([x, z], axis=1).tolist(),
+            'camera_pos_list' : camera_pos[:, [0, 2]].tolist(),
+            'dist_list' : np.hypot(x, z).tolist(),
+            'angle_list' : np.stack([angle1, angle2], axis=1).tolist(),
+        }
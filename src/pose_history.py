@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+# Latency compensation: when each frame was captured, in the robot's clock,
+# and the poses of the last second or so of frames by capture time.
+#
+# grabFrame's frame_time is in cscore's clock (microseconds). Its offset
+# from our clock is the smallest gap seen between a frame_time and the
+# moment grabFrame returned it. For the robot's clock, the robot code puts
+# its own time (e.g. Timer.getFPGATimestamp()) in Peariscope/robot_time every
+# so often, and the offset is the largest gap seen between that and the
+# moment it arrived here (the sample with the least network delay). Until
+# the robot sends its time, capture times are in the Pi's clock, and the
+# robot can still use the latency in each result packet.
+#
+# To line a pose up with odometry the robot puts a time (in its clock) in
+# Peariscope/pose_query, and the pose of the first target at that time,
+# interpolated between the frames around it, comes back in
+# Peariscope/pose_at as [query time, target_x, target_z, camera_x, camera_z,
+# dist, angle1, angle2] (just [query time] if the time is not covered).
+
+import math
+import time
+import threading
+import collections
+import numpy as np
+from networktables import NetworkTables
+
+CLOCK_WINDOW = 300 # Samples kept for each clock offset
+HISTORY_SIZE = 64 # Frames of poses kept (about 2 seconds at 30 fps)
+MAX_GAP = 0.2 # Seconds between two frames to still interpolate between them
+
+POSE_FIELDS = ['target_x', 'target_z', 'camera_x', 'camera_z', 'dist', 'angle1', 'angle2']
+ANGLE_COLUMNS = [5, 6]
+
+class RobotClock:
+    """Converts frame times to capture times in the robot's clock."""
+    def __init__(self, table, window=CLOCK_WINDOW):
+        self.frame_offsets = collections.deque(maxlen=window) # Our clock - cscore clock (seconds)
+        self.robot_offsets = collections.deque(maxlen=window) # Robot clock - our clock (seconds)
+        self.lock = threading.Lock()
+        table.addEntryListener(self.robotTimeChanged, key='robot_time', localNotify=False)
+
+    def robotTimeChanged(self, table, key, value, isNew):
+        now = time.monotonic()
+        with self.lock:
+            self.robot_offsets.append(float(value) - now)
+
+    def now(self):
+        return time.monotonic()
+
+    def capture_time(self, frame_time):
+        """Return when a frame was captured in our clock (call right after grabFrame)."""
+        frame_seconds = frame_time / 1e6
+        self.frame_offsets.append(time.monotonic() - frame_seconds)
+        return frame_seconds + min(self.frame_offsets)
+
+    def to_robot(self, local_time):
+        """Convert a time in our clock to the robot's clock (if the robot has sent its time)."""
+        with self.lock:
+            offset = max(self.robot_offsets) if len(self.robot_offsets) > 0 else 0
+        return local_time + offset
+
+class PoseHistory:
+    """A ring buffer of the first target's pose in recent frames, by capture time."""
+    def __init__(self, size=HISTORY_SIZE):
+        self.times = np.zeros(size)
+        self.poses = np.zeros((size, len(POSE_FIELDS)))
+        self.count = 0
+        self.next = 0 # Where the next pose goes
+        self.lock = threading.Lock()
+
+    def add(self, capture_time, results):
+        """Remember the pose of the first target in a frame (if there is one)."""
+        if len(results['dist_list']) == 0:
+            return
+        with self.lock:
+            i = self.next
+            self.times[i] = capture_time
+            self.poses[i, 0:2] = results['target_pos_list'][0]
+            self.poses[i, 2:4] = results['camera_pos_list'][0]
+            self.poses[i, 4] = results['dist_list'][0]
+            self.poses[i, 5:7] = results['angle_list'][0]
+            self.next = (i + 1) % len(self.times)
+            self.count = min(self.count + 1, len(self.times))
+
+    def at(self, query_time):
+        """Return the pose (see POSE_FIELDS) at a capture time, or None if it is not covered."""
+        with self.lock:
+            order = (np.arange(self.count) + self.next - self.count) % len(self.times)
+            times = self.times[order]
+            poses = self.poses[order]
+        if len(times) == 0 or query_time < times[0] or query_time > times[-1]:
+            return None
+
+        i = int(np.searchsorted(times, query_time))
+        if times[i] == query_time:
+            return poses[i]
+        if times[i] - times[i-1] > MAX_GAP:
+            return None # The target was lost in between
+
+        # Interpolate, going the short way around for the angles
+        w = (query_time - times[i-1]) / (times[i] - times[i-1])
+        change = poses[i] - poses[i-1]
+        change[ANGLE_COLUMNS] = (change[ANGLE_COLUMNS] + math.pi) % (2 * math.pi) - math.pi
+        return poses[i-1] + w * change
+
+    def serve(self, table):
+        """Answer Peariscope/pose_query with Peariscope/pose_at (see above)."""
+        def queryChanged(table, key, value, isNew):
+            pose = self.at(float(value))
+            table.putNumberArray('pose_at', [value] + ([] if pose is None else pose.tolist()))
+            NetworkTables.flush()
+        table.addEntryListener(queryChanged, key='pose_query', localNotify=False)
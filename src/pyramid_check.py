@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+# Checks the pyramid mode of peariscope_pnp (pyramid_scale 2 or 4) against
+# the full size search on a recording (see recorder.py): the same targets
+# must be found (all but MISS_TOLERANCE of them, and no others), with
+# distances and angles within the tolerances below. peariscope_pnp uses no
+# scale above MAX_PYRAMID_SCALE, the largest that passes.
+#   ./pyramid_check.py /home/pi/recordings/match1 --scale 2
+
+import os
+import sys
+import math
+import time
+import argparse
+import numpy as np
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(os.path.dirname(SRC_DIR))) # For "import peariscope.src..."
+
+from recorder import Recording
+import peariscope.src.frame_buffers as frame_buffers
+import peariscope.src.peariscope_pnp as pnp
+import peariscope.src.segmentation as segmentation
+import peariscope.src.pose as pose
+import peariscope.src.camera_calibration as camera_calibration
+
+DIST_TOLERANCE = 0.02 # Fraction of the full size distance
+ANGLE_TOLERANCE = math.radians(1.0) # Radians, for both angle1 and angle2
+MATCH_DISTANCE = 10 # Pixels between target centers to count as the same target
+MISS_TOLERANCE = 0.05 # Fraction of the full size targets that may be missed
+
+def targets(results):
+    return list(zip(results['x_list'], results['y_list'], results['dist_list'], results['angle_list']))
+
+def compare(full_targets, coarse_targets, scale):
+    """Match targets by center and return (dist errors, angle errors, missed, extra)."""
+    dist_errors, angle_errors = [], []
+    unmatched = list(coarse_targets)
+    missed = 0
+    for x, y, dist, angles in full_targets:
+        best = None
+        for target in unmatched:
+            gap = math.hypot(target[0] - x, target[1] - y)
+            if gap <= MATCH_DISTANCE * scale and (best is None or gap < best[0]):
+                best = (gap, target)
+        if best is None:
+            missed += 1
+            continue
+        unmatched.remove(best[1])
+        _, _, coarse_dist, coarse_angles = best[1]
+        dist_errors.append(abs(coarse_dist - dist) / dist)
+        angle_errors.extend(abs(a - b) for a, b in zip(coarse_angles, angles))
+    return dist_errors, angle_errors, missed, len(unmatched)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Check the pyramid mode against the full size search')
+    parser.add_argument('recording')
+    parser.add_argument('--scale', '-s', type=int, choices=[2, 4], default=2)
+    args = parser.parse_args()
+
+    recording = Recording(args.recording)
+    calibration = camera_calibration.load_calibration(recording.name, recording.width, recording.height)
+    full_estimator = pose.PoseEstimator(pnp.TARGET_POINTS, calibration)
+    coarse_estimator = pose.PoseEstimator(pnp.TARGET_POINTS, calibration)
+    vals = pnp.DEFAULT_VALS
+    segmenter = segmentation.make_segmenter('hsv',
+        (vals['min_hue'], vals['min_sat'], vals['min_val']), (vals['max_hue'], vals['max_sat'], vals['max_val']))
+
+    full_buffers, coarse_buffers = frame_buffers.FrameBuffers(), frame_buffers.FrameBuffers()
+    dist_errors, angle_errors = [], []
+    missed = extra = found = 0
+    full_time = coarse_time = 0
+    for frame in recording.frames:
+        frame = np.array(frame)
+
+        start_time = time.perf_counter()
+        full = pnp.detect(frame, segmenter, full_estimator, buffers=full_buffers)
+        full_time += time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        coarse = pnp.detect(frame, segmenter, coarse_estimator, scale=args.scale, buffers=coarse_buffers)
+        coarse_time += time.perf_counter() - start_time
+
+        errors = compare(targets(full), targets(coarse), args.scale)
+        dist_errors += errors[0]
+        angle_errors += errors[1]
+        missed += errors[2]
+        extra += errors[3]
+        found += len(full['x_list'])
+
+    count = len(recording)
+    print('full size: {:.2f} ms/frame, 1/{} size: {:.2f} ms/frame'.format(
+        full_time / count * 1000, args.scale, coarse_time / count * 1000))
+    print('targets: {} found at full size, {} missed and {} extra at 1/{} size (tolerance {:.0f}% missed)'.format(
+        found, missed, extra, args.scale, MISS_TOLERANCE * 100))
+    if len(dist_errors) == 0:
+        print('no targets to compare')
+        sys.exit(1)
+
+    dist_p95 = np.percentile(dist_errors, 95)
+    angle_p95 = np.percentile(angle_errors, 95)
+    print('distance error: mean {:.2f}% p95 {:.2f}% (tolerance {:.2f}%)'.format(
+        np.mean(dist_errors) * 100, dist_p95 * 100, DIST_TOLERANCE * 100))
+    print('angle error: mean {:.2f} p95 {:.2f} degrees (tolerance {:.2f})'.format(
+        math.degrees(np.mean(angle_errors)), math.degrees(angle_p95), math.degrees(ANGLE_TOLERANCE)))
+    ok = dist_p95 <= DIST_TOLERANCE and angle_p95 <= ANGLE_TOLERANCE and \
+        missed <= MISS_TOLERANCE * found and extra == 0
+    print('PASS' if ok else 'FAIL')
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+# Records raw camera frames so that match conditions can be replayed off the
+# robot (see replay.py).
+#
+# A recording is a directory holding:
+#   recording.json   - camera name, width, height, and pixel format of the frames
+#   frames.raw       - the BGR frames, one after another (height x width x 3 bytes each)
+#   frame_times.raw  - the int64 frame_time from grabFrame for each frame
+# The raw files can be memory-mapped directly with numpy, and a recording that
+# was cut short (e.g. by a power loss) is still readable up to its last frame.
+#
+# Record from the first camera in /boot/frc.json:
+#   ./recorder.py /home/pi/recordings/match1 --frames 900
+
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+
+INFO_NAME = 'recording.json'
+FRAMES_NAME = 'frames.raw'
+FRAME_TIMES_NAME = 'frame_times.raw'
+
+class FrameRecorder:
+    """Appends frames and their frame_time to a recording directory."""
+    def __init__(self, path, width, height, fps=None, name=None):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.shape = (height, width, 3)
+        self.count = 0
+        with open(os.path.join(path, INFO_NAME), 'w') as f:
+            json.dump({'name': name, 'width': width, 'height': height, 'fps': fps, 'format': 'bgr24'}, f)
+        self.frames_file = open(os.path.join(path, FRAMES_NAME), 'wb')
+        self.frame_times_file = open(os.path.join(path, FRAME_TIMES_NAME), 'wb')
+
+    def write(self, frame_time, img):
+        if img.shape != self.shape or img.dtype != np.uint8:
+            raise ValueError("expected a {} uint8 image, got {} {}".format(self.shape, img.shape, img.dtype))
+        self.frames_file.write(np.ascontiguousarray(img).data)
+        self.frame_times_file.write(np.int64(frame_time).tobytes())
+        self.count += 1
+
+    def close(self):
+        self.frames_file.close()
+        self.frame_times_file.close()
+
+class Recording:
+    """A recording opened read-only, with the frames memory-mapped."""
+    def __init__(self, path):
+        with open(os.path.join(path, INFO_NAME)) as f:
+            info = json.load(f)
+        self.path = path
+        self.width = info['width']
+        self.height = info['height']
+        self.fps = info.get('fps')
+        self.name = info.get('name') or 'replay' # Camera name, for finding its calibration
+
+        # Only count frames that were completely written
+        frame_size = self.width * self.height * 3
+        frames_path = os.path.join(path, FRAMES_NAME)
+        frame_times_path = os.path.join(path, FRAME_TIMES_NAME)
+        self.count = min(os.path.getsize(frames_path) // frame_size,
+                         os.path.getsize(frame_times_path) // 8)
+        if self.count == 0:
+            raise ValueError("recording '{}' has no frames".format(path))
+
+        self.frames = np.memmap(frames_path, dtype=np.uint8, mode='r',
+            shape=(self.count, self.height, self.width, 3))
+        self.frame_times = np.fromfile(frame_times_path, dtype=np.int64, count=self.count)
+
+    def __len__(self):
+        return self.count
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Record frames from the first camera')
+    parser.add_argument('output')
+    parser.add_argument('config', nargs='?', default='/boot/frc.json')
+    parser.add_argument('--frames', '-n', type=int, default=0, help='stop after this many frames (default: forever)')
+    args = parser.parse_args()
+
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    import multiCameraServer as mcs
+    mcs.configFile = args.config
+    mcs.init()
+
+    camera, inst = mcs.cameras[0], mcs.insts[0]
+    config = json.loads(camera.getConfigJson())
+    sink = inst.getVideo()
+    input_img = np.zeros(shape=(config['height'], config['width'], 3), dtype=np.uint8)
+    recorder = FrameRecorder(args.output, config['width'], config['height'], config.get('fps'), camera.getName())
+
+    print('Recording to', args.output)
+    start_time = time.time()
+    try:
+        while args.frames == 0 or recorder.count < args.frames:
+            frame_time, input_img = sink.grabFrame(input_img)
+            if frame_time == 0:
+                print(sink.getError(), file=sys.stderr)
+                continue
+            recorder.write(frame_time, input_img)
+    except KeyboardInterrupt:
+        pass
+    recorder.close()
+    elapsed_time = time.time() - start_time
+    print('Recorded {} frames in {:.1f} s ({:.1f} fps)'.format(
+        recorder.count, elapsed_time, recorder.count / elapsed_time))
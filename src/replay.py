@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+
+# Replays a recording (see recorder.py) through the peariscope() function of
+# one of the Peariscope variants and reports throughput and latency.
+#
+# The replay objects stand in for the camera, the CameraServer instance, its
+# sink, and the output stream, so the variant runs its own unmodified frame
+# loop. Run it from a checkout named "peariscope" (as on the Pi), e.g.:
+#   ./replay.py /home/pi/recordings/match1 --variant pnp
+#   ./replay.py /home/pi/recordings/match1 --variant og --realtime --loops 3
+# With --processes N the recording is replayed in N processes at once, as
+# when every camera has its own process (see multi_camera.py), to check that
+# the total frame rate scales with the Pi's cores.
+
+import os
+import sys
+import json
+import time
+import argparse
+import importlib
+import multiprocessing
+import numpy as np
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(SRC_DIR) # For "import multiCameraServer" (og)
+sys.path.append(os.path.dirname(os.path.dirname(SRC_DIR))) # For "import peariscope.src..."
+
+from recorder import Recording
+from thermal import FakeSensor
+from ringlight_service import RinglightClient
+
+VARIANTS = ['og', 'og1', 'feb14', 'pnp']
+
+class ReplayFinished(Exception):
+    """Raised by the replay sink when it runs out of frames."""
+
+class ReplaySink:
+    """Stands in for a CvSink, returning the recorded frames in order.
+
+    With realtime set, frames are handed out at the rate they were recorded
+    (frames are never delivered early, and a slow consumer simply sees them
+    late, as with the camera). Otherwise they are delivered as fast as the
+    loop asks for them.
+    """
+    def __init__(self, recording, realtime=False, loops=1):
+        self.recording = recording
+        self.realtime = realtime
+        self.loops = loops
+        self.index = 0
+        self.start_time = None
+        self.grab_times = [] # When each frame was handed to the loop
+        self.latencies = [] # Seconds from handing out each frame to the loop asking for the next
+        self.finished = False
+
+    def grabFrame(self, img):
+        # The loop has finished with the last frame (whether or not it put a debug frame)
+        if len(self.grab_times) > len(self.latencies):
+            self.latencies.append(time.time() - self.grab_times[-1])
+
+        count = len(self.recording)
+        if self.index >= count * self.loops:
+            self.finished = True
+            raise ReplayFinished()
+        i = self.index % count
+
+        if self.start_time is None:
+            self.start_time = time.time()
+        if self.realtime:
+            # Recorded frame times are in microseconds
+            loop_length = (self.recording.frame_times[-1] - self.recording.frame_times[0]) / 1e6
+            if count > 1:
+                loop_length += loop_length / (count - 1) # Gap before the first frame repeats
+            offset = (self.index // count) * loop_length
+            offset += (self.recording.frame_times[i] - self.recording.frame_times[0]) / 1e6
+            delay = self.start_time + offset - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+        frame = self.recording.frames[i]
+        if img is None or img.shape != frame.shape:
+            img = np.empty_like(frame)
+        np.copyto(img, frame)
+        self.index += 1
+        self.grab_times.append(time.time())
+        return int(self.recording.frame_times[i]), img
+
+    def getError(self):
+        return 'replay error'
+
+class ReplayOutputStream:
+    """Stands in for a CvSource, counting the frames put."""
+    def __init__(self, sink):
+        self.sink = sink
+        self.count = 0
+
+    def putFrame(self, img):
+        self.count += 1
+
+    def notifyError(self, msg):
+        print('notifyError', msg, file=sys.stderr)
+
+class ReplayCamera:
+    """Stands in for the UsbCamera, describing the recording."""
+    def __init__(self, recording):
+        self.recording = recording
+
+    def getName(self):
+        return self.recording.name
+
+    def setFPS(self, fps):
+        return True # The recording plays at its own rate
+
+    def getInfo(self):
+        return 'Replay of {}'.format(self.recording.path)
+
+    def getPath(self):
+        return self.recording.path
+
+    def getConfigJson(self):
+        return json.dumps({
+            'name': self.recording.name,
+            'path': self.recording.path,
+            'width': self.recording.width,
+            'height': self.recording.height,
+            'fps': self.recording.fps or 30,
+        })
+
+class ReplayRinglight(RinglightClient):
+    """Stands in for the ringlight service client, keeping the commands instead of sending them."""
+    def __init__(self):
+        self.commands = []
+
+    def send(self, message):
+        self.commands.append(message)
+        return True
+
+class ReplayServer:
+    """Stands in for the CameraServer instance."""
+    def __init__(self, sink):
+        self.sink = sink
+        self.output_stream = ReplayOutputStream(sink)
+
+    def getVideo(self, camera=None):
+        return self.sink
+
+    def putVideo(self, name, width, height):
+        return self.output_stream
+
+def replay(variant, recording, realtime=False, loops=1, **kwargs):
+    """Run a variant's peariscope() over a recording and return its output stream.
+
+    Any keyword arguments are passed on to peariscope().
+    """
+    module = importlib.import_module('peariscope.src.peariscope_' + variant)
+    # Leave the lights alone (og and og1 set them with ringlight_on, the others with the client)
+    module.ringlight_on = lambda red, grn, blu: None
+    module.ringlight = ReplayRinglight()
+
+    sink = ReplaySink(recording, realtime, loops)
+    server = ReplayServer(sink)
+    try:
+        module.peariscope(ReplayCamera(recording), server, **kwargs)
+    except ReplayFinished:
+        pass
+    return server.output_stream
+
+def report(variant, sink, output_stream):
+    """Print the throughput and latency of a replay and return its FPS."""
+    latencies = np.array(sink.latencies) * 1000
+    if len(latencies) == 0:
+        print('{}: no frames were processed'.format(variant))
+        return 0
+    elapsed_time = time.time() - sink.start_time
+    print('{}: {} frames in {:.2f} s, {:.1f} fps, latency ms p50 {:.2f} p95 {:.2f} p99 {:.2f} max {:.2f}, {} streamed'.format(
+        variant, len(latencies), elapsed_time, len(latencies) / elapsed_time,
+        *np.percentile(latencies, [50, 95, 99]), latencies.max(), output_stream.count))
+    return len(latencies) / elapsed_time
+
+def replay_process(variant, path, realtime, loops, kwargs):
+    """Replay a recording in a worker process and return the FPS."""
+    output_stream = replay(variant, Recording(path), realtime, loops, **kwargs)
+    return report(variant, output_stream.sink, output_stream)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Replay a recording through the Peariscope pipeline')
+    parser.add_argument('recording')
+    parser.add_argument('--variant', '-v', choices=VARIANTS + ['all'], default='pnp')
+    parser.add_argument('--realtime', '-r', action='store_true', help='replay at the recorded frame rate')
+    parser.add_argument('--loops', '-l', type=int, default=1, help='number of times to play the recording')
+    parser.add_argument('--trace-alloc', action='store_true',
+        help='report the memory allocated per frame (pnp only, slow)')
+    parser.add_argument('--processes', '-p', type=int, default=1,
+        help='number of replays to run at once, each in its own process')
+    parser.add_argument('--temperature', type=float, metavar='C',
+        help='pretend the Pi is at this temperature (pnp only, see thermal.py)')
+    args = parser.parse_args()
+    if args.trace_alloc and args.variant != 'pnp':
+        parser.error('--trace-alloc only works with --variant pnp')
+    if args.temperature is not None and args.variant != 'pnp':
+        parser.error('--temperature only works with --variant pnp')
+
+    recording = Recording(args.recording)
+    print('Replaying {} frames of {}x{}'.format(len(recording), recording.width, recording.height))
+    variants = VARIANTS if args.variant == 'all' else [args.variant]
+    for variant in variants:
+        kwargs = {'trace_alloc': True} if args.trace_alloc else {}
+        if args.temperature is not None:
+            kwargs['thermal_sensor'] = FakeSensor(args.temperature)
+        if args.processes > 1:
+            with multiprocessing.Pool(args.processes) as pool:
+                fps_list = pool.starmap(replay_process,
+                    [(variant, args.recording, args.realtime, args.loops, kwargs)] * args.processes)
+            print('{}: {} processes, {:.1f} fps in total'.format(variant, args.processes, sum(fps_list)))
+            continue
+        output_stream = replay(variant, recording, args.realtime, args.loops, **kwargs)
+        report(variant, output_stream.sink, output_stream)
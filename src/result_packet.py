@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+# The results of each frame as one number array, Peariscope/result, so the
+# robot never reads a mix of values from two different frames.
+#
+# The packet is the header values (RESULT_HEADER) followed by the values of
+# each target (RESULT_TARGET_FIELDS), num_targets times:
+#   [version, seq, frame_time, capture_time, latency, elapsed_time, fps, pose_time,
+#    num_targets,
+#    id, x, y, x_pct, y_pct, target_x, target_z, camera_x, camera_z, dist, angle1, angle2,
+#    ...]
+# frame_time is the grabFrame time of the frame (microseconds) and seq counts
+# the frames. capture_time is when the frame was captured in the robot's
+# clock (seconds, see pose_history.py) and latency is the seconds from
+# capture to publishing. id stays the same for a target from frame to frame
+# (see target_tracker.py). The field names are published once as result_header and
+# result_target_fields, and the packet is flushed to the network as soon as
+# it is put instead of waiting for the periodic update.
+
+from networktables import NetworkTables
+
+RESULT_VERSION = 1
+
+RESULT_HEADER = ['version', 'seq', 'frame_time', 'capture_time', 'latency', 'elapsed_time', 'fps',
+    'pose_time', 'num_targets']
+RESULT_TARGET_FIELDS = ['id', 'x', 'y', 'x_pct', 'y_pct', 'target_x', 'target_z', 'camera_x', 'camera_z',
+    'dist', 'angle1', 'angle2']
+
+def image_percent(value, size):
+    """Convert a pixel coordinate to a percentage distance from the image center.
+
+    For x (horizontal), 0 is center, -100 is image left, 100 is image right.
+    For y (vertical), 0 is center, -100 is image top, 100 is image bottom.
+    """
+    return round((value - size/2) / (size/2) * 100, 1)
+
+def pack(results, seq, frame_time, capture_time, latency, elapsed_time, fps, img_width, img_height):
+    """Return the packet (a list of numbers) for the results of one frame."""
+    x_list = results['x_list']
+    packet = [RESULT_VERSION, seq, frame_time, capture_time, latency, elapsed_time, fps,
+        results['pose_time'], len(x_list)]
+    for i, (x, y) in enumerate(zip(x_list, results['y_list'])):
+        packet += [results['id_list'][i], x, y, image_percent(x, img_width), image_percent(y, img_height)]
+        packet += results['target_pos_list'][i]
+        packet += results['camera_pos_list'][i]
+        packet.append(results['dist_list'][i])
+        packet += results['angle_list'][i]
+    return packet
+
+def unpack(packet):
+    """Return the header of a packet as a dict, and a dict for each target."""
+    header = dict(zip(RESULT_HEADER, packet))
+    if header['version'] != RESULT_VERSION:
+        raise ValueError('result packet version {} is not {}'.format(header['version'], RESULT_VERSION))
+    size = len(RESULT_TARGET_FIELDS)
+    start = len(RESULT_HEADER)
+    targets = [dict(zip(RESULT_TARGET_FIELDS, packet[start + i*size:start + (i+1)*size]))
+        for i in range(int(header['num_targets']))]
+    return header, targets
+
+class ResultPublisher:
+    """Publishes the results of each frame as one packet and flushes it."""
+    def __init__(self, table):
+        self.table = table
+        self.seq = 0
+        self.image_size = None
+        table.putStringArray('result_header', RESULT_HEADER)
+        table.putStringArray('result_target_fields', RESULT_TARGET_FIELDS)
+
+    def publish(self, results, frame_time, capture_time, latency, elapsed_time, fps, img_width, img_height):
+        # The image size only goes out when it changes
+        if self.image_size != (img_width, img_height):
+            self.image_size = (img_width, img_height)
+            self.table.putNumber('image_width', img_width)
+            self.table.putNumber('image_height', img_height)
+
+        self.seq += 1
+        self.table.putNumberArray('result', pack(results, self.seq, frame_time, capture_time, latency,
+            elapsed_time, fps, img_width, img_height))
+        NetworkTables.flush()
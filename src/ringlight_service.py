@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+
+# Long-running ringlight service that owns the NeoPixel ring (board.D18) and
+# the PWM light on pin 32, so changing the lights is a datagram on a local
+# socket instead of starting sudo, a shell, and a new Python interpreter.
+#
+# Start the service (as root, it needs the GPIO pins):
+#   sudo ./ringlight_service.py serve
+# Send commands to it (as any user):
+#   ./ringlight_service.py rgb 0 255 0
+#   ./ringlight_service.py pwm 80
+#   ./ringlight_service.py off
+
+import os
+import sys
+import socket
+import signal
+import argparse
+
+SOCKET_PATH = '/tmp/peariscope_ringlight.sock'
+NUMPIXELS = 16
+PWM_PIN = 32 # Board numbering
+PWM_FREQUENCY = 1000
+
+class NeoPixelBackend:
+    """Drives the real ringlight hardware."""
+    def __init__(self):
+        import board
+        import neopixel
+        import RPi.GPIO as GPIO
+        self.GPIO = GPIO
+        self.pixels = neopixel.NeoPixel(board.D18, NUMPIXELS, auto_write=False)
+        GPIO.setmode(GPIO.BOARD)
+        GPIO.setup(PWM_PIN, GPIO.OUT)
+        self.pwm = GPIO.PWM(PWM_PIN, PWM_FREQUENCY)
+        self.pwm.start(0)
+
+    def set_color(self, red, grn, blu):
+        self.pixels.fill((red, grn, blu))
+        self.pixels.show()
+
+    def set_duty_cycle(self, duty_cycle):
+        self.pwm.ChangeDutyCycle(duty_cycle)
+
+    def close(self):
+        self.set_color(0, 0, 0)
+        self.pwm.stop()
+        self.GPIO.cleanup()
+
+class FakeBackend:
+    """Records the commands it receives, for running without the hardware."""
+    def __init__(self):
+        self.color = (0, 0, 0)
+        self.duty_cycle = 0
+        self.history = []
+
+    def set_color(self, red, grn, blu):
+        self.color = (red, grn, blu)
+        self.history.append(('rgb', self.color))
+        print("ringlight color", red, grn, blu)
+
+    def set_duty_cycle(self, duty_cycle):
+        self.duty_cycle = duty_cycle
+        self.history.append(('pwm', duty_cycle))
+        print("ringlight duty cycle", duty_cycle)
+
+    def close(self):
+        self.set_color(0, 0, 0)
+
+def clamp(value, lo, hi):
+    return max(lo, min(hi, value))
+
+def parse_command(message):
+    """Parse a command into ('rgb', (red, grn, blu)) or ('pwm', duty_cycle)."""
+    words = message.split()
+    if words == ['off']:
+        return 'rgb', (0, 0, 0)
+    if len(words) == 4 and words[0] == 'rgb':
+        return 'rgb', tuple(clamp(int(round(float(word))), 0, 255) for word in words[1:])
+    if len(words) == 2 and words[0] == 'pwm':
+        return 'pwm', clamp(float(words[1]), 0, 100)
+    raise ValueError("unknown ringlight command '{}'".format(message))
+
+class RinglightService:
+    """Applies commands received on a local datagram socket to a backend."""
+    def __init__(self, backend, path=SOCKET_PATH):
+        self.backend = backend
+        self.path = path
+        if os.path.exists(path):
+            os.unlink(path) # Left over from a previous run
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(path)
+        os.chmod(path, 0o666) # The vision code does not run as root
+
+    def apply(self, message):
+        kind, value = parse_command(message)
+        if kind == 'rgb':
+            self.backend.set_color(*value)
+        else:
+            self.backend.set_duty_cycle(value)
+
+    def serve_once(self, timeout=None):
+        """Wait for commands and apply them, returning how many were received."""
+        self.sock.settimeout(timeout)
+        try:
+            messages = [self.sock.recv(1024)]
+        except socket.timeout:
+            return 0
+
+        # If commands piled up only the newest color and duty cycle matter
+        self.sock.setblocking(False)
+        while True:
+            try:
+                messages.append(self.sock.recv(1024))
+            except BlockingIOError:
+                break
+        latest = {}
+        for message in messages:
+            try:
+                kind, _ = parse_command(message.decode())
+            except (ValueError, UnicodeDecodeError) as err:
+                print(err, file=sys.stderr)
+                continue
+            latest[kind] = message.decode()
+        for message in latest.values():
+            self.apply(message)
+        return len(messages)
+
+    def serve_forever(self):
+        while True:
+            self.serve_once()
+
+    def close(self):
+        self.sock.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.backend.close()
+
+class RinglightClient:
+    """Sends commands to the ringlight service without ever blocking.
+
+    If the service is not running (or cannot keep up) the command is dropped
+    and a message is printed, so the vision loop never waits on the lights.
+    """
+    def __init__(self, path=SOCKET_PATH):
+        self.path = path
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        self.connected = True
+
+    def send(self, message):
+        try:
+            self.sock.sendto(message.encode(), self.path)
+        except OSError as err:
+            if self.connected:
+                print("ringlight service not available ({}): {}".format(self.path, err), file=sys.stderr)
+            self.connected = False
+            return False
+        self.connected = True
+        return True
+
+    def set_color(self, red, grn, blu):
+        return self.send('rgb {} {} {}'.format(red, grn, blu))
+
+    def set_duty_cycle(self, duty_cycle):
+        return self.send('pwm {}'.format(duty_cycle))
+
+    def off(self):
+        return self.send('off')
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Peariscope ringlight service')
+    parser.add_argument('--socket', '-s', default=SOCKET_PATH)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    serve_parser = subparsers.add_parser('serve', help='run the service')
+    serve_parser.add_argument('--fake', action='store_true', help='use a fake backend instead of the hardware')
+    rgb_parser = subparsers.add_parser('rgb', help='set the ring color (0 to 255 each)')
+    rgb_parser.add_argument('red')
+    rgb_parser.add_argument('grn')
+    rgb_parser.add_argument('blu')
+    pwm_parser = subparsers.add_parser('pwm', help='set the pin {} duty cycle (0 to 100)'.format(PWM_PIN))
+    pwm_parser.add_argument('duty_cycle')
+    subparsers.add_parser('off', help='turn the ring off')
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        if not args.fake and os.geteuid() != 0:
+            print("usage: sudo", sys.argv[0], "serve")
+            sys.exit(1)
+        backend = FakeBackend() if args.fake else NeoPixelBackend()
+        service = RinglightService(backend, args.socket)
+
+        def handler(signal_received, frame):
+            # Turn off the lights and exit when stopped
+            service.close()
+            sys.exit(0)
+        signal.signal(signal.SIGINT, handler)
+        signal.signal(signal.SIGTERM, handler)
+
+        print("Ringlight service listening on", args.socket)
+        service.serve_forever()
+    else:
+        client = RinglightClient(args.socket)
+        if args.command == 'rgb':
+            message = 'rgb {} {} {}'.format(args.red, args.grn, args.blu)
+        elif args.command == 'pwm':
+            message = 'pwm {}'.format(args.duty_cycle)
+        else:
+            message = 'off'
+        parse_command(message) # Report bad values here rather than in the service
+        sys.exit(0 if client.send(message) else 1)
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+
+# Region of interest tracking: once a target has been found, the next frames
+# only need to be searched near where it was, since it moves just a few
+# pixels per frame. The whole frame is still searched every few frames (to
+# pick up new targets) and right after a frame where nothing was found.
+
+import numpy as np
+
+class RoiTracker:
+    """Chooses the window of the next frame to search for targets."""
+    def __init__(self, refresh=0, margin=50):
+        self.refresh = refresh # Search the whole frame every this many frames (0 is off)
+        self.margin = margin # Pixels added around the last targets
+        self.window = None # (x0, y0, x1, y1) around the last targets, or None
+        self.count = 0 # Frames since the last whole-frame search
+
+    def next_window(self):
+        """Return the (x0, y0, x1, y1) window to search, or None for the whole frame."""
+        if self.refresh <= 0 or self.window is None or self.count >= self.refresh - 1:
+            self.count = 0
+            return None
+        self.count += 1
+        return self.window
+
+    def update(self, corners_list, img_width, img_height):
+        """Remember where the targets were found in this frame (in full-frame pixels)."""
+        # After a miss this is None, so the whole frame is searched next time
+        self.window = window_around(corners_list, self.margin, img_width, img_height)
+
+def window_around(corners_list, margin, img_width, img_height):
+    """Return the (x0, y0, x1, y1) window around the targets' corners, or None if there are none."""
+    if len(corners_list) == 0:
+        return None
+
+    points = np.concatenate(corners_list).reshape(-1, 2)
+    x0, y0 = points.min(axis=0)
+    x1, y1 = points.max(axis=0)
+
+    # Expand by the margin plus half the size of the targets
+    pad = margin + max(x1 - x0, y1 - y0) / 2
+    return (
+        max(0, int(x0 - pad)),
+        max(0, int(y0 - pad)),
+        min(img_width, int(x1 + pad) + 1),
+        min(img_height, int(y1 + pad) + 1),
+    )
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+# Segmentation backends: turn a BGR image into a binary image of the pixels
+# whose hue, saturation, and value are within the thresholds.
+#
+# HsvSegmenter is the usual cvtColor + inRange. LutSegmenter looks up every
+# (quantized) BGR color in a table built once from the thresholds, so there
+# is no intermediate HSV image. A segmenter is made for one set of
+# thresholds; make a new one (see make_segmenter) when they change.
+#
+# threshold() writes into scratch images from a FrameBuffers (see
+# frame_buffers.py) when it is given one, so nothing is allocated per frame.
+#
+# Compare the two on a recording (see recorder.py):
+#   ./segmentation.py /home/pi/recordings/match1 --bits 6
+
+import sys
+import time
+import argparse
+import cv2
+import numpy as np
+
+SEGMENTERS = ['hsv', 'lut']
+
+def scratch(buffers, name, shape, dtype=np.uint8):
+    """Return a scratch image from buffers, or a new one without them."""
+    if buffers is None:
+        return np.empty(shape, dtype=dtype)
+    return buffers.get(name, shape, dtype)
+
+def to_hsv(input_img, timer, buffers=None):
+    """Convert a BGR image to HSV (once per frame, however many thresholds it is tested against)."""
+    hsv_img = scratch(buffers, 'hsv', input_img.shape)
+    hsv_img = cv2.cvtColor(input_img, cv2.COLOR_BGR2HSV, dst=hsv_img)
+    timer.lap('cvt_color')
+    return hsv_img
+
+class HsvSegmenter:
+    """Converts to HSV and thresholds with inRange."""
+    def __init__(self, lower, upper):
+        self.lower = tuple(lower)
+        self.upper = tuple(upper)
+
+    def threshold(self, input_img, timer, buffers=None):
+        return self.in_range(to_hsv(input_img, timer, buffers), timer, buffers)
+
+    def in_range(self, hsv_img, timer, buffers=None, name='binary'):
+        """Threshold an image that is already HSV (into the scratch image name)."""
+        binary_img = scratch(buffers, name, hsv_img.shape[:2])
+        binary_img = cv2.inRange(hsv_img, self.lower, self.upper, dst=binary_img)
+        timer.lap('in_range')
+        return binary_img
+
+class LutSegmenter:
+    """Looks up each pixel's BGR color in a precomputed table.
+
+    Each channel is quantized to bits bits, so the table has 2**(3*bits)
+    entries (256 KB for 6 bits, 16 MB for 8 bits). With 8 bits the result is
+    exactly the same as HsvSegmenter; with fewer, colors near a threshold can
+    land on either side of it.
+    """
+    def __init__(self, lower, upper, bits=6):
+        self.lower = tuple(lower)
+        self.upper = tuple(upper)
+        self.bits = bits
+        self.shift = 8 - bits
+        self.lut = self.build_lut()
+
+    def build_lut(self):
+        # Every quantized color, represented by the middle of its bin
+        levels = np.arange(1 << self.bits, dtype=np.uint16) << self.shift
+        levels = (levels + ((1 << self.shift) >> 1)).astype(np.uint8)
+        b, g, r = np.meshgrid(levels, levels, levels, indexing='ij')
+        colors = np.stack([b.ravel(), g.ravel(), r.ravel()], axis=-1).reshape(-1, 1, 3)
+        hsv = cv2.cvtColor(colors, cv2.COLOR_BGR2HSV)
+        return cv2.inRange(hsv, self.lower, self.upper).ravel()
+
+    def threshold(self, input_img, timer, buffers=None):
+        shape = input_img.shape[:2]
+        index = scratch(buffers, 'lut_index', shape, np.uint32)
+        channel = scratch(buffers, 'lut_channel', shape, np.uint32)
+
+        # index = (b << 2*bits) | (g << bits) | r, using the top bits of each channel
+        np.copyto(index, input_img[:, :, 0], casting='unsafe')
+        index >>= self.shift
+        index <<= 2 * self.bits
+        np.copyto(channel, input_img[:, :, 1], casting='unsafe')
+        channel >>= self.shift
+        channel <<= self.bits
+        index |= channel
+        np.copyto(channel, input_img[:, :, 2], casting='unsafe')
+        channel >>= self.shift
+        index |= channel
+
+        binary_img = scratch(buffers, 'binary', shape)
+        np.take(self.lut, index, out=binary_img)
+        timer.lap('lut')
+        return binary_img
+
+def make_segmenter(kind, lower, upper, bits=6, current=None):
+    """Make a segmenter, or return current if it already has these settings."""
+    if current is not None and current.lower == tuple(lower) and current.upper == tuple(upper):
+        if kind == 'hsv' and isinstance(current, HsvSegmenter):
+            return current
+        if kind == 'lut' and isinstance(current, LutSegmenter) and current.bits == bits:
+            return current
+    if kind == 'lut':
+        return LutSegmenter(lower, upper, bits)
+    if kind != 'hsv':
+        print("unknown segmentation '{}', using 'hsv'".format(kind), file=sys.stderr)
+    return HsvSegmenter(lower, upper)
+
+if __name__ == "__main__":
+    from recorder import Recording
+    from frame_buffers import FrameBuffers
+    import perf
+
+    parser = argparse.ArgumentParser(description='Compare the segmentation backends on a recording')
+    parser.add_argument('recording')
+    parser.add_argument('--bits', '-b', type=int, default=6)
+    parser.add_argument('--lower', nargs=3, type=int, default=[55, 255, 40])
+    parser.add_argument('--upper', nargs=3, type=int, default=[65, 255, 255])
+    args = parser.parse_args()
+
+    recording = Recording(args.recording)
+    hsv = HsvSegmenter(args.lower, args.upper)
+    start_time = time.perf_counter()
+    lut = LutSegmenter(args.lower, args.upper, args.bits)
+    print('Built {}-bit LUT in {:.1f} ms'.format(args.bits, (time.perf_counter() - start_time) * 1000))
+
+    hsv_buffers, lut_buffers = FrameBuffers(), FrameBuffers()
+    hsv_time = lut_time = 0
+    mismatched = 0
+    for frame in recording.frames:
+        frame = np.array(frame) # Read it from the file before timing
+        start_time = time.perf_counter()
+        expected = hsv.threshold(frame, perf.NULL_TIMER, hsv_buffers)
+        hsv_time += time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        binary_img = lut.threshold(frame, perf.NULL_TIMER, lut_buffers)
+        lut_time += time.perf_counter() - start_time
+        mismatched += np.count_nonzero(binary_img != expected)
+
+    count = len(recording)
+    print('hsv: {:.2f} ms/frame'.format(hsv_time / count * 1000))
+    print('lut: {:.2f} ms/frame'.format(lut_time / count * 1000))
+    print('mismatched pixels: {} ({:.4f}%)'.format(
+        mismatched, mismatched / (count * recording.width * recording.height) * 100))
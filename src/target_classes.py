@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+# Other classes of targets (e.g. game pieces), found in the same frames as
+# the vision targets.
+#
+# The classes are listed in a JSON file (peariscope_pnp.py --classes FILE):
+#   [{"name": "cargo", "lower": [10, 120, 100], "upper": [25, 255, 255],
+#     "filter": {"min_area": 50, "target_area": 300, "max_angle": 180,
+#                "min_ratio": 0, "max_fill": 1.01, "num_corners": 0}}]
+# Each class has its own HSV thresholds and contour filter (see
+# contour_filter.py, where settings that are left out keep their defaults).
+# The frame is converted to HSV once for the vision targets and all the
+# classes, and the contours of every class go through one pass of the
+# contour filter (contour_filter.apply_all), so another class only costs an
+# inRange, a closing, and findContours on a binary image.
+#
+# The targets of each class are published in its own subtable,
+# Peariscope/<class name>, as one number array, result:
+#   [frame_time, num_targets, x, y, x_pct, y_pct, area, ...]
+# in full-frame pixels (area is the contour's). There is no pose or
+# tracking for these targets.
+
+import json
+import cv2
+import peariscope.src.segmentation as segmentation
+import peariscope.src.contour_filter as contour_filter
+import peariscope.src.blobs as blobs
+import peariscope.src.result_packet as result_packet
+
+CLASS_RESULT_HEADER = ['frame_time', 'num_targets']
+CLASS_RESULT_FIELDS = ['x', 'y', 'x_pct', 'y_pct', 'area']
+
+class TargetClass:
+    """One kind of target: a name, HSV thresholds, and a contour filter."""
+    def __init__(self, name, lower, upper, target_filter):
+        self.name = name
+        self.segmenter = segmentation.HsvSegmenter(lower, upper)
+        self.filter = target_filter
+        self.extractor = blobs.ContourBlobs()
+        self.buffer_name = 'binary_' + name # Its thresholded image in the FrameBuffers
+
+def load_classes(path):
+    """Read the target classes from a JSON file (see above)."""
+    with open(path) as f:
+        specs = json.load(f)
+    classes = [TargetClass(spec['name'], spec['lower'], spec['upper'],
+        contour_filter.ContourFilter(**spec.get('filter', {}))) for spec in specs]
+    print('Target classes from', path, [target_class.name for target_class in classes])
+    return classes
+
+class ClassPublisher:
+    """Publishes the targets of one class as one packet per frame."""
+    def __init__(self, table, target_class):
+        self.table = table
+        self.target_class = target_class
+        table.putStringArray('result_header', CLASS_RESULT_HEADER)
+        table.putStringArray('result_target_fields', CLASS_RESULT_FIELDS)
+
+    def publish(self, targets, frame_time, img_width, img_height):
+        """targets is a list of (contour, center, corners) from the contour filter."""
+        packet = [frame_time, len(targets)]
+        for contour, (x, y), corners in targets:
+            packet += [x, y, result_packet.image_percent(x, img_width), result_packet.image_percent(y, img_height),
+                cv2.contourArea(contour)]
+        self.table.putNumberArray('result', packet)
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+
+# Tracks the targets from frame to frame, so each one keeps the same ID and
+# its position and pose are smoothed.
+#
+# Each track is a constant velocity Kalman filter on the target's center
+# (in pixels), stepped by the capture times of the frames. A detection is
+# matched to the closest predicted track within the gate (a Mahalanobis
+# distance), and the pose values of the track are smoothed with a moving
+# average. Tracks are published once they have been seen MIN_HITS times,
+# in order of ID. A track is dropped as soon as a search of where it was
+# predicted to be misses it, and otherwise (when its part of the frame is
+# not searched) after MAX_AGE seconds without a detection.
+#
+# Between detections only the prediction is published, so the full
+# detection can run every detect_every frames while the results still go
+# out at the camera rate (optionally confirmed by a search of just the
+# window around the predicted tracks).
+
+import math
+import numpy as np
+
+MIN_HITS = 2 # Detections before a track is published
+MAX_AGE = 0.5 # Seconds without a detection before a track that is not searched for is dropped
+GATE = 9.21 # Squared Mahalanobis distance for a match (99% for 2 degrees of freedom)
+MEASUREMENT_NOISE = 4.0 # Pixels^2 of noise in a detected center
+ACCELERATION_NOISE = 2000.0 # (Pixels/s^2)^2 of unmodeled acceleration
+INITIAL_VELOCITY_VARIANCE = 500.0 ** 2 # (Pixels/s)^2 for a new track
+POSE_SMOOTHING = 0.5 # Weight of the newest pose in the moving average
+ANGLE_COLUMNS = [5, 6]
+
+H = np.array([[1.0, 0, 0, 0], [0, 1.0, 0, 0]])
+R = np.eye(2) * MEASUREMENT_NOISE
+
+def detections(results):
+    """Return the (center, pose, corners) of each target in the results of a frame."""
+    return [(np.array([x, y]), np.array(target_pos + camera_pos + [dist] + angles), corners)
+        for x, y, target_pos, camera_pos, dist, angles, corners in zip(
+            results['x_list'], results['y_list'], results['target_pos_list'], results['camera_pos_list'],
+            results['dist_list'], results['angle_list'], results['corners_list'])]
+
+def searched(window, center):
+    """Return whether a point is in the (x0, y0, x1, y1) window that was searched (None is the whole frame)."""
+    if window is None:
+        return True
+    x0, y0, x1, y1 = window
+    return x0 <= center[0] < x1 and y0 <= center[1] < y1
+
+class Track:
+    """One target, followed from frame to frame."""
+    def __init__(self, track_id, detection, capture_time):
+        center, pose, corners = detection
+        self.id = track_id
+        self.state = np.array([center[0], center[1], 0.0, 0.0]) # x, y, vx, vy
+        self.covariance = np.diag([MEASUREMENT_NOISE, MEASUREMENT_NOISE,
+            INITIAL_VELOCITY_VARIANCE, INITIAL_VELOCITY_VARIANCE])
+        self.time = capture_time
+        self.pose = pose
+        self.corners = corners
+        self.corners_center = center # Where the target was when the corners were found
+        self.hits = 1
+        self.last_seen = capture_time
+
+    def predict(self, capture_time):
+        dt = capture_time - self.time
+        if dt <= 0:
+            return
+        F = np.eye(4)
+        F[0, 2] = F[1, 3] = dt
+        G = np.array([[dt*dt/2, 0], [0, dt*dt/2], [dt, 0], [0, dt]])
+        self.state = F @ self.state
+        self.covariance = F @ self.covariance @ F.T + ACCELERATION_NOISE * G @ G.T
+        self.time = capture_time
+
+    def distance(self, center):
+        """Return the squared Mahalanobis distance of a detected center from the prediction."""
+        innovation = center - self.state[:2]
+        S = H @ self.covariance @ H.T + R
+        return float(innovation @ np.linalg.solve(S, innovation))
+
+    def update(self, detection):
+        center, pose, corners = detection
+        S = H @ self.covariance @ H.T + R
+        K = self.covariance @ H.T @ np.linalg.inv(S)
+        self.state = self.state + K @ (center - self.state[:2])
+        self.covariance = (np.eye(4) - K @ H) @ self.covariance
+
+        # Smooth the pose, going the short way around for the angles
+        change = pose - self.pose
+        change[ANGLE_COLUMNS] = (change[ANGLE_COLUMNS] + math.pi) % (2 * math.pi) - math.pi
+        self.pose = self.pose + POSE_SMOOTHING * change
+        self.corners = corners
+        self.corners_center = center
+        self.hits += 1
+        self.last_seen = self.time
+
+    def predicted_corners(self):
+        """The last corners, moved along with the predicted center."""
+        return self.corners + (self.state[:2] - self.corners_center).astype(self.corners.dtype)
+
+class TargetTracker:
+    """Associates the targets of each frame with tracks and publishes the tracks."""
+    def __init__(self, enabled=False, detect_every=1, confirm=True):
+        self.enabled = enabled
+        self.detect_every = detect_every # Run the full detection every this many frames
+        self.confirm = confirm # Between full detections, search around the predicted tracks
+        self.tracks = []
+        self.next_id = 1
+        self.frame_count = 0
+
+    def full_detection_due(self):
+        """Return whether the next frame to update() should get the full detection."""
+        return not self.enabled or self.detect_every <= 1 or (self.frame_count + 1) % self.detect_every == 0
+
+    def predicted_corners(self, capture_time):
+        """Return the corners of the published tracks, predicted to a capture time."""
+        for track in self.tracks:
+            track.predict(capture_time)
+        return [track.predicted_corners() for track in self.tracks if track.hits >= MIN_HITS]
+
+    def update(self, results, capture_time):
+        """Take the results of a frame and return them with the tracked targets instead.
+
+        results['detected'] is False for a frame where nothing was searched,
+        in which case the tracks are only predicted.
+        """
+        self.frame_count += 1
+        if not self.enabled:
+            self.tracks = []
+            results['id_list'] = list(range(len(results['x_list'])))
+            return results
+
+        for track in self.tracks:
+            track.predict(capture_time)
+
+        if results['detected']:
+            # Match the closest pairs first, within the gate
+            found = detections(results)
+            pairs = sorted((track.distance(detection[0]), i, j)
+                for i, track in enumerate(self.tracks) for j, detection in enumerate(found))
+            matched_tracks, matched_detections = set(), set()
+            for distance, i, j in pairs:
+                if distance > GATE:
+                    break
+                if i in matched_tracks or j in matched_detections:
+                    continue
+                self.tracks[i].update(found[j])
+                matched_tracks.add(i)
+                matched_detections.add(j)
+
+            # A track that was searched for and not found is gone
+            self.tracks = [track for i, track in enumerate(self.tracks)
+                if i in matched_tracks or not searched(results['window'], track.state[:2])]
+
+            # Start a track for every new target
+            for j, detection in enumerate(found):
+                if j not in matched_detections:
+                    self.tracks.append(Track(self.next_id, detection, capture_time))
+                    self.next_id += 1
+
+        self.tracks = [track for track in self.tracks if capture_time - track.last_seen <= MAX_AGE]
+        return self.tracked_results(results)
+
+    def tracked_results(self, results):
+        tracks = sorted((track for track in self.tracks if track.hits >= MIN_HITS), key=lambda track: track.id)
+        tracked = dict(results)
+        tracked.update({
+            'id_list' : [track.id for track in tracks],
+            'x_list' : [float(track.state[0]) for track in tracks],
+            'y_list' : [float(track.state[1]) for track in tracks],
+            'corners_list' : [track.predicted_corners() for track in tracks],
+            'target_pos_list' : [track.pose[0:2].tolist() for track in tracks],
+            'camera_pos_list' : [track.pose[2:4].tolist() for track in tracks],
+            'dist_list' : [float(track.pose[4]) for track in tracks],
+            'angle_list' : [track.pose[5:7].tolist() for track in tracks],
+        })
+        return tracked
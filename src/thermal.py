@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+
+# Background sampling of the Pi's temperature and throttle state.
+#
+# The temperature is read from sysfs, and the throttle flags from sysfs on
+# newer kernels or `vcgencmd get_throttled` otherwise, every few seconds on a
+# thread of their own so the frame loop never waits for them. The readings
+# are published as Peariscope/temperature and Peariscope/throttled, and the
+# monitor's level (NORMAL, WARM, or HOT) tells the loop to switch to cheaper
+# settings (see thermal_settings in peariscope_pnp.py).
+#
+# FakeSensor stands in for the Pi, e.g. to try the degraded settings on a
+# replay (replay.py --temperature 85), or from the command line:
+#   ./thermal.py --fake 85
+#   ./thermal.py
+
+import os
+import time
+import argparse
+import threading
+import subprocess
+
+TEMPERATURE_PATH = '/sys/class/thermal/thermal_zone0/temp'
+THROTTLED_PATH = '/sys/devices/platform/soc/soc:firmware/get_throttled'
+
+# Throttle flags from get_throttled (the "has occurred" flags are 16 bits higher)
+UNDER_VOLTAGE = 0x1
+FREQUENCY_CAPPED = 0x2
+THROTTLED = 0x4
+SOFT_TEMPERATURE_LIMIT = 0x8
+
+NORMAL, WARM, HOT = 0, 1, 2
+LEVEL_NAMES = ['normal', 'warm', 'hot']
+
+SAMPLE_INTERVAL = 2.0 # Seconds between samples
+HYSTERESIS = 3.0 # Degrees C below a threshold before dropping back a level
+
+class PiSensor:
+    """Reads the temperature and throttle flags of the Raspberry Pi."""
+    def temperature(self):
+        with open(TEMPERATURE_PATH) as f:
+            return int(f.read()) / 1000
+
+    def throttled(self):
+        if os.path.exists(THROTTLED_PATH):
+            with open(THROTTLED_PATH) as f:
+                return int(f.read(), 16)
+        result = subprocess.check_output(['vcgencmd', 'get_throttled'])
+        return int(result.decode('UTF-8').strip().split('=')[1], 16)
+
+class FakeSensor:
+    """A sensor with whatever readings it is given, for testing."""
+    def __init__(self, temperature=50.0, throttled=0):
+        self.fake_temperature = temperature
+        self.fake_throttled = throttled
+
+    def temperature(self):
+        return self.fake_temperature
+
+    def throttled(self):
+        return self.fake_throttled
+
+def thermal_level(temperature, throttled, warm, hot, current=NORMAL):
+    """Return the level for a reading, only dropping a level once it is HYSTERESIS below."""
+    if throttled & (THROTTLED | FREQUENCY_CAPPED) or temperature >= hot:
+        return HOT
+    if current == HOT and temperature > hot - HYSTERESIS:
+        return HOT
+    if throttled & SOFT_TEMPERATURE_LIMIT or temperature >= warm:
+        return WARM
+    if current >= WARM and temperature > warm - HYSTERESIS:
+        return WARM
+    return NORMAL
+
+class ThermalMonitor(threading.Thread):
+    """Samples a sensor in the background and publishes the readings."""
+    def __init__(self, table, sensor=None, warm=70.0, hot=80.0, interval=SAMPLE_INTERVAL):
+        super().__init__(name='thermal', daemon=True)
+        self.table = table
+        self.sensor = sensor or PiSensor()
+        self.warm = warm # Degrees C to start saving work
+        self.hot = hot # Degrees C to save as much work as possible
+        self.interval = interval
+        self.temperature = None
+        self.throttled = 0
+        self.level = NORMAL
+        self.errors = 0
+
+    def sample(self):
+        try:
+            self.temperature = self.sensor.temperature()
+            self.throttled = self.sensor.throttled()
+        except (OSError, ValueError, IndexError, subprocess.CalledProcessError) as err:
+            if self.errors == 0:
+                print('thermal sensor error:', err) # Only once (e.g. not on a Pi)
+            self.errors += 1
+            return
+        level = thermal_level(self.temperature, self.throttled, self.warm, self.hot, self.level)
+        if level != self.level:
+            print('Temperature {:.1f} C, throttled {:#x}: {}'.format(
+                self.temperature, self.throttled, LEVEL_NAMES[level]))
+            self.level = level
+        if self.table is not None:
+            self.table.putNumber('temperature', self.temperature)
+            self.table.putNumber('throttled', self.throttled)
+            self.table.putNumber('thermal_level', self.level)
+
+    def run(self):
+        while True:
+            self.sample()
+            time.sleep(self.interval)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Print the temperature, throttle flags, and thermal level')
+    parser.add_argument('--fake', type=float, metavar='C', help='use a fake sensor at this temperature')
+    parser.add_argument('--warm', type=float, default=70.0)
+    parser.add_argument('--hot', type=float, default=80.0)
+    args = parser.parse_args()
+
+    sensor = PiSensor() if args.fake is None else FakeSensor(args.fake)
+    monitor = ThermalMonitor(None, sensor, args.warm, args.hot)
+    monitor.sample()
+    if monitor.temperature is not None:
+        print('temperature {:.1f} C, throttled {:#x}, level {}'.format(
+            monitor.temperature, monitor.throttled, LEVEL_NAMES[monitor.level]))
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+
+# Finds the HSV thresholds (min_hue ... max_val) that best separate the
+# vision targets from everything else in a set of labelled frames.
+#
+# The frames are a recording (see recorder.py) or a directory of images,
+# with a labels.json beside them that maps each labelled frame (its index in
+# the recording, or its file name) to the polygons of the targets in it:
+#   {"12": [[[x, y], [x, y], [x, y], [x, y]], ...], "13": [], ...}
+# Only the labelled frames are used; an empty list is a frame with no targets.
+#
+# Each frame is reduced once to two 3D histograms of its HSV colors, one of
+# the pixels inside the polygons and one of the rest (saturation and value
+# in bins of sv_step), and the sums over all frames are turned into summed
+# volume tables. The number of target and background pixels within any set
+# of thresholds is then 8 lookups, so a candidate is scored without touching
+# a pixel. The search is coordinate ascent on the F-score (every value of one
+# threshold at a time, until none improves), from the given thresholds and
+# from random starts, which are spread across a process pool along with the
+# histograms.
+#
+# The result is written as JSON that peariscope_pnp.py loads into its
+# DEFAULT_VALS (--defaults FILE):
+#   ./tune_thresholds.py /home/pi/recordings/match1 -o thresholds.json
+
+import os
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+import cv2
+import numpy as np
+from recorder import Recording, INFO_NAME
+
+LABELS_NAME = 'labels.json'
+THRESHOLD_KEYS = ['min_hue', 'max_hue', 'min_sat', 'max_sat', 'min_val', 'max_val']
+HUE_BINS = 180 # OpenCV's 8-bit hue is 0-179
+
+def read_labels(path):
+    """Return the labelled frames of a directory as a list of (frame, polygons)."""
+    with open(os.path.join(path, LABELS_NAME)) as f:
+        labels = json.load(f)
+    return sorted((key, [np.array(polygon, dtype=np.int32) for polygon in polygons])
+        for key, polygons in labels.items())
+
+def read_frame(path, recording, key):
+    """Return a labelled frame, by index in a recording or by image file name."""
+    if recording is not None:
+        return np.array(recording.frames[int(key)])
+    img = cv2.imread(os.path.join(path, key))
+    if img is None:
+        raise ValueError("cannot read image '{}'".format(os.path.join(path, key)))
+    return img
+
+def frame_histograms(path, labelled, sv_step):
+    """Return the HSV histograms of the target and background pixels of some frames."""
+    sv_bins = 256 // sv_step
+    shape = (HUE_BINS, sv_bins, sv_bins)
+    target = np.zeros(shape, dtype=np.int64).ravel()
+    background = np.zeros_like(target)
+    recording = Recording(path) if os.path.exists(os.path.join(path, INFO_NAME)) else None
+    for key, polygons in labelled:
+        img = read_frame(path, recording, key)
+        hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+        index = hsv[:, :, 0].astype(np.int32) * (sv_bins * sv_bins)
+        index += (hsv[:, :, 1] // sv_step).astype(np.int32) * sv_bins
+        index += hsv[:, :, 2] // sv_step
+
+        mask = np.zeros(img.shape[:2], dtype=np.uint8)
+        if len(polygons) > 0:
+            cv2.fillPoly(mask, polygons, 255)
+        inside = mask > 0
+        target += np.bincount(index[inside], minlength=target.size)
+        background += np.bincount(index[~inside], minlength=background.size)
+    return target.reshape(shape), background.reshape(shape)
+
+def summed_volume(hist):
+    """Return the summed volume table of a 3D histogram (padded with a zero plane on each axis)."""
+    table = np.zeros(tuple(n + 1 for n in hist.shape), dtype=np.int64)
+    table[1:, 1:, 1:] = hist.cumsum(0).cumsum(1).cumsum(2)
+    return table
+
+def box_count(table, h0, h1, s0, s1, v0, v1):
+    """Return the count within the inclusive bin ranges (which can be arrays of candidates)."""
+    h1, s1, v1 = h1 + 1, s1 + 1, v1 + 1
+    return (table[h1, s1, v1] - table[h0, s1, v1] - table[h1, s0, v1] - table[h1, s1, v0]
+        + table[h0, s0, v1] + table[h0, s1, v0] + table[h1, s0, v0] - table[h0, s0, v0])
+
+def scores(tables, bins, beta):
+    """Return the F-scores, precisions, and recalls of candidate bins (arrays of lower/upper bins)."""
+    target_table, background_table = tables
+    true_positives = box_count(target_table, *bins)
+    false_positives = box_count(background_table, *bins)
+    total_targets = max(1, target_table[-1, -1, -1])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.where(true_positives > 0, true_positives / (true_positives + false_positives), 0.0)
+    recall = true_positives / total_targets
+    b2 = beta * beta
+    with np.errstate(divide='ignore', invalid='ignore'):
+        f_score = np.where(precision + recall > 0,
+            (1 + b2) * precision * recall / (b2 * precision + recall), 0.0)
+    valid = (bins[0] <= bins[1]) & (bins[2] <= bins[3]) & (bins[4] <= bins[5])
+    return np.where(valid, f_score, -1.0), precision, recall
+
+# The tables are set once in each worker process rather than sent with every start
+worker_tables = None
+
+def init_worker(tables):
+    global worker_tables
+    worker_tables = tables
+
+def ascend(start, beta):
+    """Coordinate ascent from a start (lower and upper bins); return (f_score, bins)."""
+    sizes = [n - 1 for n in worker_tables[0].shape for _ in range(2)] # Less the zero plane
+    bins = list(start)
+    best = float(scores(worker_tables, [np.array(b) for b in bins], beta)[0])
+    improved = True
+    while improved:
+        improved = False
+        for k in range(6):
+            candidates = [np.full(sizes[k], b) for b in bins]
+            candidates[k] = np.arange(sizes[k])
+            f_score = scores(worker_tables, candidates, beta)[0]
+            i = int(np.argmax(f_score))
+            if f_score[i] > best + 1e-12:
+                best = float(f_score[i])
+                bins[k] = i
+                improved = True
+    return best, bins
+
+def to_bins(thresholds, sv_step):
+    min_hue, max_hue, min_sat, max_sat, min_val, max_val = thresholds
+    return [min(min_hue, HUE_BINS - 1), min(max_hue, HUE_BINS - 1),
+        min_sat // sv_step, max_sat // sv_step, min_val // sv_step, max_val // sv_step]
+
+def to_thresholds(bins, sv_step):
+    """Return the thresholds covering whole bins (upper thresholds are the top of their bin)."""
+    h0, h1, s0, s1, v0, v1 = (int(b) for b in bins)
+    return [h0, h1, s0 * sv_step, s1 * sv_step + sv_step - 1, v0 * sv_step, v1 * sv_step + sv_step - 1]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Find the HSV thresholds that best match labelled targets')
+    parser.add_argument('frames', help='a recording or a directory of images, with a labels.json')
+    parser.add_argument('--output', '-o', metavar='FILE', help='write the thresholds to this JSON file')
+    parser.add_argument('--lower', nargs=3, type=int, default=[55, 255, 40], help='the first start')
+    parser.add_argument('--upper', nargs=3, type=int, default=[65, 255, 255], help='the first start')
+    parser.add_argument('--starts', type=int, default=32, help='number of random starts')
+    parser.add_argument('--sv-step', type=int, default=4, choices=[1, 2, 4, 8, 16],
+        help='width of the saturation and value bins')
+    parser.add_argument('--beta', type=float, default=1.0,
+        help='weight of recall against precision in the F-score')
+    parser.add_argument('--processes', '-p', type=int, default=os.cpu_count())
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    labels = read_labels(args.frames)
+    if len(labels) == 0:
+        sys.exit("no labelled frames in '{}'".format(os.path.join(args.frames, LABELS_NAME)))
+
+    # Histograms of the frames, in one chunk per process
+    start_time = time.perf_counter()
+    chunks = [labels[i::args.processes] for i in range(args.processes) if i < len(labels)]
+    with multiprocessing.Pool(len(chunks)) as pool:
+        histograms = pool.starmap(frame_histograms, [(args.frames, chunk, args.sv_step) for chunk in chunks])
+    target = sum(hist[0] for hist in histograms)
+    background = sum(hist[1] for hist in histograms)
+    tables = (summed_volume(target), summed_volume(background))
+    print('Histograms of {} frames ({} target pixels) in {:.1f} s'.format(
+        len(labels), target.sum(), time.perf_counter() - start_time))
+    if target.sum() == 0:
+        sys.exit('the labels have no target pixels')
+
+    # Coordinate ascent from the given thresholds and from random boxes
+    start_time = time.perf_counter()
+    rng = np.random.RandomState(args.seed)
+    sv_bins = 256 // args.sv_step
+    (min_hue, min_sat, min_val), (max_hue, max_sat, max_val) = args.lower, args.upper
+    starts = [to_bins([min_hue, max_hue, min_sat, max_sat, min_val, max_val], args.sv_step)]
+    for _ in range(args.starts):
+        h = np.sort(rng.randint(0, HUE_BINS, 2))
+        s = np.sort(rng.randint(0, sv_bins, 2))
+        v = np.sort(rng.randint(0, sv_bins, 2))
+        starts.append([int(h[0]), int(h[1]), int(s[0]), int(s[1]), int(v[0]), int(v[1])])
+    with multiprocessing.Pool(args.processes, init_worker, (tables,)) as pool:
+        results = pool.starmap(ascend, [(start, args.beta) for start in starts])
+    f_score, bins = max(results, key=lambda result: result[0])
+    _, precision, recall = scores(tables, [np.array(b) for b in bins], args.beta)
+    print('Searched from {} starts in {:.1f} s'.format(len(starts), time.perf_counter() - start_time))
+
+    thresholds = dict(zip(THRESHOLD_KEYS, to_thresholds(bins, args.sv_step)))
+    print(' '.join('{} {}'.format(key, value) for key, value in thresholds.items()))
+    print('precision {:.4f}, recall {:.4f}, F{:g} {:.4f}'.format(precision, recall, args.beta, f_score))
+    if args.output:
+        thresholds['tuning'] = {'precision': float(precision), 'recall': float(recall),
+            'f_score': f_score, 'beta': args.beta, 'frames': len(labels)}
+        with open(args.output, 'w') as f:
+            json.dump(thresholds, f, indent=2)
+        print('Wrote', args.output)
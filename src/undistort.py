@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+# Undistorts whole frames with remap tables that are built once.
+#
+# cv2.undistort works out where every output pixel comes from on each call.
+# An Undistorter builds those tables once with initUndistortRectifyMap, in
+# OpenCV's fixed-point form (CV_16SC2 pixel coordinates and a CV_16UC1 table
+# of interpolation weights, a third of the size of float maps), and each
+# frame is then a single remap. The output can be smaller than the camera
+# image (1/scale), so undistorting and downscaling are the same remap.
+#
+# The tables are saved as .npy files next to the calibration file, named
+# after the output size and a hash of the calibration, and memory-mapped
+# the next time, so starting up does not rebuild them:
+#   calibration/Peariscope_640x480.yml.320x240.1a2b3c4d.map1.npy
+#
+# Compare with cv2.undistort on a recording (see recorder.py):
+#   ./undistort.py /home/pi/recordings/match1 --scale 2
+
+import os
+import sys
+import time
+import hashlib
+import argparse
+import cv2
+import numpy as np
+
+class Undistorter:
+    """Remap tables from one camera calibration to an undistorted image of one size."""
+    def __init__(self, calibration, scale=1, alpha=0.0, cache=True):
+        self.calibration = calibration
+        self.scale = scale # The undistorted image is 1/scale of the camera resolution
+        self.alpha = alpha # 0 keeps only valid pixels, 1 keeps all of the camera image (see getOptimalNewCameraMatrix)
+        self.input_size = (calibration.width, calibration.height)
+        self.output_size = (calibration.width // scale, calibration.height // scale)
+        self.camera_matrix, _ = cv2.getOptimalNewCameraMatrix(calibration.camera_matrix,
+            calibration.distortion_coeffs, self.input_size, alpha, self.output_size)
+
+        paths = self.map_paths() if cache else None
+        if paths is not None and all(os.path.exists(path) for path in paths):
+            self.map1, self.map2 = (np.load(path, mmap_mode='r') for path in paths)
+        else:
+            self.map1, self.map2 = self.build_maps()
+            if paths is not None:
+                self.save_maps(paths)
+
+    def map_paths(self):
+        """Return the paths of the saved tables, or None if the calibration is not from a file."""
+        if self.calibration.path is None:
+            return None
+        key = hashlib.sha1()
+        for array in [self.calibration.camera_matrix, self.calibration.distortion_coeffs, self.camera_matrix]:
+            key.update(np.ascontiguousarray(array, dtype=np.float64).tobytes())
+        key.update(np.array(self.input_size).tobytes())
+        prefix = '{}.{}x{}.{}'.format(self.calibration.path, self.output_size[0], self.output_size[1],
+            key.hexdigest()[:8])
+        return [prefix + '.map1.npy', prefix + '.map2.npy']
+
+    def build_maps(self):
+        return cv2.initUndistortRectifyMap(self.calibration.camera_matrix, self.calibration.distortion_coeffs,
+            None, self.camera_matrix, self.output_size, cv2.CV_16SC2)
+
+    def save_maps(self, paths):
+        # Written under a temporary name first, so a half written table is never loaded
+        try:
+            for path, array in zip(paths, [self.map1, self.map2]):
+                with open(path + '.tmp', 'wb') as f:
+                    np.save(f, array)
+                os.replace(path + '.tmp', path)
+        except OSError as err:
+            print('cannot save the undistortion tables:', err, file=sys.stderr)
+
+    def undistort(self, img, dst=None):
+        """Return the undistorted image (written into dst if given)."""
+        return cv2.remap(img, self.map1, self.map2, cv2.INTER_LINEAR, dst=dst)
+
+if __name__ == "__main__":
+    from recorder import Recording
+    from camera_calibration import load_calibration
+
+    parser = argparse.ArgumentParser(description='Compare Undistorter with cv2.undistort on a recording')
+    parser.add_argument('recording')
+    parser.add_argument('--scale', '-s', type=int, default=1, choices=[1, 2, 4])
+    parser.add_argument('--alpha', type=float, default=0.0)
+    args = parser.parse_args()
+
+    recording = Recording(args.recording)
+    calibration = load_calibration(recording.name, recording.width, recording.height)
+    start_time = time.perf_counter()
+    undistorter = Undistorter(calibration, args.scale, args.alpha)
+    print('Loaded or built the tables in {:.1f} ms'.format((time.perf_counter() - start_time) * 1000))
+
+    # cv2.undistort to the full size (then resized) for comparison
+    full_matrix, _ = cv2.getOptimalNewCameraMatrix(calibration.camera_matrix, calibration.distortion_coeffs,
+        undistorter.input_size, args.alpha, undistorter.input_size)
+
+    dst = np.empty((undistorter.output_size[1], undistorter.output_size[0], 3), dtype=np.uint8)
+    undistort_time = remap_time = difference = 0
+    for frame in recording.frames:
+        frame = np.array(frame) # Read it from the file before timing
+        start_time = time.perf_counter()
+        expected = cv2.undistort(frame, calibration.camera_matrix, calibration.distortion_coeffs,
+            None, full_matrix)
+        if args.scale != 1:
+            expected = cv2.resize(expected, undistorter.output_size, interpolation=cv2.INTER_AREA)
+        undistort_time += time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        undistorter.undistort(frame, dst)
+        remap_time += time.perf_counter() - start_time
+        difference += np.mean(cv2.absdiff(expected, dst))
+
+    count = len(recording)
+    print('undistort: {:.2f} ms/frame'.format(undistort_time / count * 1000))
+    print('remap: {:.2f} ms/frame'.format(remap_time / count * 1000))
+    print('mean difference: {:.2f} levels'.format(difference / count))
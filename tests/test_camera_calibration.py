@@ -0,0 +1,20 @@
+import camera_calibration
+
+def touch(directory, *names):
+    for name in names:
+        (directory / name).write_text('')
+
+def test_prefers_the_file_for_the_resolution(tmp_path):
+    touch(tmp_path, 'Peariscope_320x240.yml', 'Peariscope_640x480.yml')
+    assert camera_calibration.find_calibration_file('Peariscope', 640, 480, str(tmp_path)) == \
+        str(tmp_path / 'Peariscope_640x480.yml')
+    assert camera_calibration.find_calibration_file('Peariscope', 1280, 720, str(tmp_path)) == \
+        str(tmp_path / 'Peariscope_320x240.yml')
+
+def test_ignores_other_cameras_and_other_files(tmp_path):
+    touch(tmp_path, 'Peariscope_2_640x480.yml', 'Peariscope_640x480.yml.bak',
+        'Peariscope_640x480.yml.320x240.0123abcd.map1.npy',
+        'Peariscope_640x480.yml.320x240.0123abcd.map1.npy.tmp', # Left by an interrupted save
+        'Peariscope_320x240.xml')
+    assert camera_calibration.find_calibration_file('Peariscope', 640, 480, str(tmp_path)) == \
+        str(tmp_path / 'Peariscope_320x240.xml')
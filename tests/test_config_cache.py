@@ -0,0 +1,48 @@
+import pytest
+import config_cache
+
+class FakeTable:
+    """Just what ConfigCache uses of a network table."""
+    def setDefaultValue(self, key, value):
+        pass
+
+    def addEntryListener(self, listener, immediateNotify, localNotify):
+        pass
+
+    def putValue(self, key, value):
+        pass
+
+DEFAULTS = {'min_hue' : 55, 'latency_budget' : 0.0, 'pnp_track' : True, 'pnp_solver' : 'iterative'}
+
+@pytest.fixture
+def settings():
+    return config_cache.ConfigCache(FakeTable(), DEFAULTS)
+
+@pytest.mark.parametrize('key, value, expected', [
+    ('min_hue', 60.0, 60), # Dashboards send every number as a float
+    ('min_hue', 61, 61),
+    ('latency_budget', 1, 1.0),
+    ('latency_budget', 0.02, 0.02),
+    ('pnp_track', False, False),
+    ('pnp_solver', 'epnp', 'epnp'),
+])
+def test_values_are_converted_to_the_type_of_their_default(settings, key, value, expected):
+    settings.set(key, value)
+    assert getattr(settings, key) == expected
+    assert type(getattr(settings, key)) is type(expected)
+    assert settings.version == 1
+
+@pytest.mark.parametrize('key, value', [
+    ('min_hue', 55.7),
+    ('min_hue', True),
+    ('min_hue', '60'),
+    ('latency_budget', 'fast'),
+    ('pnp_track', 'False'),
+    ('pnp_track', 0),
+    ('pnp_solver', 3.0),
+])
+def test_wrong_kinds_of_values_are_rejected(settings, capsys, key, value):
+    settings.set(key, value)
+    assert getattr(settings, key) == DEFAULTS[key]
+    assert settings.version == 0
+    assert "config error: '{}' cannot be set".format(key) in capsys.readouterr().err
@@ -0,0 +1,90 @@
+import os
+import numpy as np
+import pytest
+from multiprocessing import resource_tracker
+
+frame_bus = pytest.importorskip('frame_bus') # Needs Python 3.8 or later
+
+WIDTH, HEIGHT = 8, 6
+
+@pytest.fixture
+def bus():
+    bus = frame_bus.FrameBus.create('peariscope-test-{}'.format(os.getpid()), WIDTH, HEIGHT, fps=30)
+    yield bus
+    bus.close()
+    bus.shm.unlink()
+
+def write(writer, value, frame_time):
+    writer.next_image()[:] = value
+    writer.publish(frame_time)
+
+def test_reads_the_latest_frame(bus):
+    writer = frame_bus.FrameWriter(bus)
+    reader = frame_bus.FrameReader(bus)
+    assert reader.latest() is None
+    write(writer, 1, 1000)
+    write(writer, 2, 2000)
+    seq, frame_time, img = reader.latest()
+    assert (seq, frame_time) == (2, 2000)
+    assert img.shape == (HEIGHT, WIDTH, 3)
+    assert np.all(img == 2)
+    assert reader.valid(seq)
+
+def test_frame_stays_valid_until_its_slot_is_written(bus):
+    writer = frame_bus.FrameWriter(bus)
+    reader = frame_bus.FrameReader(bus)
+    write(writer, 1, 1000)
+    seq, _, img = reader.latest()
+    for i in range(bus.slots - 1):
+        write(writer, 2 + i, 2000 + i)
+    assert reader.valid(seq)
+    assert np.all(img == 1)
+
+    # The write that overlaps the read starts on the reader's slot
+    writer.next_image()
+    assert not reader.valid(seq)
+
+def test_frame_being_written_is_not_returned(bus):
+    writer = frame_bus.FrameWriter(bus)
+    reader = frame_bus.FrameReader(bus)
+    write(writer, 1, 1000)
+    for i in range(bus.slots - 1):
+        write(writer, 2 + i, 2000 + i)
+    # The next write starts on the slot after the latest, so the latest is still whole
+    writer.next_image()
+    assert reader.latest()[0] == bus.slots
+
+def test_torn_latest_frame_is_not_returned():
+    bus = frame_bus.FrameBus.create('peariscope-test-{}-1'.format(os.getpid()), WIDTH, HEIGHT, slots=1)
+    try:
+        writer = frame_bus.FrameWriter(bus)
+        reader = frame_bus.FrameReader(bus)
+        write(writer, 1, 1000)
+        writer.next_image() # Writing over the latest (and only) slot
+        assert reader.latest() is None
+        writer.publish(2000)
+        assert reader.latest()[:2] == (2, 2000)
+    finally:
+        bus.close()
+        bus.shm.unlink()
+
+def test_sink_returns_read_only_views(bus):
+    writer = frame_bus.FrameWriter(bus)
+    reader_bus = frame_bus.FrameBus.attach(bus.shm.name)
+    try:
+        sink = frame_bus.BusSink(reader_bus, timeout=0.01)
+        img = np.zeros((HEIGHT, WIDTH, 3), dtype=np.uint8)
+        assert sink.grabFrame(img) == (0, img)
+        write(writer, 7, 1000)
+        frame_time, view = sink.grabFrame(img)
+        assert frame_time == 1000
+        assert view is not img and np.all(view == 7)
+        assert not view.flags.writeable
+        assert sink.valid()
+        for i in range(bus.slots):
+            write(writer, 8 + i, 2000 + i)
+        assert not sink.valid()
+    finally:
+        reader_bus.close()
+        # attach() unregistered the bus, which this process also created (and unlinks)
+        resource_tracker.register(bus.shm._name, 'shared_memory')
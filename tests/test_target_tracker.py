@@ -0,0 +1,101 @@
+import numpy as np
+import target_tracker
+
+FRAME_TIME = 1 / 30
+
+def frame(centers, window=None, detected=True):
+    """The results of a frame with targets at centers (see peariscope_pnp.detect)."""
+    corners = [np.array([[[x - 10, y - 5]], [[x - 5, y + 5]], [[x + 5, y + 5]], [[x + 10, y - 5]]], dtype=np.float32)
+        for x, y in centers]
+    return {
+        'detected' : detected,
+        'window' : window,
+        'x_list' : [x for x, _ in centers],
+        'y_list' : [y for _, y in centers],
+        'corners_list' : corners,
+        'target_pos_list' : [[0.0, 3.0] for _ in centers],
+        'camera_pos_list' : [[0.0, -3.0] for _ in centers],
+        'dist_list' : [3.0 for _ in centers],
+        'angle_list' : [[0.0, 0.0] for _ in centers],
+    }
+
+def run(tracks, frames):
+    """Update the tracks with each frame in turn, and return what each one published as {id: (x, y)}."""
+    published = []
+    for n, results in enumerate(frames):
+        results = tracks.update(results, n * FRAME_TIME)
+        published.append(dict(zip(results['id_list'], zip(results['x_list'], results['y_list']))))
+    return published
+
+def test_new_target_is_published_after_min_hits():
+    published = run(target_tracker.TargetTracker(enabled=True), [frame([(100, 100)])] * 3)
+    assert [len(targets) for targets in published] == [0, 1, 1]
+    assert target_tracker.MIN_HITS == 2
+
+def test_disabled_passes_the_raw_results_through():
+    tracks = target_tracker.TargetTracker(enabled=False)
+    results = tracks.update(frame([(100, 100), (200, 120)]), 0)
+    assert results['id_list'] == [0, 1]
+    assert results['x_list'] == [100, 200]
+    assert tracks.tracks == []
+
+def test_crossing_targets_keep_their_ids():
+    # One target moves right and one left, passing 20 pixels apart, listed in a different order each frame
+    frames = []
+    for n in range(20):
+        centers = [(100 + 10 * n, 200), (300 - 10 * n, 220)]
+        frames.append(frame(centers if n % 2 else centers[::-1]))
+    published = run(target_tracker.TargetTracker(enabled=True), frames)
+    for targets in published[1:]:
+        assert sorted(targets) == [1, 2] # No track was lost or swapped for a new one
+    right_id, left_id = sorted(published[1], key=lambda target_id: published[1][target_id][0])
+    rightward = [targets[right_id][0] for targets in published[1:]]
+    leftward = [targets[left_id][0] for targets in published[1:]]
+    assert rightward == sorted(rightward) and rightward[-1] > 250
+    assert leftward == sorted(leftward, reverse=True) and leftward[-1] < 150
+
+def test_detection_outside_the_gate_starts_a_new_track():
+    tracks = target_tracker.TargetTracker(enabled=True)
+    run(tracks, [frame([(100, 100)])] * 3)
+    results = tracks.update(frame([(400, 300)]), 3 * FRAME_TIME)
+    assert len(tracks.tracks) == 1 and tracks.tracks[0].id == 2 # The old one was searched for and missed
+    assert results['id_list'] == []
+
+def test_missed_target_is_dropped_at_once():
+    tracks = target_tracker.TargetTracker(enabled=True)
+    published = run(tracks, [frame([(100, 100)])] * 3 + [frame([])] + [frame([(100, 100)])] * 2)
+    assert list(published[2]) == [1]
+    assert published[3] == {} # No coasting through a full detection that found nothing
+    assert published[4] == {} # Back as a new track, published once seen twice
+    assert list(published[5]) == [2]
+
+def test_target_outside_the_searched_window_coasts_until_max_age():
+    tracks = target_tracker.TargetTracker(enabled=True)
+    run(tracks, [frame([(100, 100)])] * 3)
+    window = (300, 300, 400, 400) # Somewhere else
+    n = 3
+    while n * FRAME_TIME - 2 * FRAME_TIME <= target_tracker.MAX_AGE:
+        results = tracks.update(frame([], window), n * FRAME_TIME)
+        assert results['id_list'] == [1]
+        n += 1
+    assert tracks.update(frame([], window), n * FRAME_TIME)['id_list'] == []
+
+def test_detect_every_predicts_in_between():
+    tracks = target_tracker.TargetTracker(enabled=True, detect_every=3)
+    due = []
+    published = []
+    for n in range(12):
+        due.append(tracks.full_detection_due())
+        results = frame([(100 + 5 * n, 100)]) if due[-1] else frame([], detected=False)
+        results = tracks.update(results, n * FRAME_TIME)
+        published.append(dict(zip(results['id_list'], results['x_list'])))
+    assert due == [False, False, True] * 4
+    assert [list(targets) for targets in published] == [[]] * 5 + [[1]] * 7
+    # Between detections the track moves on at its estimated velocity
+    assert published[6][1] < published[7][1] < published[8][1]
+
+def test_full_detection_due_only_advances_on_update():
+    tracks = target_tracker.TargetTracker(enabled=True, detect_every=2)
+    assert [tracks.full_detection_due() for _ in range(3)] == [False] * 3
+    tracks.update(frame([], detected=False), 0)
+    assert tracks.full_detection_due()